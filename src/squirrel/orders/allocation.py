@@ -0,0 +1,204 @@
+"""
+The allocation engine decides how much each order takes from each stockpile.
+
+It works on plain lists that have been fetched from the database beforehand and returns the pillages to create,
+so the database is only touched once for reading and once for writing, no matter how many orders and stockpiles
+are involved.
+
+Which orders are filled first when there is not enough stock for all of them is decided by an allocation strategy.
+The strategy is chosen with ALLOCATION_STRATEGY in the settings.
+"""
+import heapq
+from bisect import bisect_right
+from collections import namedtuple
+from itertools import accumulate
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# An order that still needs `amount` items. Team and event are names and only used for prioritizing.
+Demand = namedtuple("Demand", ["order_id", "amount", "team", "event"])
+Demand.__new__.__defaults__ = (None, None)
+
+# A stockpile that still has `amount` items in stock
+Supply = namedtuple("Supply", ["stockpile_id", "amount"])
+
+# A pillage of `amount` items from a stockpile for an order
+Allocation = namedtuple("Allocation", ["order_id", "stockpile_id", "amount"])
+
+
+def allocate(demand, supply):
+    """
+    Splits the supply over the demand. Both are filled in the order they are given in.
+
+    Both iterables are consumed lazily, so demand that comes after the last unit of supply is never looked at.
+
+    :param demand: iterable of Demand
+    :param supply: iterable of Supply
+    :return: a list of Allocation
+    """
+    allocations = []
+
+    demand = (d for d in demand if d.amount > 0)
+    supply = (s for s in supply if s.amount > 0)
+
+    current_supply = next(supply, None)
+    available = current_supply.amount if current_supply else 0
+
+    while current_supply is not None:
+        current_demand = next(demand, None)
+        if current_demand is None:
+            break
+
+        needed = current_demand.amount
+        while needed > 0 and current_supply is not None:
+            amount = min(needed, available)
+            allocations.append(
+                Allocation(current_demand.order_id, current_supply.stockpile_id, amount)
+            )
+
+            needed -= amount
+            available -= amount
+
+            if available == 0:
+                current_supply = next(supply, None)
+                available = current_supply.amount if current_supply else 0
+
+    return allocations
+
+
+def allocate_cumulative(demand, supply):
+    """
+    Splits the supply over the demand like allocate, but for whole lists at once, e.g. when rebuilding all pillages.
+
+    Lined up one after another, order i covers the units between the cumulative sums D[i-1] and D[i] of the demand
+    and stockpile j those between S[j-1] and S[j] of the supply. Each piece between two consecutive cumulative
+    sums of either list belongs to exactly one order and one stockpile, which are found by binary search.
+
+    :param demand: list of Demand
+    :param supply: list of Supply
+    :return: a list of Allocation
+    """
+    demand = [d for d in demand if d.amount > 0]
+    supply = [s for s in supply if s.amount > 0]
+
+    demand_ends = list(accumulate(d.amount for d in demand))
+    supply_ends = list(accumulate(s.amount for s in supply))
+    if not demand_ends or not supply_ends:
+        return []
+
+    total = min(demand_ends[-1], supply_ends[-1])
+    allocations = []
+
+    start = 0
+    for end in heapq.merge(demand_ends, supply_ends):
+        end = min(end, total)
+        if end <= start:
+            continue
+
+        allocations.append(
+            Allocation(
+                demand[bisect_right(demand_ends, start)].order_id,
+                supply[bisect_right(supply_ends, start)].stockpile_id,
+                end - start,
+            )
+        )
+        start = end
+
+    return allocations
+
+
+class AllocationStrategy:
+    """
+    Base class for allocation strategies. A strategy defines a sort key for the demand, orders with the smallest
+    key are filled first.
+    """
+
+    def key(self, demand):
+        raise NotImplementedError("subclasses of AllocationStrategy must provide key()")
+
+    def order_demand(self, demand):
+        """
+        Yields the demand in the order it should be filled in.
+
+        A heap is used instead of sorting everything, as a stockpile is often used up by the first few orders.
+        """
+        heap = [(self.key(d), d) for d in demand if d.amount > 0]
+        heapq.heapify(heap)
+        while heap:
+            yield heapq.heappop(heap)[1]
+
+    def allocate(self, demand, supply):
+        """ Splits the supply over the demand in the order of this strategy """
+        return allocate(self.order_demand(demand), supply)
+
+
+class FifoStrategy(AllocationStrategy):
+    """ Oldest orders first """
+
+    def key(self, demand):
+        return demand.order_id
+
+
+class SmallestFirstStrategy(AllocationStrategy):
+    """ Smallest orders first, so as many orders as possible are complete """
+
+    def key(self, demand):
+        return demand.amount, demand.order_id
+
+
+class LargestFirstStrategy(AllocationStrategy):
+    """ Largest orders first """
+
+    def key(self, demand):
+        return -demand.amount, demand.order_id
+
+
+class PriorityStrategy(AllocationStrategy):
+    """
+    Orders of prioritized teams first, then orders of prioritized events. Teams and events are ranked by their
+    position in the given lists. Orders with the same priority are filled oldest first.
+    """
+
+    def __init__(self, teams=(), events=()):
+        self.teams = {name: rank for rank, name in enumerate(teams)}
+        self.events = {name: rank for rank, name in enumerate(events)}
+
+    def key(self, demand):
+        return (
+            self.teams.get(demand.team, len(self.teams)),
+            self.events.get(demand.event, len(self.events)),
+            demand.order_id,
+        )
+
+
+STRATEGIES = {
+    "fifo": FifoStrategy,
+    "smallest": SmallestFirstStrategy,
+    "largest": LargestFirstStrategy,
+    "priority": PriorityStrategy,
+}
+
+
+def get_strategy(name=None):
+    """
+    Returns an instance of the allocation strategy with the given name or the one configured in the settings
+
+    :raises ImproperlyConfigured: if there is no strategy with that name
+    """
+    if name is None:
+        name = settings.ALLOCATION_STRATEGY
+
+    try:
+        strategy_class = STRATEGIES[name]
+    except KeyError:
+        raise ImproperlyConfigured(
+            f"Unknown allocation strategy '{name}', use one of {', '.join(STRATEGIES)}"
+        )
+
+    if strategy_class is PriorityStrategy:
+        return PriorityStrategy(
+            teams=settings.ALLOCATION_PRIORITY_TEAMS,
+            events=settings.ALLOCATION_PRIORITY_EVENTS,
+        )
+    return strategy_class()
@@ -0,0 +1,121 @@
+"""
+Permissions and team memberships of users, cached across requests.
+
+Django's ModelBackend reads the permissions of a user once per request. CachedModelBackend keeps them in the cache
+until they change, and user_team_ids does the same for the teams a user is a member of. The receivers in models.py
+forget the cached values whenever permissions, groups or team members change, so a warm request needs no query for
+authorization.
+
+All processes have to share the cache for this, see CACHES in the settings. If CACHE_SHARED says they don't, a
+permission or membership that was revoked in one process would still work in the others, so nothing is cached across
+requests then.
+"""
+from uuid import uuid4
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core import checks
+from django.core.cache import cache
+from django.db import transaction
+
+ACCESS_VERSION_KEY = "orders:access:version"
+
+# Entries are dropped when access changes, this only limits how long entries of old versions are kept
+ACCESS_TIMEOUT = 24 * 60 * 60
+
+
+def _access_version():
+    version = cache.get(ACCESS_VERSION_KEY)
+    if version is None:
+        version = uuid4().hex
+        cache.add(ACCESS_VERSION_KEY, version, None)
+        version = cache.get(ACCESS_VERSION_KEY, version)
+    return version
+
+
+def _user_keys(user_id):
+    version = _access_version()
+    return {
+        "permissions": f"orders:access:{version}:{user_id}:permissions",
+        "teams": f"orders:access:{version}:{user_id}:teams",
+    }
+
+
+def _cached(key, compute):
+    if not settings.CACHE_SHARED:
+        return compute()
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, ACCESS_TIMEOUT)
+    return value
+
+
+def forget_users(*user_ids):
+    """
+    Drops the cached permissions and teams of the given users. It is done again after the current transaction is
+    committed, so a request that read the old state in the meantime can't put it back into the cache.
+    """
+
+    def forget():
+        cache.delete_many(
+            [key for user_id in user_ids for key in _user_keys(user_id).values()]
+        )
+
+    forget()
+    transaction.on_commit(forget)
+
+
+def forget_all_users():
+    """ Drops the cached permissions and teams of everyone, e.g. when a group changes """
+
+    def forget():
+        cache.set(ACCESS_VERSION_KEY, uuid4().hex, None)
+
+    forget()
+    transaction.on_commit(forget)
+
+
+class CachedModelBackend(ModelBackend):
+    """ The ModelBackend with the permissions of users kept in the cache """
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, "_perm_cache"):
+            user_obj._perm_cache = _cached(
+                _user_keys(user_obj.pk)["permissions"],
+                lambda: super(CachedModelBackend, self).get_all_permissions(user_obj),
+            )
+        return user_obj._perm_cache
+
+
+def user_team_ids(user):
+    """ The ids of the teams the user is a member of, as a frozenset """
+    if user.is_anonymous:
+        return frozenset()
+    if not hasattr(user, "_team_id_cache"):
+        memberships = apps.get_model("orders", "Team").members.through.objects
+        user._team_id_cache = _cached(
+            _user_keys(user.pk)["teams"],
+            lambda: frozenset(
+                memberships.filter(user_id=user.pk).values_list("team_id", flat=True)
+            ),
+        )
+    return user._team_id_cache
+
+
+@checks.register(checks.Tags.security)
+def check_cache_shared(app_configs, **kwargs):
+    if settings.CACHE_SHARED:
+        return []
+    return [
+        checks.Warning(
+            "The cache is not shared between processes, so permissions and team memberships are read for every "
+            "request and the product catalog may be outdated in other processes.",
+            hint="Use a shared cache like django.core.cache.backends.db.DatabaseCache, or set CACHE_SHARED if "
+            "there is only a single process.",
+            id="orders.W001",
+        )
+    ]
@@ -0,0 +1,108 @@
+"""
+The product catalog for autocompletion.
+
+The names of all products are kept in the cache as a sorted index, so a prefix search is a binary search and no
+query at all. The index is stored under the catalog version, which changes whenever a product is saved or deleted,
+so an outdated index is never used.
+
+Searching reads the index only the first time a term is searched for, the results are cached by term. Each process
+also keeps the index of the current version, so it is not read from the cache again for every new term.
+"""
+from bisect import bisect_left
+from hashlib import md5
+from uuid import uuid4
+
+from django.apps import apps
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = "orders:catalog:version"
+
+# Entries of old versions are never read again, this only limits how long they are kept
+CATALOG_TIMEOUT = 24 * 60 * 60
+
+# (catalog version, index) of the last index this process used
+_local_index = (None, None)
+
+
+def catalog_version():
+    """ A token that changes whenever a product changes """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = uuid4().hex
+        cache.add(CATALOG_VERSION_KEY, version, None)
+        version = cache.get(CATALOG_VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version():
+    """ Outdates everything cached for the current catalog. Called whenever a product is saved or deleted. """
+    cache.set(CATALOG_VERSION_KEY, uuid4().hex, None)
+
+
+def product_name_index():
+    """
+    All product names as a list of (lowercase name, name), sorted by the lowercase name. Built with one query
+    when the catalog has changed, taken from the cache otherwise.
+    """
+    global _local_index
+    version = catalog_version()
+    local_version, index = _local_index
+    if local_version == version:
+        return index
+
+    key = f"orders:catalog:names:{version}"
+    index = cache.get(key)
+    if index is None:
+        index = sorted(
+            (name.lower(), name)
+            for name in apps.get_model("orders", "Product").objects.values_list(
+                "name", flat=True
+            )
+        )
+        cache.set(key, index, CATALOG_TIMEOUT)
+    _local_index = (version, index)
+    return index
+
+
+def product_names():
+    """ All product names, sorted ignoring case """
+    return [name for lower, name in product_name_index()]
+
+
+def search_product_names(term, limit=20):
+    """
+    Product names that contain the term, ignoring case. Names that start with the term come first.
+
+    :return: a list of at most limit names
+    """
+    term = term.strip().lower()
+    if not term:
+        return []
+
+    # Terms are hashed, as cache keys must not contain spaces or be arbitrarily long
+    key = f"orders:catalog:search:{catalog_version()}:{limit}:{md5(term.encode()).hexdigest()}"
+    results = cache.get(key)
+    if results is None:
+        results = _search_index(product_name_index(), term, limit)
+        cache.set(key, results, CATALOG_TIMEOUT)
+    return results
+
+
+def _search_index(index, term, limit):
+    # The names starting with the term are next to each other in the sorted index
+    results = []
+    position = bisect_left(index, (term,))
+    while position < len(index) and len(results) < limit:
+        lower, name = index[position]
+        if not lower.startswith(term):
+            break
+        results.append(name)
+        position += 1
+
+    for lower, name in index:
+        if len(results) >= limit:
+            break
+        if term in lower and not lower.startswith(term):
+            results.append(name)
+
+    return results
@@ -0,0 +1,522 @@
+"""
+Exports that are streamed to the client while they are read from the database.
+
+Rows are read in chunks with everything they show joined in, so an export takes the same number of queries and
+about the same memory for any number of rows, and the first bytes are sent right away.
+"""
+import csv
+import io
+import json
+import re
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Case, F, FloatField, OuterRef, Q, Subquery, Sum, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from squirrel.orders.models import DeletedOrder, Order, Pillage
+from squirrel.orders.utilities import squirrel_round
+
+# Rows read from the database at once
+CHUNK_SIZE = 2000
+
+# Orders are identified by id, so later delta exports can be applied to a full export
+ORDER_COLUMNS = [
+    "Id",
+    "Amount",
+    "Unit",
+    "Item",
+    "Comment",
+    "State",
+    "Unit price",
+    "Total price",
+    "Event",
+    "Team",
+]
+
+PURCHASE_COLUMNS = [
+    "Id",
+    "Vendor",
+    "Ordered at",
+    "Paid",
+    "Paid at",
+    "Payment method",
+    "Payer",
+    "Prices are net",
+    "Sum net",
+    "Sum gross",
+]
+
+STOCKPILE_COLUMNS = [
+    "Id",
+    "Item",
+    "Unit",
+    "Amount",
+    "Stock",
+    "Unit price",
+    "Tax rate",
+    "Purchase",
+    "Vendor",
+]
+
+PILLAGE_COLUMNS = [
+    "Id",
+    "Amount",
+    "Automatic",
+    "Order",
+    "Item",
+    "State",
+    "Team",
+    "Event",
+    "Stockpile",
+    "Stockpile item",
+    "Unit price",
+    "Purchase",
+]
+
+# The delta export also marks deleted orders
+DELTA_COLUMNS = ORDER_COLUMNS + ["Deleted"]
+
+# Orders changed this long before the cursor are exported again, as an order saved just before the cursor was taken
+# may be committed only after the export read the table
+CURSOR_OVERLAP = timedelta(seconds=10)
+
+CURSOR_SALT = "squirrel.orders.exports.cursor"
+
+CENTS = Decimal("0.01")
+
+
+def export_cursor(timestamp):
+    """ An opaque cursor for the next delta export """
+    return signing.dumps(timestamp.isoformat(), salt=CURSOR_SALT)
+
+
+def export_since(since=None, cursor=None):
+    """
+    The time from which a delta export starts, from a cursor or an ISO 8601 timestamp. Timestamps without a time
+    zone are in the current time zone. It can't reach back further than deleted orders are kept.
+
+    :return: an aware datetime or None for a full export
+    :raises ValueError: if the cursor or the timestamp is not valid or too old
+    """
+    if cursor:
+        try:
+            since = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            raise ValueError("Invalid cursor")
+    if not since:
+        return None
+
+    timestamp = parse_datetime(since)
+    if timestamp is None:
+        raise ValueError(f"Invalid timestamp '{since}', use ISO 8601")
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    if timestamp - CURSOR_OVERLAP < DeletedOrder.kept_since():
+        raise ValueError(
+            f"{timestamp.isoformat(timespec='seconds')} is too long ago, deleted orders are only kept for "
+            f"{settings.DELETED_ORDERS_RETENTION_DAYS} days. Export all orders without since or cursor instead."
+        )
+    return timestamp
+
+
+def euros(tenth_cents):
+    """ A price in 10ths of cents as Decimal € with two decimals, rounded like the rest of Squirrel """
+    if tenth_cents is None:
+        return None
+    return (Decimal(squirrel_round(int(tenth_cents + 0.5))) / 1000).quantize(CENTS)
+
+
+def unit_euros(tenth_cents):
+    """ A unit price in 10ths of cents as Decimal € with three decimals, as it is stored """
+    if tenth_cents is None:
+        return None
+    return Decimal(tenth_cents).scaleb(-3)
+
+
+def timestamp(value):
+    """ A datetime in the current time zone as ISO 8601 """
+    if value is None:
+        return None
+    return timezone.localtime(value).isoformat(timespec="seconds")
+
+
+def pillaged_gross_price():
+    """
+    The gross price of everything an order got from stockpiles in 10ths of cents, as a subquery for Order. Prices of
+    stockpiles without a purchase count as net.
+    """
+    price = F("amount") * F("stockpile__unit_price")
+    return Subquery(
+        Pillage.objects.filter(order=OuterRef("pk"))
+        .values("order")
+        .annotate(
+            total=Sum(
+                Case(
+                    When(Q(stockpile__purchase__is_net=False), then=price),
+                    default=price * F("stockpile__tax"),
+                    output_field=FloatField(),
+                )
+            )
+        )
+        .values("total"),
+        output_field=FloatField(),
+    )
+
+
+def order_rows(orders, delta=False):
+    """
+    The orders as rows of ORDER_COLUMNS, or of DELTA_COLUMNS for a delta export. The unit price is the average gross
+    price of the pillaged units, the total price that of all of them. Both are empty while nothing has been pillaged.
+    """
+    states = dict(Order.STATE_CHOICES)
+    rows = (
+        orders.annotate(total_price=pillaged_gross_price())
+        .order_by("pk")
+        .values_list(
+            "pk",
+            "amount",
+            "product__unit",
+            "product__name",
+            "comment",
+            "state",
+            "pillaged_amount",
+            "total_price",
+            "event__name",
+            "team__name",
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for pk, amount, unit, product, comment, state, pillaged, total, event, team in rows:
+        row = [
+            pk,
+            amount,
+            unit,
+            product,
+            comment,
+            states.get(state, state),
+            euros(total / pillaged) if pillaged and total is not None else None,
+            euros(total),
+            event,
+            team,
+        ]
+        yield row + [None] if delta else row
+
+
+def deleted_order_rows(deleted_orders):
+    """ DeletedOrders as rows of DELTA_COLUMNS """
+    empty = [None] * (len(ORDER_COLUMNS) - 1)
+    for order_id in (
+        deleted_orders.order_by("pk")
+        .values_list("order_id", flat=True)
+        .iterator(chunk_size=CHUNK_SIZE)
+    ):
+        yield [order_id] + empty + [True]
+
+
+def purchase_rows(purchases):
+    """ Purchases as rows of PURCHASE_COLUMNS, with the totals Stockpile keeps on them """
+    rows = (
+        purchases.order_by("pk")
+        .values_list(
+            "pk",
+            "vendor__name",
+            "ordered_at",
+            "paid",
+            "paid_at",
+            "payment_method",
+            "payer",
+            "is_net",
+            "total_net",
+            "total_gross",
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for (
+        pk,
+        vendor,
+        ordered_at,
+        paid,
+        paid_at,
+        method,
+        payer,
+        is_net,
+        net,
+        gross,
+    ) in rows:
+        yield [
+            pk,
+            vendor,
+            timestamp(ordered_at),
+            paid,
+            timestamp(paid_at),
+            method,
+            payer,
+            is_net,
+            euros(net),
+            euros(gross),
+        ]
+
+
+def stockpile_rows(stockpiles):
+    """ Stockpiles as rows of STOCKPILE_COLUMNS, with what is left of them """
+    rows = (
+        stockpiles.annotate(remaining_stock=F("amount") - F("pillaged_amount"))
+        .order_by("pk")
+        .values_list(
+            "pk",
+            "product__name",
+            "product__unit",
+            "amount",
+            "remaining_stock",
+            "unit_price",
+            "tax",
+            "purchase_id",
+            "purchase__vendor__name",
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for pk, product, unit, amount, stock, unit_price, tax, purchase, vendor in rows:
+        yield [
+            pk,
+            product,
+            unit,
+            amount,
+            stock,
+            unit_euros(unit_price),
+            tax,
+            purchase,
+            vendor,
+        ]
+
+
+def pillage_rows(pillages):
+    """ Pillages as rows of PILLAGE_COLUMNS, with their order and stockpile """
+    states = dict(Order.STATE_CHOICES)
+    rows = (
+        pillages.order_by("pk")
+        .values_list(
+            "pk",
+            "amount",
+            "automatic",
+            "order_id",
+            "order__product__name",
+            "order__state",
+            "order__team__name",
+            "order__event__name",
+            "stockpile_id",
+            "stockpile__product__name",
+            "stockpile__unit_price",
+            "stockpile__purchase_id",
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for row in rows:
+        (
+            *head,
+            state,
+            team,
+            event,
+            stockpile,
+            stockpile_product,
+            unit_price,
+            purchase,
+        ) = row
+        yield head + [
+            states.get(state, state),
+            team,
+            event,
+            stockpile,
+            stockpile_product,
+            unit_euros(unit_price),
+            purchase,
+        ]
+
+
+def _chunks(header, lines, rows_per_chunk):
+    """ Joins lines into chunks of rows_per_chunk lines, the header is a chunk of its own """
+    yield header
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == rows_per_chunk:
+            yield "".join(chunk)
+            chunk = []
+    yield "".join(chunk)
+
+
+def stream_csv(columns, rows, rows_per_chunk=500):
+    """
+    Writes the rows as CSV and yields it in chunks of rows_per_chunk rows. The header is yielded on its own, so it
+    is sent before the first rows are read. Booleans are written as yes and no.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(row):
+        writer.writerow(
+            _CSV_BOOLEANS.get(value, value) if isinstance(value, bool) else value
+            for value in row
+        )
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    return _chunks(line(columns), map(line, rows), rows_per_chunk)
+
+
+_CSV_BOOLEANS = {True: "yes", False: "no"}
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} can not be exported as JSON")
+
+
+def stream_jsonl(columns, rows, rows_per_chunk=500):
+    """
+    Writes the rows as JSON Lines, one object per row with the columns in snake case as keys, e.g. unit_price.
+    Empty values are null.
+    """
+    keys = [column.lower().replace(" ", "_") for column in columns]
+
+    def line(row):
+        return (
+            json.dumps(dict(zip(keys, row)), ensure_ascii=False, default=_json_value)
+            + "\n"
+        )
+
+    return _chunks("", map(line, rows), rows_per_chunk)
+
+
+def _column_letters(number):
+    """ A, B, …, Z, AA, … for the column number, counted from 0 """
+    letters = ""
+    number += 1
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+# XML 1.0 has no way to write most control characters
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+def _xlsx_cell(reference, value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{reference}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c r="{reference}"><v>{value}</v></c>'
+    text = escape(_XML_INVALID.sub("", str(value)))
+    return f'<c r="{reference}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(number, letters, row):
+    cells = "".join(
+        _xlsx_cell(f"{column}{number}", value) for column, value in zip(letters, row)
+    )
+    return f'<row r="{number}">{cells}</row>'
+
+
+_XLSX_NAMESPACE = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_XLSX_RELATIONSHIPS = (
+    "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+)
+_XLSX_PACKAGE_RELATIONSHIPS = (
+    "http://schemas.openxmlformats.org/package/2006/relationships"
+)
+_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# Everything in a workbook with a single sheet but the sheet itself
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        f'<Relationships xmlns="{_XLSX_PACKAGE_RELATIONSHIPS}">'
+        f'<Relationship Id="rId1" Type="{_XLSX_RELATIONSHIPS}/officeDocument" Target="xl/workbook.xml"/>'
+        "</Relationships>"
+    ),
+    "xl/workbook.xml": (
+        f'<workbook xmlns="{_XLSX_NAMESPACE}" xmlns:r="{_XLSX_RELATIONSHIPS}">'
+        '<sheets><sheet name="Squirrel" sheetId="1" r:id="rId1"/></sheets>'
+        "</workbook>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        f'<Relationships xmlns="{_XLSX_PACKAGE_RELATIONSHIPS}">'
+        f'<Relationship Id="rId1" Type="{_XLSX_RELATIONSHIPS}/worksheet" Target="worksheets/sheet1.xml"/>'
+        "</Relationships>"
+    ),
+}
+
+
+class _Pipe(io.RawIOBase):
+    """ A file that keeps what is written to it until it is taken, it can't seek """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_xlsx(columns, rows, rows_per_chunk=500):
+    """
+    Writes the rows as an Excel workbook with a single sheet and yields it in chunks while it is written. The zip
+    file is written front to back without seeking and strings are stored in their cells instead of a table of all
+    strings, so only the current chunk is kept in memory.
+    """
+    letters = [_column_letters(number) for number in range(len(columns))]
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, "w", compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, xml in _XLSX_PARTS.items():
+            workbook.writestr(name, _XML_DECLARATION + xml)
+        with workbook.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write(
+                f'{_XML_DECLARATION}<worksheet xmlns="{_XLSX_NAMESPACE}"><sheetData>'.encode()
+            )
+            sheet.write(_xlsx_row(1, letters, columns).encode())
+            yield pipe.take()
+            for number, row in enumerate(rows, 2):
+                sheet.write(_xlsx_row(number, letters, row).encode())
+                if number % rows_per_chunk == 0:
+                    yield pipe.take()
+            sheet.write(b"</sheetData></worksheet>")
+    yield pipe.take()
+
+
+# format: (writer, content type)
+EXPORT_FORMATS = {
+    "csv": (stream_csv, "text/csv"),
+    "jsonl": (stream_jsonl, "application/x-ndjson"),
+    "xlsx": (
+        stream_xlsx,
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ),
+}
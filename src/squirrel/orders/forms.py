@@ -2,7 +2,12 @@ from crispy_forms.bootstrap import Field
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Fieldset, Layout, Submit
 from django import forms
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.forms import ChoiceField, ModelChoiceField, inlineformset_factory
+from django.urls import reverse_lazy
+from squirrel.orders.backends import user_team_ids
+from squirrel.orders.catalog import catalog_version, product_names
 from squirrel.orders.models import (
     Event,
     Order,
@@ -13,7 +18,7 @@ from squirrel.orders.models import (
     Team,
     Vendor,
 )
-from squirrel.orders.widgets import TextInput
+from squirrel.orders.widgets import AutocompleteInput, TextInput
 
 
 class OrderForm(forms.ModelForm):
@@ -30,10 +35,17 @@ class OrderForm(forms.ModelForm):
             Submit("submit", "Save order", css_class="btn-success"),
         )
 
+        if settings.PRODUCT_AUTOCOMPLETE:
+            product_widget = AutocompleteInput(url=reverse_lazy("product_autocomplete"))
+        else:
+            product_widget = TextInput(
+                datalist=product_names, datalist_version=catalog_version
+            )
+
         self.fields["product"] = ModelChoiceField(
             queryset=Product.objects.all().order_by("name"),
             to_field_name="name",
-            widget=TextInput(datalist=[p.name for p in Product.objects.all()]),
+            widget=product_widget,
         )
 
         self.fields[
@@ -62,6 +74,61 @@ class OrderForm(forms.ModelForm):
         }
 
 
+class OrderFilterForm(forms.Form):
+    """ Filters for the order list. Every field is optional, the filters that are set are combined. """
+
+    state = ChoiceField(
+        choices=[("", "All states")] + Order.STATE_CHOICES, required=False
+    )
+    team = ModelChoiceField(
+        queryset=Team.objects.order_by("name"), required=False, empty_label="All teams"
+    )
+    event = ModelChoiceField(
+        queryset=Event.objects.order_by("-id"), required=False, empty_label="All events"
+    )
+    product = ModelChoiceField(
+        queryset=Product.objects.all(),
+        to_field_name="name",
+        required=False,
+        widget=forms.TextInput(attrs={"placeholder": "Product"}),
+    )
+    created_by = ModelChoiceField(
+        queryset=User.objects.order_by("username"),
+        required=False,
+        empty_label="All creators",
+    )
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop("user", None)
+        super().__init__(*args, **kwargs)
+
+        # Who can only see the orders of their teams only gets to choose from their teams
+        if user is not None and not user.has_perm("orders.view_order"):
+            self.fields["team"].queryset = Team.objects.filter(
+                pk__in=user_team_ids(user)
+            ).order_by("name")
+            del self.fields["created_by"]
+
+        self.helper = FormHelper(self)
+        self.helper.form_method = "get"
+        self.helper.form_class = "form-inline mb-3"
+        self.helper.field_template = "bootstrap4/layout/inline_field.html"
+        self.helper.add_input(Submit("filter", "Filter", css_class="btn-secondary"))
+
+    def filter(self, orders):
+        """
+        Filters a queryset of orders by the filters that are set. If a filter is invalid, e.g. an unknown product,
+        no orders are found and the form shows the error, rather than the filter being dropped.
+        """
+        if not self.is_bound:
+            return orders
+        if not self.is_valid():
+            return orders.none()
+
+        filters = {name: value for name, value in self.cleaned_data.items() if value}
+        return orders.filter(**filters)
+
+
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
@@ -0,0 +1,89 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from squirrel.orders.allocation import (
+    STRATEGIES,
+    Demand,
+    PriorityStrategy,
+    Supply,
+    get_strategy,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the allocation strategies on a synthetic dataset. Nothing is read from or written to the "
+        "database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=10000)
+        parser.add_argument("--stockpiles", type=int, default=500)
+        parser.add_argument("--teams", type=int, default=30)
+        parser.add_argument("--events", type=int, default=3)
+        parser.add_argument(
+            "--supply-ratio",
+            type=float,
+            default=0.7,
+            help="How much stock there is in relation to the ordered amount",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["orders"] < 1:
+            raise CommandError("There has to be at least one order to compare.")
+
+        rng = random.Random(options["seed"])
+        teams = [f"Team {i}" for i in range(options["teams"])]
+        events = [f"Event {i}" for i in range(options["events"])]
+
+        demand = [
+            Demand(
+                order_id,
+                rng.choice((1, 1, 1, 2, 5, 10, 50, 200)),
+                rng.choice(teams),
+                rng.choice(events),
+            )
+            for order_id in range(1, options["orders"] + 1)
+        ]
+
+        total_stock = int(sum(d.amount for d in demand) * options["supply_ratio"])
+        stockpiles = max(options["stockpiles"], 1)
+        supply = [
+            Supply(stockpile_id, total_stock // stockpiles)
+            for stockpile_id in range(1, stockpiles + 1)
+        ]
+
+        demanded = sum(d.amount for d in demand)
+        self.stdout.write(
+            f"{len(demand)} orders for {demanded} items, "
+            f"{len(supply)} stockpiles with {sum(s.amount for s in supply)} items"
+        )
+        # The fill rate is the share of the ordered items that were allocated, complete % that of the orders
+        self.stdout.write(
+            f"{'strategy':<10} {'time (ms)':>10} {'pillages':>9} {'complete orders':>16} {'complete %':>11} "
+            f"{'fill rate':>10}"
+        )
+
+        for name in STRATEGIES:
+            if name == "priority":
+                strategy = PriorityStrategy(teams=teams[:3], events=events[:1])
+            else:
+                strategy = get_strategy(name)
+
+            start = time.perf_counter()
+            allocations = strategy.allocate(demand, supply)
+            elapsed = (time.perf_counter() - start) * 1000
+
+            filled = {}
+            for a in allocations:
+                filled[a.order_id] = filled.get(a.order_id, 0) + a.amount
+            complete = sum(1 for d in demand if filled.get(d.order_id, 0) == d.amount)
+
+            allocated = sum(filled.values())
+
+            self.stdout.write(
+                f"{name:<10} {elapsed:>10.2f} {len(allocations):>9} {complete:>16} "
+                f"{complete / len(demand):>11.1%} {allocated / demanded:>10.1%}"
+            )
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from squirrel.orders.models import Order, Stockpile
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks that the pillaged_amount counters of orders and stockpiles match the sum of their pillages "
+        "and optionally repairs them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Set all wrong counters to the sum of their pillages",
+        )
+
+    def handle(self, *args, **options):
+        inconsistent = 0
+
+        with transaction.atomic():
+            for model in (Order, Stockpile):
+                mismatches = (
+                    model.objects.annotate(actual=Coalesce(Sum("pillage__amount"), 0))
+                    .exclude(pillaged_amount=F("actual"))
+                    .values_list("pk", "pillaged_amount", "actual")
+                )
+
+                for pk, counted, actual in list(mismatches):
+                    inconsistent += 1
+                    self.stdout.write(
+                        f"{model.__name__} {pk}: counter is {counted}, pillages sum up to {actual}"
+                    )
+                    if options["repair"]:
+                        model.objects.filter(pk=pk).update(pillaged_amount=actual)
+
+        if inconsistent == 0:
+            self.stdout.write(self.style.SUCCESS("All counters are consistent."))
+        elif options["repair"]:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {inconsistent} counters."))
+        else:
+            raise CommandError(
+                f"Found {inconsistent} inconsistent counters. Run with --repair to fix them."
+            )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from squirrel.orders.models import DeletedOrder
+
+
+class Command(BaseCommand):
+    help = (
+        "Removes the records of orders deleted longer ago than DELETED_ORDERS_RETENTION_DAYS. Run it regularly, "
+        "e.g. daily from cron."
+    )
+
+    def handle(self, *args, **options):
+        removed = DeletedOrder.prune()
+        self.stdout.write(
+            self.style.SUCCESS(f"Removed {removed} records of deleted orders.")
+        )
@@ -0,0 +1,134 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from squirrel.orders.allocation import Demand, Supply, allocate_cumulative, get_strategy
+from squirrel.orders.models import (
+    Event,
+    Order,
+    Pillage,
+    Product,
+    Stockpile,
+    create_pillages,
+    lock_product,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Removes all automatically created pillages and allocates the stock to the orders again. "
+        "Pillages that were entered by hand are kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--product", help="Only reallocate the product with this name"
+        )
+        parser.add_argument(
+            "--event", help="Only reallocate orders of the event with this name"
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only show what would change, do not write anything",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="How many pillages are inserted per query",
+        )
+
+    def handle(self, *args, **options):
+        orders = Order.objects.exclude(product=None)
+        stockpiles = Stockpile.objects.all()
+
+        if options["product"]:
+            try:
+                product = Product.objects.get(name=options["product"])
+            except Product.DoesNotExist:
+                raise CommandError(f"There is no product '{options['product']}'.")
+            orders = orders.filter(product=product)
+            stockpiles = stockpiles.filter(product=product)
+
+        if options["event"]:
+            try:
+                event = Event.objects.get(name=options["event"])
+            except Event.DoesNotExist:
+                raise CommandError(f"There is no event '{options['event']}'.")
+            orders = orders.filter(event=event)
+
+        with transaction.atomic():
+            product_ids = set(orders.values_list("product_id", flat=True).distinct())
+            for product_id in sorted(product_ids):
+                lock_product(product_id)
+
+            stockpiles = stockpiles.filter(product_id__in=product_ids)
+            wiped = Pillage.objects.filter(automatic=True, order__in=orders)
+
+            # Read everything once, then calculate as if the automatic pillages were gone already
+            freed_orders = defaultdict(int)
+            freed_stockpiles = defaultdict(int)
+            wiped_count = 0
+            for order_id, stockpile_id, amount in wiped.values_list(
+                "order_id", "stockpile_id", "amount"
+            ).iterator():
+                freed_orders[order_id] += amount
+                freed_stockpiles[stockpile_id] += amount
+                wiped_count += 1
+
+            demand = defaultdict(list)
+            for (
+                pk,
+                product_id,
+                amount,
+                pillaged,
+                team,
+                event_name,
+            ) in orders.values_list(
+                "id",
+                "product_id",
+                "amount",
+                "pillaged_amount",
+                "team__name",
+                "event__name",
+            ).iterator():
+                pillaged -= freed_orders[pk]
+                demand[product_id].append(
+                    Demand(pk, amount - pillaged, team, event_name)
+                )
+
+            supply = defaultdict(list)
+            for pk, product_id, amount, pillaged in (
+                stockpiles.order_by("id")
+                .values_list("id", "product_id", "amount", "pillaged_amount")
+                .iterator()
+            ):
+                pillaged -= freed_stockpiles[pk]
+                supply[product_id].append(Supply(pk, amount - pillaged))
+
+            strategy = get_strategy()
+            allocations = []
+            for product_id in product_ids:
+                allocations.extend(
+                    allocate_cumulative(
+                        list(strategy.order_demand(demand[product_id])),
+                        supply[product_id],
+                    )
+                )
+
+            self.stdout.write(
+                f"{len(product_ids)} products: removing {wiped_count} automatic pillages "
+                f"of {sum(freed_orders.values())} items, creating {len(allocations)} pillages "
+                f"of {sum(a.amount for a in allocations)} items."
+            )
+
+            if options["dry_run"]:
+                self.stdout.write("Dry run, nothing was changed.")
+                transaction.set_rollback(True)
+                return
+
+            wiped.delete()
+            create_pillages(allocations, batch_size=options["batch_size"])
+
+        self.stdout.write(self.style.SUCCESS("Reallocation complete."))
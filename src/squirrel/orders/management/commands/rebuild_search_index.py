@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from squirrel.orders.search import install_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text index of products, order comments and vendors"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="The database to rebuild the index of",
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+
+        with transaction.atomic(using=options["database"]):
+            # Also brings back triggers that went missing
+            if install_search_index(connection) and rebuild_search_index(connection):
+                self.stdout.write(self.style.SUCCESS("Rebuilt the search index."))
+            else:
+                self.stdout.write(
+                    "This database has no full-text index, searching uses LIKE queries."
+                )
@@ -0,0 +1,42 @@
+# Generated by Django 3.0.7 on 2026-10-18 02:57
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_pillaged_amounts(apps, schema_editor):
+    """ Initialize the counters from the existing pillages """
+    Order = apps.get_model("orders", "Order")
+    Stockpile = apps.get_model("orders", "Stockpile")
+    Pillage = apps.get_model("orders", "Pillage")
+
+    for model, field in ((Order, "order"), (Stockpile, "stockpile")):
+        pillaged = (
+            Pillage.objects.filter(**{field: OuterRef("pk")})
+            .values(field)
+            .annotate(total=Sum("amount"))
+            .values("total")
+        )
+        model.objects.update(pillaged_amount=Coalesce(Subquery(pillaged), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0004_product_order"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="pillaged_amount",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="stockpile",
+            name="pillaged_amount",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_pillaged_amounts, migrations.RunPython.noop),
+    ]
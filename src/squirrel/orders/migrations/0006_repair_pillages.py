@@ -0,0 +1,58 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:09
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def repair_existing_data(apps, schema_editor):
+    """
+    Existing data has to satisfy the new constraints. Pillages between different products are removed, pillages
+    that exceed their order or stockpile are shrunk, the oldest pillages are kept. Then all counters are recounted.
+    """
+    Order = apps.get_model("orders", "Order")
+    Stockpile = apps.get_model("orders", "Stockpile")
+    Pillage = apps.get_model("orders", "Pillage")
+
+    order_left = dict(Order.objects.values_list("id", "amount"))
+    stockpile_left = dict(Stockpile.objects.values_list("id", "amount"))
+
+    for pillage in Pillage.objects.select_related("order", "stockpile").order_by("id"):
+        if pillage.order.product_id != pillage.stockpile.product_id:
+            keep = 0
+        else:
+            keep = min(
+                pillage.amount,
+                order_left[pillage.order_id],
+                stockpile_left[pillage.stockpile_id],
+            )
+
+        if keep == 0:
+            pillage.delete()
+            continue
+        if keep < pillage.amount:
+            pillage.amount = keep
+            pillage.save()
+
+        order_left[pillage.order_id] -= keep
+        stockpile_left[pillage.stockpile_id] -= keep
+
+    for model, field in ((Order, "order"), (Stockpile, "stockpile")):
+        pillaged = (
+            Pillage.objects.filter(**{field: OuterRef("pk")})
+            .values(field)
+            .annotate(total=Sum("amount"))
+            .values("total")
+        )
+        model.objects.update(pillaged_amount=Coalesce(Subquery(pillaged), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0005_pillaged_amount"),
+    ]
+
+    operations = [
+        migrations.RunPython(repair_existing_data, migrations.RunPython.noop),
+    ]
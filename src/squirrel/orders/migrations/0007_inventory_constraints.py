@@ -0,0 +1,48 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:09
+
+import django.db.models.expressions
+from django.db import migrations, models
+from squirrel.orders.triggers import install_triggers, uninstall_triggers
+
+
+def create_triggers(apps, schema_editor):
+    install_triggers(schema_editor.connection)
+
+
+def drop_triggers(apps, schema_editor):
+    uninstall_triggers(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0006_repair_pillages"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="order",
+            constraint=models.CheckConstraint(
+                check=models.Q(
+                    pillaged_amount__lte=django.db.models.expressions.F("amount")
+                ),
+                name="order_pillaged_amount_lte_amount",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="pillage",
+            constraint=models.CheckConstraint(
+                check=models.Q(amount__gte=1), name="pillage_amount_gte_1"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="stockpile",
+            constraint=models.CheckConstraint(
+                check=models.Q(
+                    pillaged_amount__lte=django.db.models.expressions.F("amount")
+                ),
+                name="stockpile_pillaged_amount_lte_amount",
+            ),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
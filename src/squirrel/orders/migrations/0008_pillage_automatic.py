@@ -0,0 +1,18 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0007_inventory_constraints"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pillage",
+            name="automatic",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
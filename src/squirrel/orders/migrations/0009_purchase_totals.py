@@ -0,0 +1,44 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:23
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from squirrel.orders.utilities import line_totals
+
+
+def compute_totals(apps, schema_editor):
+    """ Initialize the totals from the existing stockpiles """
+    Purchase = apps.get_model("orders", "Purchase")
+    Stockpile = apps.get_model("orders", "Stockpile")
+
+    totals = defaultdict(lambda: [0, 0])
+    for purchase_id, is_net, amount, unit_price, tax in Stockpile.objects.filter(
+        purchase__isnull=False
+    ).values_list("purchase_id", "purchase__is_net", "amount", "unit_price", "tax"):
+        net, gross = line_totals(amount, unit_price, tax, is_net)
+        totals[purchase_id][0] += net
+        totals[purchase_id][1] += gross
+
+    for purchase_id, (net, gross) in totals.items():
+        Purchase.objects.filter(pk=purchase_id).update(total_net=net, total_gross=gross)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0008_pillage_automatic"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="purchase",
+            name="total_gross",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="purchase",
+            name="total_net",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_totals, migrations.RunPython.noop),
+    ]
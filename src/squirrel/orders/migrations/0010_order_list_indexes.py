@@ -0,0 +1,27 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0009_purchase_totals"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["state", "event"], name="order_state_event_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["team", "state"], name="order_team_state_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["product", "state"], name="order_product_state_idx"
+            ),
+        ),
+    ]
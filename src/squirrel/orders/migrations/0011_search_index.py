@@ -0,0 +1,26 @@
+from django.db import migrations
+from squirrel.orders.search import (
+    install_search_index,
+    rebuild_search_index,
+    uninstall_search_index,
+)
+
+
+def create_search_index(apps, schema_editor):
+    if install_search_index(schema_editor.connection):
+        rebuild_search_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    uninstall_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0010_order_list_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
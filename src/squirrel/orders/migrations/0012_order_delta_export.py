@@ -0,0 +1,42 @@
+# Generated by Django 3.0.7 on 2026-10-18 04:02
+
+from django.db import migrations, models
+from squirrel.orders.triggers import install_triggers, uninstall_triggers
+
+
+def replace_triggers(apps, schema_editor):
+    """ The counter triggers now also set updated_at of orders, existing ones are not replaced by installing """
+    uninstall_triggers(schema_editor.connection)
+    install_triggers(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0011_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeletedOrder",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("order_id", models.PositiveIntegerField()),
+                ("team_id", models.PositiveIntegerField()),
+                ("deleted_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["updated_at"], name="order_updated_at_idx"),
+        ),
+        migrations.RunPython(replace_triggers, replace_triggers),
+    ]
@@ -1,27 +1,176 @@
 """
 Models for our orders
 """
-from django.contrib.auth.models import User
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission, User
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import F, FloatField, Sum
+from django.db import IntegrityError, connection, connections, models, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
+from django.dispatch import receiver
 from django.utils import timezone
-from squirrel.orders.utilities import squirrel_round
+from squirrel.orders.allocation import Demand, Supply, allocate, get_strategy
+from squirrel.orders.backends import forget_all_users, forget_users
+from squirrel.orders.catalog import bump_catalog_version
+from squirrel.orders.search import install_search_index
+from squirrel.orders.triggers import database_maintains_counters, install_triggers
+from squirrel.orders.utilities import line_totals, squirrel_round
+
+
+def _counter_safe_save_kwargs(instance, kwargs, counters=("pillaged_amount",)):
+    """
+    Counters like pillaged_amount are only ever changed with relative updates. A plain save of an existing
+    instance would write back whatever counter value was loaded with it, so we leave the counters out of the
+    UPDATE unless the caller asked for specific fields.
+    """
+    if (
+        instance.pk is None
+        or instance._state.adding
+        or kwargs.get("force_insert")
+        or kwargs.get("update_fields") is not None
+    ):
+        return kwargs
+
+    kwargs["update_fields"] = [
+        f.name
+        for f in instance._meta.concrete_fields
+        if not f.primary_key and f.name not in counters
+    ]
+    return kwargs
+
+
+def lock_product(*product_ids):
+    """
+    Serializes all allocation for the given products until the end of the current transaction.
+
+    Databases with row locks lock the rows of the products with SELECT ... FOR UPDATE, always in the same order so
+    two transactions can't wait for each other. SQLite has no row locks, so we write to the rows instead: this
+    takes the write lock of the database, which other writers wait for. The written column has no triggers, so the
+    search index is not touched.
+    """
+    product_ids = sorted(pk for pk in product_ids if pk is not None)
+    if not product_ids:
+        return
+
+    products = Product.objects.filter(pk__in=product_ids)
+    if connection.features.has_select_for_update:
+        list(products.order_by("pk").select_for_update().values_list("pk", flat=True))
+    else:
+        products.update(default_price=F("default_price"))
+
+
+def _touch_orders(**filters):
+    """
+    Marks the orders matching the filters as changed with a single UPDATE, for what the delta export shows of them
+    but is stored elsewhere, like the names of their product or the prices of their stockpiles
+    """
+    Order.objects.filter(**filters).update(updated_at=timezone.now())
+
+
+class TrackedModel(models.Model):
+    """
+    Remembers the values of the fields in tracked_fields as they were loaded from the database or last saved, so
+    we can tell what changed without reading the row again. Relations are tracked by their ids, so they are never
+    loaded for this. Tracked fields that were deferred are read from the row when they are first asked for, as
+    they may have been set since.
+    """
+
+    tracked_fields = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_tracked_values()
+        return instance
 
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self._remember_tracked_values(fields)
 
-class Event(models.Model):
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._remember_tracked_values()
+
+    def _remember_tracked_values(self, fields=None):
+        values = self.__dict__.setdefault("_tracked_values", {})
+        deferred = self.get_deferred_fields()
+        for field in self._meta.concrete_fields:
+            if field.attname not in self.tracked_fields or field.attname in deferred:
+                continue
+            if fields is None or field.attname in fields or field.name in fields:
+                values[field.attname] = getattr(self, field.attname)
+
+    def _tracked_values_with_deferred(self):
+        values = self.__dict__.get("_tracked_values")
+        if values is None:
+            return None
+        missing = [attname for attname in self.tracked_fields if attname not in values]
+        if missing:
+            values.update(
+                type(self)
+                ._base_manager.using(self._state.db)
+                .filter(pk=self.pk)
+                .values(*missing)
+                .get()
+            )
+        return values
+
+    @property
+    def stored_values(self):
+        """ The tracked fields as loaded or last saved, None if the instance has not been saved yet """
+        values = self._tracked_values_with_deferred()
+        return dict(values) if values is not None else None
+
+    def has_changed(self, attname):
+        """ Whether a tracked field is different from the value in the database """
+        values = self._tracked_values_with_deferred()
+        return values is not None and values[attname] != getattr(self, attname)
+
+
+class ShownOnOrders(TrackedModel):
+    """
+    A model the order export shows fields of. Changing them marks the orders referencing it in order_field as
+    changed, so the delta export picks them up.
+    """
+
+    tracked_fields = ("name",)
+    order_field = None
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            changed = any(self.has_changed(attname) for attname in self.tracked_fields)
+            super().save(*args, **kwargs)
+            if changed:
+                _touch_orders(**{self.order_field: self.pk})
+
+
+class Event(ShownOnOrders):
     """An event for which orders can be made"""
 
+    order_field = "event_id"
+
     name = models.CharField(max_length=50, unique=True, default=None)
 
     def __str__(self):
         return self.name
 
 
-class Team(models.Model):
+class Team(ShownOnOrders):
     """A team or similar group that orders things"""
 
+    order_field = "team_id"
+
     class Meta:
         permissions = [("view_budget", "Can view budget")]
 
@@ -32,6 +181,43 @@ class Team(models.Model):
         return self.name
 
 
+@receiver(m2m_changed, sender=Team.members.through)
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_access_changed(sender, instance, action, pk_set, **kwargs):
+    """ Forgets the cached permissions and teams of users that joined or left a team or group or got permissions """
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if isinstance(instance, User):
+        forget_users(instance.pk)
+    elif action == "post_clear":
+        # The users that were removed are not known anymore
+        forget_all_users()
+    else:
+        forget_users(*pk_set)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        forget_all_users()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """ Superusers and inactive users have different permissions """
+    forget_users(instance.pk)
+
+
+@receiver(post_delete, sender=Team)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def access_deleted(sender, **kwargs):
+    """ Memberships and permissions are deleted with them without any m2m_changed signal """
+    forget_all_users()
+
+
 class Vendor(models.Model):
     """A vendor"""
 
@@ -41,9 +227,12 @@ class Vendor(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(ShownOnOrders):
     """A product that can be ordered"""
 
+    tracked_fields = ("name", "unit")
+    order_field = "product_id"
+
     class Meta:
         ordering = ["name"]
 
@@ -57,7 +246,15 @@ class Product(models.Model):
         return self.name
 
 
-class Purchase(models.Model):
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, **kwargs):
+    bump_catalog_version()
+
+
+class Purchase(TrackedModel):
+    tracked_fields = ("is_net",)
+
     is_net = models.BooleanField(verbose_name="Prices are net", default=True,)
     paid = models.BooleanField(help_text="Is the purchase paid?", default=False)
     payment_method = models.CharField(max_length=255, blank=True)
@@ -69,57 +266,63 @@ class Purchase(models.Model):
     ordered_at = models.DateTimeField(default=timezone.now)
     paid_at = models.DateTimeField(blank=True, null=True)
 
+    # Net and gross totals of the stockpiles in 10ths of cents, maintained by Stockpile. Each stockpile is added
+    # rounded to whole 10ths of cents (see line_totals), sum_net and sum_gross round the sum to cents. Summing the
+    # exact prices first could differ by a cent on purchases with many stockpiles.
+    total_net = models.BigIntegerField(default=0, editable=False)
+    total_gross = models.BigIntegerField(default=0, editable=False)
+
     @property
     def sum_net(self):
         """ The sum of the purchase in €, net """
-        if self.is_net:
-            return squirrel_round(self.__sum_without_tax_adjustment()) / 1000
-
-        # Sum over all purchase sums, for each purchase divide by its tax
-        return (
-            squirrel_round(
-                Stockpile.objects.filter(purchase=self).aggregate(
-                    total=Sum(
-                        F("amount") * F("unit_price") / F("tax"),
-                        output_field=FloatField(),
-                    )
-                )["total"]
-            )
-            / 1000
-        )
+        return squirrel_round(self.total_net) / 1000
 
     @property
     def sum_gross(self):
         """ The sum of the purchase in €, gross"""
-        if self.is_net:
-            # Sum over all purchase sums, for each purchase multiply with its tax
-            return (
-                squirrel_round(
-                    Stockpile.objects.filter(purchase=self).aggregate(
-                        total=Sum(
-                            F("amount") * F("unit_price") * F("tax"),
-                            output_field=FloatField(),
-                        )
-                    )["total"]
-                )
-                / 1000
-            )
-
-        return squirrel_round(self.__sum_without_tax_adjustment()) / 1000
+        return squirrel_round(self.total_gross) / 1000
 
-    def __sum_without_tax_adjustment(self):
-        """ Returns the sum of all stockpiles without adding or subtracting tax """
-        return Stockpile.objects.filter(purchase=self).aggregate(
-            total=Sum(F("amount") * F("unit_price"))
-        )["total"]
+    def save(self, *args, **kwargs):
+        """
+        The totals are kept up to date by the stockpiles. Only if the prices switch between net and gross, they are
+        computed again from all stockpiles.
+        """
+        with transaction.atomic():
+            is_net_changed = self.has_changed("is_net")
+            super().save(
+                *args,
+                **_counter_safe_save_kwargs(
+                    self, kwargs, counters=("total_net", "total_gross")
+                ),
+            )
+            if is_net_changed:
+                self.update_totals()
+                # The gross prices of the orders pillaging this purchase change
+                _touch_orders(pillage__stockpile__purchase_id=self.pk)
+
+    def update_totals(self):
+        """ Computes the totals again from all stockpiles of this purchase """
+        self.total_net = self.total_gross = 0
+        for line in Stockpile.objects.filter(purchase=self).values_list(
+            "amount", "unit_price", "tax"
+        ):
+            net, gross = line_totals(*line, self.is_net)
+            self.total_net += net
+            self.total_gross += gross
+
+        Purchase.objects.filter(pk=self.pk).update(
+            total_net=self.total_net, total_gross=self.total_gross
+        )
 
     def __str__(self):
         return "Purchase with {} @ {}".format(self.vendor, self.ordered_at.date())
 
 
-class Order(models.Model):
+class Order(TrackedModel):
     """A single order. Orders are always referenced to a team"""
 
+    tracked_fields = ("product_id",)
+
     class Meta:
         permissions = [
             ("request_order", "Can request a order"),
@@ -132,6 +335,20 @@ class Order(models.Model):
             ("change_order_all_teams", "Can change orders for all teams"),
             ("delete_order_all_teams", "Can delete orders for all teams"),
         ]
+        constraints = [
+            models.CheckConstraint(
+                check=Q(pillaged_amount__lte=F("amount")),
+                name="order_pillaged_amount_lte_amount",
+            )
+        ]
+        # For the filters of the order list
+        indexes = [
+            models.Index(fields=["state", "event"], name="order_state_event_idx"),
+            models.Index(fields=["team", "state"], name="order_team_state_idx"),
+            models.Index(fields=["product", "state"], name="order_product_state_idx"),
+            # For the delta export
+            models.Index(fields=["updated_at"], name="order_updated_at_idx"),
+        ]
 
     STATE_CHOICES = [
         ("REQ", "Requested"),  # User has requested Order
@@ -172,6 +389,9 @@ class Order(models.Model):
         User, null=True, related_name="orders_updates", on_delete=models.SET_NULL
     )
 
+    # Sum of the amounts of all pillages for this order, maintained by Pillage
+    pillaged_amount = models.PositiveIntegerField(default=0, editable=False)
+
     def __str__(self):
         unit = f"{self.product.unit} " if self.product.unit else ""
         return "{} {} of {}".format(self.amount, unit, self.product)
@@ -179,33 +399,72 @@ class Order(models.Model):
     @property
     def to_pillage(self):
         """ The amount of the order that has yet to be pillaged """
-        return self.amount - (
-            (self.pillage_set.all().aggregate(Sum("amount"))["amount__sum"] or 0)
-        )
+        return self.amount - self.pillaged_amount
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        """
+        Saving an order takes what it still needs from the stockpiles. If the order needs less than before or is
+        for another product now, the stock it no longer needs is given to the other open orders.
+        """
+        with transaction.atomic():
+            freed_product_id = None
+            if self._state.adding:
+                lock_product(self.product_id)
+            elif self.has_changed("product_id"):
+                freed_product_id = self.stored_values["product_id"]
+                lock_product(freed_product_id, self.product_id)
+                Pillage.objects.filter(order_id=self.pk).delete()
+                self.pillaged_amount = 0
+            else:
+                lock_product(self.product_id)
+                self.refresh_from_db(fields=["pillaged_amount"])
+                if self.amount < self.pillaged_amount:
+                    release_pillages(
+                        Pillage.objects.filter(order_id=self.pk),
+                        self.pillaged_amount - self.amount,
+                    )
+                    freed_product_id = self.product_id
+                    self.pillaged_amount = self.amount
+
+            super().save(*args, **_counter_safe_save_kwargs(self, kwargs))
+            self.fill_from_stockpiles()
 
-        if self.to_pillage > 0:
-            product_stockpiles = Stockpile.objects.filter(product=self.product)
+            if freed_product_id is not None:
+                fill_open_orders(freed_product_id)
 
-            with_stock = [s for s in product_stockpiles if s.stock > 0]
+    def fill_from_stockpiles(self):
+        """
+        Takes what is still needed for this order from the stockpiles of our product that have stock left.
+
+        The stockpiles are read with their remaining stock in one query and the pillages are written in bulk, so
+        this takes the same number of queries for any number of stockpiles.
+        """
+        if self.to_pillage <= 0 or self.product_id is None:
+            return
 
-            while self.to_pillage > 0 and len(with_stock) > 0:
-                stockpile = with_stock.pop(0)
-                Pillage.objects.create(
-                    order=self,
-                    stockpile=stockpile,
-                    amount=min(self.to_pillage, stockpile.stock),
-                )
+        allocations = allocate(
+            [Demand(self.pk, self.to_pillage)], _available_supply(self.product_id)
+        )
+        create_pillages(allocations)
+        self.pillaged_amount += sum(a.amount for a in allocations)
 
 
-class Stockpile(models.Model):
+class Stockpile(TrackedModel):
     """
     A stockpile is a specific amount of a product that has been bought at a certain price.
     It can then be pillaged by orders.
     """
 
+    tracked_fields = ("product_id", "purchase_id", "amount", "unit_price", "tax")
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=Q(pillaged_amount__lte=F("amount")),
+                name="stockpile_pillaged_amount_lte_amount",
+            )
+        ]
+
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
     amount = models.PositiveIntegerField()
 
@@ -227,70 +486,110 @@ class Stockpile(models.Model):
         verbose_name="Tax rate", help_text="The tax rate as a factor of the net price"
     )
 
+    # Sum of the amounts of all pillages from this stockpile, maintained by Pillage
+    pillaged_amount = models.PositiveIntegerField(default=0, editable=False)
+
     @property
     def stock(self):
         """
         The stock is calculated by taking the total amount bought and subtracting the sum of pillages.
         :return: the number left in stock
         """
-
-        pillages = self.pillage_set.all().aggregate(Sum("amount"))["amount__sum"]
-        if pillages is None:
-            pillages = 0
-
-        return self.amount - pillages
+        return self.amount - self.pillaged_amount
 
     def __str__(self):
         return f"Stockpile of {self.product} ({self.stock}/{self.amount})"
 
-    def __init__(self, *args, **kwargs):
-        super(Stockpile, self).__init__(*args, **kwargs)
-        try:
-            self.inital_product = self.product
-        except Product.DoesNotExist:
-            self.inital_product = None
-
     def clean(self):
-        if self.inital_product and (self.product != self.inital_product):
+        if self.has_changed("product_id"):
             raise ValidationError("You can’t change the product of a Stockpile!")
 
     def save(self, *args, **kwargs):
         """
         As save does not call full_clean, we call clean explicitly
+
+        If the stockpile has less than has been pillaged from it, the newest pillages are shrunk and the orders
+        they belonged to are filled from other stockpiles.
         """
         self.clean()
-        super().save(*args, **kwargs)
-
-        # While there is stock, create pillages for orders that are not topped up yet
-        # TODO: We start with which orders? Possible:
-        # * oldest (id)
-        # * smallest
-        # * largest
-
-        # Get all orders for the product
-        orders = Order.objects.filter(product=self.product)
+        with transaction.atomic():
+            lock_product(self.product_id)
+
+            shrunk = False
+            stored = self.stored_values
+            if stored is not None:
+                del stored["product_id"]
+                self.refresh_from_db(fields=["pillaged_amount"])
+                if self.amount < self.pillaged_amount:
+                    release_pillages(
+                        Pillage.objects.filter(stockpile_id=self.pk),
+                        self.pillaged_amount - self.amount,
+                    )
+                    self.pillaged_amount = self.amount
+                    shrunk = True
+
+            super().save(*args, **_counter_safe_save_kwargs(self, kwargs))
+
+            line = {
+                "purchase_id": self.purchase_id,
+                "amount": self.amount,
+                "unit_price": self.unit_price,
+                "tax": self.tax,
+            }
+            if stored != line:
+                if stored is not None:
+                    _add_to_purchase_totals(**stored, sign=-1)
+                _add_to_purchase_totals(**line)
+            if stored is not None and any(
+                stored[attname] != line[attname]
+                for attname in ("purchase_id", "unit_price", "tax")
+            ):
+                _touch_orders(pillage__stockpile_id=self.pk)
+
+            if shrunk:
+                fill_open_orders(self.product_id)
+            else:
+                self.fill_orders()
+
+    def fill_orders(self):
+        """
+        Fills the orders for our product that are not topped up yet from the stock of this stockpile.
 
-        # Filter for orders that still need something
-        to_fill = [o for o in orders if o.to_pillage > 0]
+        All open orders are read with one query and the pillages are written in bulk, so this takes the same
+        number of queries for any number of orders.
+        """
+        if self.stock <= 0:
+            return
 
-        while self.stock > 0 and len(to_fill) > 0:
-            order = to_fill.pop(0)
-            Pillage.objects.create(
-                order=order, stockpile=self, amount=min(self.stock, order.to_pillage),
-            )
+        # Which orders are filled first is up to the configured strategy
+        allocations = get_strategy().allocate(
+            _open_demand(self.product_id), [Supply(self.pk, self.stock)]
+        )
+        create_pillages(allocations)
+        self.pillaged_amount += sum(a.amount for a in allocations)
 
 
-class Pillage(models.Model):
+class Pillage(TrackedModel):
     """
     A pillage is the connection between an order and a stockpile.
 
     It specifies how much an order has taken from a stockpile
     """
 
+    tracked_fields = ("order_id", "stockpile_id", "amount")
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(check=Q(amount__gte=1), name="pillage_amount_gte_1")
+        ]
+
     amount = models.PositiveIntegerField(validators=[MinValueValidator(1)])
     stockpile = models.ForeignKey(Stockpile, on_delete=models.CASCADE)
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
 
+    # Pillages created by the allocation engine can be removed and recreated by reallocating, others are kept
+    automatic = models.BooleanField(default=False, editable=False)
+
     def clean(self):
         """
         We need to ensure that the product of the stockpile and the order match
@@ -300,13 +599,26 @@ class Pillage(models.Model):
         """
 
         # Check that products of order and stockpile match
-        if self.stockpile.product != self.order.product:
+        if self.stockpile.product_id != self.order.product_id:
             raise ValidationError(
                 "The product of the order and the stockpile it is taken from have to match!"
             )
 
+        # Validate against the current counters, not the ones loaded with the instances
+        for related in (self.order, self.stockpile):
+            related.refresh_from_db(fields=["pillaged_amount"])
+
+        # When this pillage is changed, its old amount must not be counted twice
+        stored = self.stored_values
+        own_order = own_stockpile = 0
+        if stored is not None:
+            if stored["order_id"] == self.order_id:
+                own_order = stored["amount"]
+            if stored["stockpile_id"] == self.stockpile_id:
+                own_stockpile = stored["amount"]
+
         # Get how much is already pillaged for the order in other pillages
-        pillaged = self.order.amount - self.order.to_pillage
+        pillaged = self.order.pillaged_amount - own_order
 
         if self.amount + pillaged > self.order.amount:
             raise ValidationError(
@@ -314,19 +626,337 @@ class Pillage(models.Model):
                 f"it would go to {self.amount + pillaged}."
             )
 
-        if self.amount > self.stockpile.stock:
+        available = self.stockpile.stock + own_stockpile
+        if self.amount > available:
             raise ValidationError(
-                f"The stockpile has {self.stockpile.stock} available, you requested {self.amount}."
+                f"The stockpile has {available} available, you requested {self.amount}."
             )
 
         super().clean()
 
     def save(self, *args, **kwargs):
         """
-        As save does not call full_clean, we call clean explicitly
+        The database checks that order and stockpile have the same product and that neither of them is exceeded,
+        and it updates the pillaged_amount counters of both. Creating a pillage is a single INSERT.
+
+        If the database refuses the pillage, clean is called to raise a ValidationError that explains why.
+        On databases without our triggers, we lock the product, check and update the counters ourselves.
         """
-        self.clean()
-        super().save(*args, **kwargs)
+        maintained = database_maintains_counters(connection)
+        stored = self.stored_values
+
+        try:
+            with transaction.atomic():
+                if not maintained:
+                    lock_product(self.stockpile.product_id)
+                    self.clean()
+
+                super().save(*args, **kwargs)
+
+                if not maintained:
+                    if stored is not None:
+                        _adjust_pillaged_amounts(
+                            stored["order_id"],
+                            stored["stockpile_id"],
+                            -stored["amount"],
+                        )
+                    _adjust_pillaged_amounts(
+                        self.order_id, self.stockpile_id, self.amount
+                    )
+
+                # Stock taken back from a pillage goes to the other open orders
+                if stored is not None and (
+                    self.amount < stored["amount"]
+                    or stored["stockpile_id"] != self.stockpile_id
+                ):
+                    fill_open_orders(
+                        self.stockpile.product_id,
+                        exclude_order_ids=[stored["order_id"], self.order_id],
+                    )
+        except IntegrityError:
+            self.clean()
+            raise
+
+        # Keep the counters of the related instances we hold in sync, so reading them costs no queries
+        for name in ("order", "stockpile"):
+            field = self._meta.get_field(name)
+            if field.is_cached(self):
+                related = field.get_cached_value(self)
+                if stored is not None and stored[f"{name}_id"] == related.pk:
+                    related.pillaged_amount -= stored["amount"]
+                related.pillaged_amount += self.amount
+
+    def delete(self, *args, **kwargs):
+        """
+        The stock of a deleted pillage goes to the other open orders. The order of the pillage itself is left
+        as it is, as someone decided it should not have that stock.
+        """
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            fill_open_orders(
+                self.stockpile.product_id, exclude_order_ids=[self.order_id]
+            )
+        return result
 
     def __str__(self):
         return f"Pillage of {self.amount} for {self.order} from {self.stockpile}"
+
+
+def _adjust_pillaged_amounts(order_id, stockpile_id, delta):
+    """ Relative update of the pillaged_amount counters of an order and a stockpile """
+    _add_pillaged_amounts(Order, {order_id: delta})
+    _add_pillaged_amounts(Stockpile, {stockpile_id: delta})
+
+
+def _add_pillaged_amounts(model, deltas):
+    """
+    Adds the given amounts to the pillaged_amount counters of many orders or stockpiles with a single UPDATE
+
+    :param model: Order or Stockpile
+    :param deltas: dict of primary key to the amount to add
+    """
+    items = list(deltas.items())
+
+    # Stay well below the limit of query parameters of SQLite
+    while items:
+        batch, items = items[:400], items[400:]
+        model.objects.filter(pk__in=[pk for pk, _ in batch]).update(
+            pillaged_amount=F("pillaged_amount")
+            + Case(
+                *[When(pk=pk, then=Value(delta)) for pk, delta in batch],
+                output_field=models.IntegerField(),
+            ),
+            # Like the triggers, so the delta export sees the new prices of the orders
+            **({"updated_at": timezone.now()} if model is Order else {}),
+        )
+
+
+def _add_to_purchase_totals(purchase_id, amount, unit_price, tax, sign=1):
+    """
+    Adds a line to the totals of a purchase, or removes it with sign=-1, with a single relative UPDATE. The
+    database picks the net or gross variant of the line depending on the purchase.
+    """
+    if purchase_id is None:
+        return
+
+    net_if_net, gross_if_net = line_totals(amount, unit_price, tax, is_net=True)
+    net_if_gross, gross_if_gross = line_totals(amount, unit_price, tax, is_net=False)
+    Purchase.objects.filter(pk=purchase_id).update(
+        total_net=F("total_net")
+        + Case(
+            When(is_net=True, then=Value(sign * net_if_net)),
+            default=Value(sign * net_if_gross),
+            output_field=models.BigIntegerField(),
+        ),
+        total_gross=F("total_gross")
+        + Case(
+            When(is_net=True, then=Value(sign * gross_if_net)),
+            default=Value(sign * gross_if_gross),
+            output_field=models.BigIntegerField(),
+        ),
+    )
+
+
+@receiver(post_delete, sender=Stockpile)
+def stockpile_deleted(sender, instance, **kwargs):
+    """ Removes a deleted stockpile from the totals of its purchase """
+    _add_to_purchase_totals(
+        instance.purchase_id,
+        instance.amount,
+        instance.unit_price,
+        instance.tax,
+        sign=-1,
+    )
+
+
+def create_pillages(allocations, batch_size=None):
+    """
+    Writes the result of the allocation engine: all pillages with one bulk INSERT. If the database does not update
+    the counters itself, they are updated with one UPDATE per model.
+
+    Pillage.clean is skipped here. The allocation engine only combines orders and stockpiles of the same product
+    and never hands out more than is open or in stock, so its result passes clean by construction.
+    """
+    if not allocations:
+        return
+
+    Pillage.objects.bulk_create(
+        [
+            Pillage(
+                order_id=a.order_id,
+                stockpile_id=a.stockpile_id,
+                amount=a.amount,
+                automatic=True,
+            )
+            for a in allocations
+        ],
+        batch_size=batch_size,
+    )
+
+    if database_maintains_counters(connection):
+        return
+
+    order_deltas = defaultdict(int)
+    stockpile_deltas = defaultdict(int)
+    for a in allocations:
+        order_deltas[a.order_id] += a.amount
+        stockpile_deltas[a.stockpile_id] += a.amount
+
+    _add_pillaged_amounts(Order, order_deltas)
+    _add_pillaged_amounts(Stockpile, stockpile_deltas)
+
+
+def _open_demand(product_id):
+    """ All orders of a product that still need something, read with one query """
+    return [
+        Demand(*row)
+        for row in Order.objects.filter(product_id=product_id)
+        .annotate(outstanding=F("amount") - F("pillaged_amount"))
+        .filter(outstanding__gt=0)
+        .values_list("id", "outstanding", "team__name", "event__name")
+    ]
+
+
+def _available_supply(product_id):
+    """ All stockpiles of a product that have stock left, oldest first, read with one query """
+    return [
+        Supply(*row)
+        for row in Stockpile.objects.filter(product_id=product_id)
+        .annotate(remaining=F("amount") - F("pillaged_amount"))
+        .filter(remaining__gt=0)
+        .order_by("id")
+        .values_list("id", "remaining")
+    ]
+
+
+def fill_open_orders(product_id, exclude_order_ids=()):
+    """
+    Gives the stock of a product that is left to the open orders of the product in the order of the configured
+    strategy. This only creates the pillages that are missing, existing ones are kept.
+
+    :param exclude_order_ids: orders that are not filled
+    :return: the list of Allocation that were written
+    """
+    if product_id is None:
+        return []
+
+    lock_product(product_id)
+    demand = [
+        d for d in _open_demand(product_id) if d.order_id not in exclude_order_ids
+    ]
+    allocations = get_strategy().allocate(demand, _available_supply(product_id))
+    create_pillages(allocations)
+    return allocations
+
+
+def release_pillages(pillages, amount):
+    """
+    Takes the given amount back from the pillages, automatic ones and the newest first. Pillages that are used up
+    completely are deleted, at most one is shrunk. The caller has to lock the product.
+
+    :param pillages: a queryset of pillages of one order or one stockpile
+    :param amount: how much to release
+    """
+    to_delete = []
+    shrink = None
+    order_deltas = defaultdict(int)
+    stockpile_deltas = defaultdict(int)
+
+    for pk, order_id, stockpile_id, pillaged in pillages.order_by(
+        "-automatic", "-id"
+    ).values_list("id", "order_id", "stockpile_id", "amount"):
+        if amount <= 0:
+            break
+
+        released = min(amount, pillaged)
+        if released == pillaged:
+            to_delete.append(pk)
+        else:
+            shrink = (pk, pillaged - released)
+            order_deltas[order_id] -= released
+            stockpile_deltas[stockpile_id] -= released
+        amount -= released
+
+    # Without triggers, the post_delete receiver updates the counters of deleted pillages
+    Pillage.objects.filter(pk__in=to_delete).delete()
+
+    if shrink is not None:
+        Pillage.objects.filter(pk=shrink[0]).update(amount=shrink[1])
+        if not database_maintains_counters(connection):
+            _add_pillaged_amounts(Order, order_deltas)
+            _add_pillaged_amounts(Stockpile, stockpile_deltas)
+
+
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=Stockpile)
+def stock_freed(sender, instance, **kwargs):
+    """
+    The pillages of a deleted order or stockpile are gone with it: the stock of a deleted order goes to other
+    orders, the orders of a deleted stockpile are filled from other stockpiles. This also catches cascades, e.g.
+    when a purchase is deleted.
+    """
+    fill_open_orders(instance.product_id)
+
+
+class DeletedOrder(models.Model):
+    """
+    Remembers that an order was deleted, so the delta export can tell. Kept for DELETED_ORDERS_RETENTION_DAYS,
+    older ones are removed by the prune_deleted_orders command.
+    """
+
+    # Plain ids, the order is gone and the team may follow
+    order_id = models.PositiveIntegerField()
+    team_id = models.PositiveIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Order {self.order_id}, deleted at {self.deleted_at}"
+
+    @staticmethod
+    def kept_since():
+        """ Orders deleted before this time may have been pruned already """
+        return timezone.now() - timedelta(days=settings.DELETED_ORDERS_RETENTION_DAYS)
+
+    @classmethod
+    def prune(cls):
+        """
+        Removes what is older than the retention period.
+
+        :return: the number of deleted orders removed
+        """
+        return cls.objects.filter(deleted_at__lt=cls.kept_since()).delete()[0]
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    DeletedOrder.objects.create(order_id=instance.pk, team_id=instance.team_id)
+
+
+def pillage_deleted(sender, instance, **kwargs):
+    """
+    Pillages are deleted directly, in bulk or by cascading from their order or stockpile, none of which call
+    Pillage.delete. The signal catches all of them.
+    """
+    _adjust_pillaged_amounts(instance.order_id, instance.stockpile_id, -instance.amount)
+
+
+# Only needed without triggers. A receiver makes Django load every pillage before deleting it.
+if not database_maintains_counters(connection):
+    post_delete.connect(pillage_deleted, sender=Pillage)
+
+
+@receiver(post_migrate)
+def reinstall_triggers(sender, using, **kwargs):
+    """
+    SQLite drops triggers when a migration rebuilds their table, so we install them and the triggers of the search
+    index again after every migrate once the migrations that introduced them are applied.
+    """
+    if sender.name != "squirrel.orders":
+        return
+
+    database = connections[using]
+    applied = MigrationRecorder(database).applied_migrations()
+    if ("orders", "0007_inventory_constraints") in applied:
+        install_triggers(database)
+    if ("orders", "0011_search_index") in applied:
+        install_search_index(database)
@@ -0,0 +1,68 @@
+"""
+Keyset pagination for the table views.
+
+Instead of counting all rows and skipping to an OFFSET, a page is the next rows by id after or before the last one
+shown. Every page is a single range query on the primary key, no matter how deep it is, and rows inserted in the
+meantime do not shift the following pages.
+"""
+from django.conf import settings
+
+
+class KeysetPaginationMixin:
+    """
+    Pages a SingleTableView by id, newest first, if KEYSET_PAGINATION is set. The table can't be sorted then.
+
+    The cursors are passed as ?after=<id> for older and ?before=<id> for newer rows.
+    """
+
+    keyset_page_size = 25
+
+    def keyset_enabled(self):
+        return settings.KEYSET_PAGINATION
+
+    def get_table(self, **kwargs):
+        if not self.keyset_enabled():
+            return super().get_table(**kwargs)
+
+        kwargs["orderable"] = False
+        return self.get_table_class()(
+            data=self.paginate_keyset(self.get_table_data()), **kwargs
+        )
+
+    def paginate_keyset(self, queryset):
+        """
+        Returns the rows of the current page and remembers the cursors of the neighbouring pages in self.keyset
+        """
+        size = self.keyset_page_size
+        after = self._cursor("after")
+        before = self._cursor("before")
+
+        if before is not None:
+            rows = list(queryset.filter(pk__gt=before).order_by("pk")[: size + 1])
+            has_newer = len(rows) > size
+            rows = rows[:size][::-1]
+            has_older = True
+        else:
+            if after is not None:
+                queryset = queryset.filter(pk__lt=after)
+            rows = list(queryset.order_by("-pk")[: size + 1])
+            has_older = len(rows) > size
+            rows = rows[:size]
+            has_newer = after is not None
+
+        self.keyset = {
+            "newer": rows[0].pk if rows and has_newer else None,
+            "older": rows[-1].pk if rows and has_older else None,
+        }
+        return rows
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["keyset"] = getattr(self, "keyset", None)
+        return context
+
+    def _cursor(self, name):
+        try:
+            return int(self.request.GET[name])
+        except (KeyError, ValueError):
+            return None
@@ -0,0 +1,36 @@
+"""
+The permissions of the current user, read once per request.
+
+Tables and templates look up what the user may do in a set instead of asking the auth backends for every row and
+every link. Templates get it as `permissions`, e.g. `{% if permissions.change_order %}`.
+"""
+from django.utils.functional import SimpleLazyObject
+
+
+class PermissionMatrix:
+    """ What a user may do in the orders app, by codename, e.g. matrix["change_order"] """
+
+    def __init__(self, user):
+        self.is_superuser = user.is_active and user.is_superuser
+        self.codenames = frozenset(
+            permission.split(".", 1)[1]
+            for permission in user.get_all_permissions()
+            if permission.startswith("orders.")
+        )
+
+    def __getitem__(self, codename):
+        return self.is_superuser or codename in self.codenames
+
+
+def request_permissions(request):
+    """ The PermissionMatrix of the user of the request, built on first use """
+    try:
+        return request._permission_matrix
+    except AttributeError:
+        request._permission_matrix = PermissionMatrix(request.user)
+        return request._permission_matrix
+
+
+def permissions(request):
+    """ Context processor that adds the permissions of the user as `permissions` """
+    return {"permissions": SimpleLazyObject(lambda: request_permissions(request))}
@@ -0,0 +1,139 @@
+"""
+Planning shows which pillages saving stockpiles or orders would create, without saving anything.
+
+The open orders and the stockpiles with stock left are read once for all products involved. Saving the
+hypothetical stockpiles and orders is then played through in memory with the same allocation engine the models
+use, so the plan matches what saving would do.
+"""
+from collections import OrderedDict, defaultdict
+
+from django.db.models import F
+from squirrel.orders.allocation import Demand, Supply, allocate, get_strategy
+from squirrel.orders.models import Order, Pillage, Stockpile
+
+
+def plan_allocation(product=None, stockpiles=(), orders=(), strategy=None):
+    """
+    Plans the pillages for a product and for stockpiles and orders that have not been saved yet.
+
+    * For the product, the stock that is left is given to its open orders, like reallocating it.
+    * Each of the stockpiles then fills the open orders of its product, like saving it.
+    * Each of the orders then takes what it needs from the stockpiles of its product, like saving it.
+
+    The stockpiles and orders may also be changed instances of saved ones. Nothing is written to the database.
+
+    :param product: a Product or None
+    :param stockpiles: iterable of Stockpile
+    :param orders: iterable of Order
+    :param strategy: the AllocationStrategy to use, the configured one by default
+    :return: a list of unsaved Pillage, with order and stockpile set
+    """
+    if strategy is None:
+        strategy = get_strategy()
+
+    stockpiles = [s for s in stockpiles if s.product_id is not None]
+    orders = [o for o in orders if o.product_id is not None]
+
+    # Unsaved instances get negative ids, so they can be told apart from saved ones
+    stockpile_ids = [s.pk or -i for i, s in enumerate(stockpiles, 1)]
+    order_ids = [o.pk or -i for i, o in enumerate(orders, 1)]
+
+    product_id = product.pk if product is not None else None
+    demand_products = ({s.product_id for s in stockpiles} | {product_id}) - {None}
+    supply_products = ({o.product_id for o in orders} | {product_id}) - {None}
+
+    # One read per model for all products. The instances are kept to show the plan.
+    open_orders = OrderedDict()
+    if demand_products:
+        for order in (
+            Order.objects.filter(product_id__in=demand_products)
+            .exclude(pk__in=[pk for pk in order_ids if pk > 0])
+            .annotate(outstanding=F("amount") - F("pillaged_amount"))
+            .filter(outstanding__gt=0)
+            .select_related("product", "team", "event")
+            .order_by("id")
+        ):
+            open_orders[order.pk] = order
+
+    available = OrderedDict()
+    if supply_products:
+        for stockpile in (
+            Stockpile.objects.filter(product_id__in=supply_products)
+            .exclude(pk__in=[pk for pk in stockpile_ids if pk > 0])
+            .annotate(remaining=F("amount") - F("pillaged_amount"))
+            .filter(remaining__gt=0)
+            .select_related("product")
+            .order_by("id")
+        ):
+            available[stockpile.pk] = stockpile
+
+    outstanding = {pk: o.outstanding for pk, o in open_orders.items()}
+    remaining = {pk: s.remaining for pk, s in available.items()}
+    orders_of_product = defaultdict(list)
+    for pk, order in open_orders.items():
+        orders_of_product[order.product_id].append(pk)
+    stockpiles_of_product = defaultdict(list)
+    for pk, stockpile in available.items():
+        stockpiles_of_product[stockpile.product_id].append(pk)
+
+    planned = []
+
+    def demand_for(product_id):
+        return [
+            Demand(
+                pk,
+                outstanding[pk],
+                _name(open_orders[pk], "team"),
+                _name(open_orders[pk], "event"),
+            )
+            for pk in orders_of_product[product_id]
+            if outstanding[pk] > 0
+        ]
+
+    def supply_for(product_id):
+        return [
+            Supply(pk, remaining[pk])
+            for pk in stockpiles_of_product[product_id]
+            if remaining[pk] > 0
+        ]
+
+    def apply(allocations):
+        for a in allocations:
+            outstanding[a.order_id] -= a.amount
+            remaining[a.stockpile_id] -= a.amount
+            planned.append(
+                Pillage(
+                    order=open_orders[a.order_id],
+                    stockpile=available[a.stockpile_id],
+                    amount=a.amount,
+                    automatic=True,
+                )
+            )
+
+    if product_id is not None:
+        apply(strategy.allocate(demand_for(product_id), supply_for(product_id)))
+
+    for pk, stockpile in zip(stockpile_ids, stockpiles):
+        available[pk] = stockpile
+        remaining[pk] = max(stockpile.amount - stockpile.pillaged_amount, 0)
+        stockpiles_of_product[stockpile.product_id].append(pk)
+        apply(
+            strategy.allocate(
+                demand_for(stockpile.product_id), [Supply(pk, remaining[pk])]
+            )
+        )
+
+    for pk, order in zip(order_ids, orders):
+        open_orders[pk] = order
+        outstanding[pk] = max(order.amount - order.pillaged_amount, 0)
+        orders_of_product[order.product_id].append(pk)
+        apply(allocate([Demand(pk, outstanding[pk])], supply_for(order.product_id)))
+
+    return planned
+
+
+def _name(order, field):
+    """ The name of the team or event of an order, which may not be set on unsaved orders """
+    if getattr(order, f"{field}_id") is None:
+        return None
+    return getattr(order, field).name
@@ -0,0 +1,214 @@
+"""
+Full-text search over product names, order comments and vendor names.
+
+On SQLite, each of them has an FTS5 index that reads its text from the indexed table itself (an external content
+table) and is kept up to date by triggers. Results are ranked by bm25, the best match first.
+
+On other databases, or when SQLite was built without FTS5, searching falls back to LIKE queries. Names that start
+with the search term are ranked above names that only contain it, shorter names above longer ones.
+
+Like the stock triggers, the search triggers are installed again after every migrate, as SQLite drops them when a
+migration rebuilds their table.
+"""
+import re
+from collections import namedtuple
+
+from django.apps import apps
+from django.db import OperationalError, connection
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import Length
+
+# kind: (table, column) of the indexed text. The search index of a table is named <table>_search.
+SEARCHABLE = {
+    "product": ("orders_product", "name"),
+    "order": ("orders_order", "comment"),
+    "vendor": ("orders_vendor", "name"),
+}
+
+# A search hit. The higher the score, the better the match.
+SearchResult = namedtuple("SearchResult", ["kind", "pk", "text", "score"])
+
+
+def _index_statements(table, column):
+    index = f"{table}_search"
+    return [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {index}
+        USING fts5({column}, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {index}_insert
+        AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO {index}(rowid, {column}) VALUES (NEW.id, NEW.{column});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {index}_update
+        AFTER UPDATE OF {column} ON {table}
+        WHEN OLD.{column} IS NOT NEW.{column}
+        BEGIN
+            INSERT INTO {index}({index}, rowid, {column}) VALUES ('delete', OLD.id, OLD.{column});
+            INSERT INTO {index}(rowid, {column}) VALUES (NEW.id, NEW.{column});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {index}_delete
+        AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO {index}({index}, rowid, {column}) VALUES ('delete', OLD.id, OLD.{column});
+        END
+        """,
+    ]
+
+
+def fts_available(connection):
+    """ Whether the database can have a full-text index """
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE temp.orders_fts_probe USING fts5(text)"
+            )
+        except OperationalError:
+            return False
+        cursor.execute("DROP TABLE temp.orders_fts_probe")
+    return True
+
+
+def search_index_enabled(connection):
+    """ Whether the full-text index has been created on this database """
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (%s, %s, %s)",
+            [f"{table}_search" for table, column in SEARCHABLE.values()],
+        )
+        return cursor.fetchone()[0] == len(SEARCHABLE)
+
+
+def install_search_index(connection):
+    """
+    Creates the search indexes and their triggers if the database supports them. Safe to run any number of times.
+
+    :return: whether the database has a full-text index now
+    """
+    if not fts_available(connection):
+        return False
+    with connection.cursor() as cursor:
+        for table, column in SEARCHABLE.values():
+            for statement in _index_statements(table, column):
+                cursor.execute(statement)
+    return True
+
+
+def uninstall_search_index(connection):
+    """ Removes the search indexes and their triggers again """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for table, column in SEARCHABLE.values():
+            for suffix in ("insert", "update", "delete"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {table}_search_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {table}_search")
+
+
+def rebuild_search_index(connection):
+    """
+    Reads the indexed text of all rows again, e.g. after the index got out of date because the triggers were
+    missing.
+
+    :return: whether there was a full-text index to rebuild
+    """
+    if not search_index_enabled(connection):
+        return False
+    with connection.cursor() as cursor:
+        for table, column in SEARCHABLE.values():
+            cursor.execute(
+                f"INSERT INTO {table}_search({table}_search) VALUES ('rebuild')"
+            )
+    return True
+
+
+def search(term, kinds=tuple(SEARCHABLE), teams=None, limit=20):
+    """
+    Searches products, orders and vendors for all words of the term. The last word may be incomplete.
+
+    :param kinds: which of "product", "order" and "vendor" to search
+    :param teams: ids of the teams whose orders may be found, all orders if None
+    :return: a list of at most limit SearchResult, the best match first
+    """
+    words = re.findall(r"\w+", term)
+    if not words:
+        return []
+
+    if teams is not None:
+        teams = list(teams)
+        if not teams:
+            kinds = [kind for kind in kinds if kind != "order"]
+
+    if search_index_enabled(connection):
+        results = _search_index(words, kinds, teams, limit)
+    else:
+        results = _search_like(words, kinds, teams, limit)
+
+    return sorted(results, key=lambda r: -r.score)[:limit]
+
+
+def _search_index(words, kinds, teams, limit):
+    # Quoting every word keeps FTS5 from reading its query syntax in the term, * matches words that start with it
+    query = " ".join(f'"{word}"*' for word in words)
+
+    results = []
+    with connection.cursor() as cursor:
+        for kind in kinds:
+            table, column = SEARCHABLE[kind]
+            index = f"{table}_search"
+
+            sql = f"SELECT rowid, {column}, bm25({index}) FROM {index} WHERE {index} MATCH %s"
+            params = [query]
+            if kind == "order" and teams is not None:
+                sql += f" AND rowid IN (SELECT id FROM orders_order WHERE team_id IN ({', '.join(['%s'] * len(teams))}))"
+                params += teams
+            sql += f" ORDER BY bm25({index}) LIMIT %s"
+            params.append(limit)
+
+            cursor.execute(sql, params)
+            # bm25 is smaller for better matches
+            results += [
+                SearchResult(kind, pk, text, -rank)
+                for pk, text, rank in cursor.fetchall()
+            ]
+    return results
+
+
+def _search_like(words, kinds, teams, limit):
+    results = []
+    for kind in kinds:
+        table, column = SEARCHABLE[kind]
+        model = apps.get_model("orders", kind)
+
+        objects = model.objects.all()
+        for word in words:
+            objects = objects.filter(**{f"{column}__icontains": word})
+        if kind == "order" and teams is not None:
+            objects = objects.filter(team_id__in=teams)
+
+        objects = objects.annotate(
+            starts_with=Case(
+                When(**{f"{column}__istartswith": words[0]}, then=Value(1)),
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+            length=Length(column),
+        ).order_by("-starts_with", "length", "pk")
+
+        results += [
+            SearchResult(kind, pk, text, starts_with + 1 / (1 + length))
+            for pk, text, starts_with, length in objects.values_list(
+                "pk", column, "starts_with", "length"
+            )[:limit]
+        ]
+    return results
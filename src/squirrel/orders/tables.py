@@ -1,3 +1,6 @@
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
 from django_tables2 import Column, TemplateColumn, tables
 from squirrel.orders.models import (
     Event,
@@ -9,61 +12,72 @@ from squirrel.orders.models import (
     Team,
     Vendor,
 )
+from squirrel.orders.permissions import request_permissions
 
+# Stands in for the id of the record in the pre-rendered buttons
+_ID_PLACEHOLDER = 2147483647
 
-class VendorTable(tables.Table):
-    class Meta:
-        model = Vendor
-        attrs = {"class": "table table-sm"}
-        fields = ["name"]
 
-    edit = TemplateColumn(
-        """
-        {% if perms.orders.change_vendor %}
-        <a class="btn btn-primary btn-sm" href="{% url 'edit_vendor' record.id %}">Edit</a>
-        {% endif %}
-        {% if perms.orders.delete_vendor %}
-        <a class="btn btn-danger btn-sm" href="{% url 'delete_vendor' record.id %}">Delete</a>
-        {% endif %}
+class EditableTable(tables.Table):
     """
-    )
+    A table with edit and delete buttons for users who may change or delete its records.
+
+    The buttons are rendered once per table for what the user may do, each cell only gets the id of its record put
+    in. The views are edit_<model> and delete_<model>.
+    """
+
+    edit = Column(empty_values=(), orderable=False)
+    edit_buttons = ""
 
     def before_render(self, request):
-        if request.user.has_perm("orders.change_vendor") or request.user.has_perm(
-            "orders.delete_vendor"
-        ):
+        model_name = self._meta.model._meta.model_name
+        permissions = request_permissions(request)
+
+        buttons = []
+        if permissions[f"change_{model_name}"]:
+            buttons.append(
+                format_html(
+                    '<a class="btn btn-primary btn-sm" href="{}">Edit</a>',
+                    reverse(f"edit_{model_name}", args=[_ID_PLACEHOLDER]),
+                )
+            )
+        if permissions[f"delete_{model_name}"]:
+            buttons.append(
+                format_html(
+                    '<a class="btn btn-danger btn-sm" href="{}">Delete</a>',
+                    reverse(f"delete_{model_name}", args=[_ID_PLACEHOLDER]),
+                )
+            )
+
+        if buttons:
+            self.edit_buttons = (
+                "\n".join(buttons)
+                .replace("%", "%%")
+                .replace(str(_ID_PLACEHOLDER), "%(id)d")
+            )
             self.columns.show("edit")
         else:
             self.columns.hide("edit")
 
+    def render_edit(self, record):
+        return mark_safe(self.edit_buttons % {"id": record.pk})
+
 
-class TeamTable(tables.Table):
+class VendorTable(EditableTable):
     class Meta:
-        model = Team
+        model = Vendor
         attrs = {"class": "table table-sm"}
         fields = ["name"]
 
-    edit = TemplateColumn(
-        """
-        {% if perms.orders.change_team %}
-        <a class="btn btn-primary btn-sm" href="{% url 'edit_team' record.id %}">Edit</a>
-        {% endif %}
-        {% if perms.orders.delete_team %}
-        <a class="btn btn-danger btn-sm" href="{% url 'delete_team' record.id %}">Delete</a>
-        {% endif %}
-    """
-    )
 
-    def before_render(self, request):
-        if request.user.has_perm("orders.change_team") or request.user.has_perm(
-            "orders.delete_team"
-        ):
-            self.columns.show("edit")
-        else:
-            self.columns.hide("edit")
+class TeamTable(EditableTable):
+    class Meta:
+        model = Team
+        attrs = {"class": "table table-sm"}
+        fields = ["name"]
 
 
-class OrderTable(tables.Table):
+class OrderTable(EditableTable):
     class Meta:
         model = Order
         attrs = {"class": "table table-sm"}
@@ -76,113 +90,41 @@ class OrderTable(tables.Table):
             "team",
         ]
 
-    edit = TemplateColumn(
-        """
-        {% if perms.orders.change_order %}
-        <a class="btn btn-primary btn-sm" href="{% url 'edit_order' record.id %}">Edit</a>
-        {% endif %}
-        {% if perms.orders.delete_order %}
-        <a class="btn btn-danger btn-sm" href="{% url 'delete_order' record.id %}">Delete</a>
-        {% endif %}
-    """
-    )
-
     comment = TemplateColumn(
         '<data-toggle="tooltip" title="{{record.comment}}">{{record.comment|truncatechars:50}}'
     )
 
-    def before_render(self, request):
-        if request.user.has_perm("orders.change_order") or request.user.has_perm(
-            "orders.delete_order"
-        ):
-            self.columns.show("edit")
-        else:
-            self.columns.hide("edit")
-
     @staticmethod
     def render_amount(record):
         unit = f"{record.product.unit} " if record.product.unit else ""
         return f"{record.amount} {unit}"
 
 
-class ProductTable(tables.Table):
+class ProductTable(EditableTable):
     class Meta:
         model = Product
         attrs = {"class": "table table-sm"}
         fields = ["name", "unit", "default_price"]
 
-    edit = TemplateColumn(
-        """
-        {% if perms.orders.change_product %}
-        <a class="btn btn-primary btn-sm" href="{% url 'edit_product' record.id %}">Edit</a>
-        {% endif %}
-        {% if perms.orders.delete_product %}
-        <a class="btn btn-danger btn-sm" href="{% url 'delete_product' record.id %}">Delete</a>
-        {% endif %}
-    """
-    )
-
-    def before_render(self, request):
-        if request.user.has_perm("orders.change_product") or request.user.has_perm(
-            "orders.delete_product"
-        ):
-            self.columns.show("edit")
-        else:
-            self.columns.hide("edit")
 
-
-class EventTable(tables.Table):
+class EventTable(EditableTable):
     class Meta:
         model = Event
         attrs = {"class": "table table-sm"}
         fields = ["name"]
 
-    edit = TemplateColumn(
-        """
-        {% if perms.orders.change_event %}
-        <a class="btn btn-primary btn-sm" href="{% url 'edit_event' record.id %}">Edit</a>
-        {% endif %}
-        {% if perms.orders.delete_event %}
-        <a class="btn btn-danger btn-sm" href="{% url 'delete_event' record.id %}">Delete</a>
-        {% endif %}
-    """
-    )
-
-    def before_render(self, request):
-        if request.user.has_perm("orders.change_event") or request.user.has_perm(
-            "orders.delete_event"
-        ):
-            self.columns.show("edit")
-        else:
-            self.columns.hide("edit")
-
 
-class PurchaseTable(tables.Table):
+class PurchaseTable(EditableTable):
     class Meta:
         model = Purchase
         attrs = {"class": "table table-sm"}
+        exclude = ["total_net", "total_gross"]
 
-    edit = TemplateColumn(
-        """
-        {% if perms.orders.change_purchase %}
-        <a class="btn btn-primary btn-sm" href="{% url 'edit_purchase' record.id %}">Edit</a>
-        {% endif %}
-        {% if perms.orders.delete_purchase %}
-        <a class="btn btn-danger btn-sm" href="{% url 'delete_purchase' record.id %}">Delete</a>
-        {% endif %}
-    """
-    )
-
-    def before_render(self, request):
-        if request.user.has_perm("orders.change_purchase") or request.user.has_perm(
-            "orders.delete_purchase"
-        ):
-            self.columns.show("edit")
-        else:
-            self.columns.hide("edit")
+    sum_net = Column(verbose_name="Sum net", order_by="total_net")
+    sum_gross = Column(verbose_name="Sum gross", order_by="total_gross")
 
 
-class StockpileTable(tables.Table):
+class StockpileTable(EditableTable):
     class Meta:
         model = Stockpile
         fields = [
@@ -196,52 +138,33 @@ class StockpileTable(tables.Table):
         ]
         attrs = {"class": "table table-sm"}
 
-    edit = TemplateColumn(
-        """
-        {% if perms.orders.change_stockpile %}
-        <a class="btn btn-primary btn-sm" href="{% url 'edit_stockpile' record.id %}">Edit</a>
-        {% endif %}
-        {% if perms.orders.delete_stockpile %}
-        <a class="btn btn-danger btn-sm" href="{% url 'delete_stockpile' record.id %}">Delete</a>
-        {% endif %}
+    stock = Column(accessor="remaining_stock", order_by="remaining_stock")
+
+
+class PillageTable(EditableTable):
+    """
+    Order and stockpile are shown with their __str__, which needs their products. The view loads them together
+    with the pillages, so a page takes the same number of queries for any number of rows.
     """
-    )
 
-    stock = Column(empty_values=())
+    class Meta:
+        model = Pillage
+        attrs = {"class": "table table-sm"}
+        fields = ["id", "amount", "order", "team", "stockpile", "automatic"]
 
-    @staticmethod
-    def render_stock(record):
-        return record.stock
+    order = Column(order_by=("order__product__name", "order__amount"))
+    team = Column(accessor="order.team", order_by=("order__team__name",))
+    stockpile = Column(order_by=("stockpile__product__name", "stockpile__amount"))
 
-    def before_render(self, request):
-        if request.user.has_perm("orders.change_stockpile") or request.user.has_perm(
-            "orders.delete_stockpile"
-        ):
-            self.columns.show("edit")
-        else:
-            self.columns.hide("edit")
 
+class PillagePlanTable(tables.Table):
+    """ Pillages that saving would create, they have no id yet """
 
-class PillageTable(tables.Table):
     class Meta:
         model = Pillage
         attrs = {"class": "table table-sm"}
+        fields = ["amount", "order", "stockpile"]
+        orderable = False
 
-    edit = TemplateColumn(
-        """
-        {% if perms.orders.change_pillage %}
-        <a class="btn btn-primary btn-sm" href="{% url 'edit_pillage' record.id %}">Edit</a>
-        {% endif %}
-        {% if perms.orders.delete_pillage %}
-        <a class="btn btn-danger btn-sm" href="{% url 'delete_pillage' record.id %}">Delete</a>
-        {% endif %}
-    """
-    )
-
-    def before_render(self, request):
-        if request.user.has_perm("orders.change_pillage") or request.user.has_perm(
-            "orders.delete_pillage"
-        ):
-            self.columns.show("edit")
-        else:
-            self.columns.hide("edit")
+    team = Column(accessor="order.team")
+    event = Column(accessor="order.event")
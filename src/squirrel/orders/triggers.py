@@ -0,0 +1,210 @@
+"""
+Database triggers that enforce the stock invariants.
+
+* The pillaged_amount counters of orders and stockpiles are updated by the database on every insert, update and
+  delete of a pillage. Together with the check constraints on the counters, the database refuses any pillage that
+  takes more than is in stock or more than was ordered.
+* A pillage can only connect an order and a stockpile of the same product, and the product of an order or a
+  stockpile can't change while it has pillages. Whether it has some is read from its counter, as SQLite refuses to
+  rebuild a table in a migration that a trigger of another table reads.
+* The updated_at of an order is set whenever its pillages change, as that changes its prices in the export.
+
+Triggers exist for SQLite and PostgreSQL. On other databases, the models update the counters themselves.
+
+SQLite drops the triggers of a table whenever a migration rebuilds it, so the triggers are installed again after
+every migrate.
+"""
+
+TRIGGER_VENDORS = ("sqlite", "postgresql")
+
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS orders_pillage_product_insert
+    BEFORE INSERT ON orders_pillage
+    WHEN (SELECT product_id FROM orders_stockpile WHERE id = NEW.stockpile_id)
+        IS NOT (SELECT product_id FROM orders_order WHERE id = NEW.order_id)
+    BEGIN
+        SELECT RAISE(ABORT, 'orders_pillage_product_mismatch');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS orders_pillage_product_update
+    BEFORE UPDATE OF order_id, stockpile_id ON orders_pillage
+    WHEN (SELECT product_id FROM orders_stockpile WHERE id = NEW.stockpile_id)
+        IS NOT (SELECT product_id FROM orders_order WHERE id = NEW.order_id)
+    BEGIN
+        SELECT RAISE(ABORT, 'orders_pillage_product_mismatch');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS orders_order_product_update
+    BEFORE UPDATE OF product_id ON orders_order
+    WHEN OLD.product_id IS NOT NEW.product_id AND OLD.pillaged_amount > 0
+    BEGIN
+        SELECT RAISE(ABORT, 'orders_pillage_product_mismatch');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS orders_stockpile_product_update
+    BEFORE UPDATE OF product_id ON orders_stockpile
+    WHEN OLD.product_id IS NOT NEW.product_id AND OLD.pillaged_amount > 0
+    BEGIN
+        SELECT RAISE(ABORT, 'orders_pillage_product_mismatch');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS orders_pillage_counters_insert
+    AFTER INSERT ON orders_pillage
+    BEGIN
+        UPDATE orders_order SET pillaged_amount = pillaged_amount + NEW.amount,
+            updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.order_id;
+        UPDATE orders_stockpile SET pillaged_amount = pillaged_amount + NEW.amount
+            WHERE id = NEW.stockpile_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS orders_pillage_counters_update
+    AFTER UPDATE OF amount, order_id, stockpile_id ON orders_pillage
+    BEGIN
+        UPDATE orders_order SET pillaged_amount = pillaged_amount - OLD.amount,
+            updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = OLD.order_id;
+        UPDATE orders_stockpile SET pillaged_amount = pillaged_amount - OLD.amount
+            WHERE id = OLD.stockpile_id;
+        UPDATE orders_order SET pillaged_amount = pillaged_amount + NEW.amount,
+            updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.order_id;
+        UPDATE orders_stockpile SET pillaged_amount = pillaged_amount + NEW.amount
+            WHERE id = NEW.stockpile_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS orders_pillage_counters_delete
+    AFTER DELETE ON orders_pillage
+    BEGIN
+        UPDATE orders_order SET pillaged_amount = pillaged_amount - OLD.amount,
+            updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = OLD.order_id;
+        UPDATE orders_stockpile SET pillaged_amount = pillaged_amount - OLD.amount
+            WHERE id = OLD.stockpile_id;
+    END
+    """,
+]
+
+POSTGRESQL_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION orders_pillage_check_product() RETURNS trigger AS $$
+    BEGIN
+        IF (SELECT product_id FROM orders_stockpile WHERE id = NEW.stockpile_id)
+            IS DISTINCT FROM (SELECT product_id FROM orders_order WHERE id = NEW.order_id) THEN
+            RAISE EXCEPTION 'orders_pillage_product_mismatch'
+                USING ERRCODE = 'integrity_constraint_violation';
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS orders_pillage_product ON orders_pillage",
+    """
+    CREATE TRIGGER orders_pillage_product
+    BEFORE INSERT OR UPDATE OF order_id, stockpile_id ON orders_pillage
+    FOR EACH ROW EXECUTE PROCEDURE orders_pillage_check_product()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION orders_pillaged_product_check() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.product_id IS DISTINCT FROM OLD.product_id AND OLD.pillaged_amount > 0 THEN
+            RAISE EXCEPTION 'orders_pillage_product_mismatch'
+                USING ERRCODE = 'integrity_constraint_violation';
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS orders_order_product ON orders_order",
+    """
+    CREATE TRIGGER orders_order_product
+    BEFORE UPDATE OF product_id ON orders_order
+    FOR EACH ROW EXECUTE PROCEDURE orders_pillaged_product_check()
+    """,
+    "DROP TRIGGER IF EXISTS orders_stockpile_product ON orders_stockpile",
+    """
+    CREATE TRIGGER orders_stockpile_product
+    BEFORE UPDATE OF product_id ON orders_stockpile
+    FOR EACH ROW EXECUTE PROCEDURE orders_pillaged_product_check()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION orders_pillage_counters() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE orders_order SET pillaged_amount = pillaged_amount - OLD.amount,
+                updated_at = now() WHERE id = OLD.order_id;
+            UPDATE orders_stockpile SET pillaged_amount = pillaged_amount - OLD.amount
+                WHERE id = OLD.stockpile_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            UPDATE orders_order SET pillaged_amount = pillaged_amount + NEW.amount,
+                updated_at = now() WHERE id = NEW.order_id;
+            UPDATE orders_stockpile SET pillaged_amount = pillaged_amount + NEW.amount
+                WHERE id = NEW.stockpile_id;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS orders_pillage_counters ON orders_pillage",
+    """
+    CREATE TRIGGER orders_pillage_counters
+    AFTER INSERT OR DELETE OR UPDATE OF amount, order_id, stockpile_id ON orders_pillage
+    FOR EACH ROW EXECUTE PROCEDURE orders_pillage_counters()
+    """,
+]
+
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS orders_pillage_product_insert",
+    "DROP TRIGGER IF EXISTS orders_pillage_product_update",
+    "DROP TRIGGER IF EXISTS orders_order_product_update",
+    "DROP TRIGGER IF EXISTS orders_stockpile_product_update",
+    "DROP TRIGGER IF EXISTS orders_pillage_counters_insert",
+    "DROP TRIGGER IF EXISTS orders_pillage_counters_update",
+    "DROP TRIGGER IF EXISTS orders_pillage_counters_delete",
+]
+
+POSTGRESQL_DROP = [
+    "DROP TRIGGER IF EXISTS orders_pillage_product ON orders_pillage",
+    "DROP TRIGGER IF EXISTS orders_pillage_counters ON orders_pillage",
+    "DROP TRIGGER IF EXISTS orders_order_product ON orders_order",
+    "DROP TRIGGER IF EXISTS orders_stockpile_product ON orders_stockpile",
+    "DROP FUNCTION IF EXISTS orders_pillage_check_product()",
+    "DROP FUNCTION IF EXISTS orders_pillaged_product_check()",
+    "DROP FUNCTION IF EXISTS orders_pillage_counters()",
+]
+
+
+def database_maintains_counters(connection):
+    """ Whether the triggers keep the pillaged_amount counters up to date on this database """
+    return connection.vendor in TRIGGER_VENDORS
+
+
+def install_triggers(connection):
+    """ Creates or replaces all triggers. Safe to run any number of times. """
+    _execute(
+        connection,
+        {"sqlite": SQLITE_TRIGGERS, "postgresql": POSTGRESQL_TRIGGERS}.get(
+            connection.vendor, []
+        ),
+    )
+
+
+def uninstall_triggers(connection):
+    """ Removes all triggers again """
+    _execute(
+        connection,
+        {"sqlite": SQLITE_DROP, "postgresql": POSTGRESQL_DROP}.get(
+            connection.vendor, []
+        ),
+    )
+
+
+def _execute(connection, statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
@@ -15,3 +15,16 @@ def squirrel_round(number):
 
     # else, we round up
     return number + (10 - last_digit)
+
+
+def line_totals(amount, unit_price, tax, is_net):
+    """
+    The net and gross total of a line of a purchase in 10ths of cents, rounded to whole 10ths of cents.
+
+    :param is_net: whether the unit price is net, else it is gross
+    :return: a tuple of net and gross total
+    """
+    price = amount * unit_price
+    if is_net:
+        return price, int(price * tax + 0.5)
+    return int(price / tax + 0.5), price
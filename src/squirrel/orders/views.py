@@ -1,14 +1,36 @@
-import csv
+from itertools import chain
 
 from decouple import UndefinedValueError, config
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
-from django.http import HttpResponse
+from django.db.models import F
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+from django.utils import timezone
 from django_tables2 import SingleTableView
+from squirrel.orders.backends import user_team_ids
+from squirrel.orders.catalog import search_product_names
+from squirrel.orders.exports import (
+    CURSOR_OVERLAP,
+    DELTA_COLUMNS,
+    EXPORT_FORMATS,
+    ORDER_COLUMNS,
+    PILLAGE_COLUMNS,
+    PURCHASE_COLUMNS,
+    STOCKPILE_COLUMNS,
+    deleted_order_rows,
+    export_cursor,
+    export_since,
+    order_rows,
+    pillage_rows,
+    purchase_rows,
+    stockpile_rows,
+)
 from squirrel.orders.forms import (
     EventForm,
+    OrderFilterForm,
     OrderForm,
     PillageForm,
     ProductForm,
@@ -19,6 +41,7 @@ from squirrel.orders.forms import (
     VendorForm,
 )
 from squirrel.orders.models import (
+    DeletedOrder,
     Event,
     Order,
     Pillage,
@@ -28,9 +51,13 @@ from squirrel.orders.models import (
     Team,
     Vendor,
 )
+from squirrel.orders.pagination import KeysetPaginationMixin
+from squirrel.orders.planning import plan_allocation
+from squirrel.orders.search import search as search_index
 from squirrel.orders.tables import (
     EventTable,
     OrderTable,
+    PillagePlanTable,
     PillageTable,
     ProductTable,
     PurchaseTable,
@@ -48,16 +75,34 @@ def orders_redirect(request):
     return redirect("orders")
 
 
-class OrderListView(LoginRequiredMixin, SingleTableView):
+class OrderListView(LoginRequiredMixin, KeysetPaginationMixin, SingleTableView):
     model = Order
     table_class = OrderTable
     template_name = "orders.html"
 
+    # The most queries a page of the list may take, no matter how many rows it shows. Checked by the tests.
+    query_budget = 9
+
     def get_table_data(self):
+        orders = self.get_filter_form().filter(
+            Order.objects.select_related("product", "event", "team")
+        )
         if self.request.user.has_perm("orders.view_order"):
-            return Order.objects.all()
+            return orders.all()
         else:
-            return Order.objects.filter(team__members=self.request.user)
+            return orders.filter(team_id__in=user_team_ids(self.request.user))
+
+    def get_filter_form(self):
+        if not hasattr(self, "filter_form"):
+            self.filter_form = OrderFilterForm(
+                self.request.GET or None, user=self.request.user
+            )
+        return self.filter_form
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["filter_form"] = self.get_filter_form()
+        return context
 
 
 class VendorListView(PermissionRequiredMixin, SingleTableView):
@@ -65,6 +110,7 @@ class VendorListView(PermissionRequiredMixin, SingleTableView):
     model = Vendor
     table_class = VendorTable
     template_name = "vendors.html"
+    query_budget = 6
 
 
 class ProductListView(PermissionRequiredMixin, SingleTableView):
@@ -72,6 +118,7 @@ class ProductListView(PermissionRequiredMixin, SingleTableView):
     model = Product
     table_class = ProductTable
     template_name = "products.html"
+    query_budget = 6
 
 
 class TeamListView(PermissionRequiredMixin, SingleTableView):
@@ -79,6 +126,7 @@ class TeamListView(PermissionRequiredMixin, SingleTableView):
     model = Team
     table_class = TeamTable
     template_name = "teams.html"
+    query_budget = 6
 
 
 class EventListView(PermissionRequiredMixin, SingleTableView):
@@ -86,6 +134,7 @@ class EventListView(PermissionRequiredMixin, SingleTableView):
     model = Event
     table_class = EventTable
     template_name = "events.html"
+    query_budget = 6
 
 
 class PurchaseListView(PermissionRequiredMixin, SingleTableView):
@@ -93,20 +142,39 @@ class PurchaseListView(PermissionRequiredMixin, SingleTableView):
     model = Purchase
     table_class = PurchaseTable
     template_name = "purchases.html"
+    query_budget = 6
+
+    def get_table_data(self):
+        return Purchase.objects.select_related("vendor")
 
 
-class StockpileListView(PermissionRequiredMixin, SingleTableView):
+class StockpileListView(
+    PermissionRequiredMixin, KeysetPaginationMixin, SingleTableView
+):
     permission_required = "orders.view_stockpile"
     model = Stockpile
     table_class = StockpileTable
     template_name = "stockpiles.html"
+    query_budget = 6
 
+    def get_table_data(self):
+        # The stock is annotated, so the database can sort by it
+        return Stockpile.objects.select_related("product", "purchase__vendor").annotate(
+            remaining_stock=F("amount") - F("pillaged_amount")
+        )
 
-class PillageListView(PermissionRequiredMixin, SingleTableView):
+
+class PillageListView(PermissionRequiredMixin, KeysetPaginationMixin, SingleTableView):
     permission_required = "orders.view_pillage"
     model = Pillage
     table_class = PillageTable
     template_name = "pillages.html"
+    query_budget = 6
+
+    def get_table_data(self):
+        return Pillage.objects.select_related(
+            "order__product", "order__team", "stockpile__product"
+        )
 
 
 # Not a View.
@@ -148,7 +216,7 @@ def order(request, order_id=None):
     if request.user.has_perm("orders.view_team"):
         my_teams = Team.objects.all()
     else:
-        my_teams = Team.objects.filter(members=request.user)
+        my_teams = Team.objects.filter(pk__in=user_team_ids(request.user))
 
     if request.method == "POST":
         if order_object:
@@ -181,7 +249,7 @@ def order(request, order_id=None):
                     states=_state_helper(request, order_object),
                 )
             elif (
-                request.user in order_object.team.members.all()
+                order_object.team_id in user_team_ids(request.user)
                 and order_object.state == "REQ"
             ):
                 form = OrderForm(
@@ -218,10 +286,9 @@ def order(request, order_id=None):
         if order_object:
             # view a existing order
 
-            if (
-                request.user.has_perm("orders.view_order")
-                or request.user in order_object.team.members.all()
-            ):
+            if request.user.has_perm(
+                "orders.view_order"
+            ) or order_object.team_id in user_team_ids(request.user):
                 # limit the states
                 my_states = _state_helper(request, order_object)
 
@@ -275,7 +342,7 @@ def delete_order(request, order_id=None):
     order_object = get_object_or_404(Order, id=order_id)
     if (
         request.user.has_perm("orders.delete_order")
-        and request.user in order_object.team.members.all()
+        and order_object.team_id in user_team_ids(request.user)
         and order_object.state == "REQ"
     ) or request.user.has_perm("orders.delete_order_all_teams"):
         order_object.delete()
@@ -377,6 +444,61 @@ def delete_event(request, event_id=None):
     return redirect("events")
 
 
+SEARCH_RESULT_VIEWS = {
+    "product": "edit_product",
+    "order": "edit_order",
+    "vendor": "edit_vendor",
+}
+
+
+def _search_results(request):
+    """ Searches for ?q= in everything the user may see """
+    kinds = ["order"]
+    if request.user.has_perm("orders.view_product"):
+        kinds.append("product")
+    if request.user.has_perm("orders.view_vendor"):
+        kinds.append("vendor")
+
+    teams = None
+    if not request.user.has_perm("orders.view_order"):
+        teams = user_team_ids(request.user)
+
+    return [
+        {
+            "kind": result.kind,
+            "id": result.pk,
+            "text": result.text,
+            "score": result.score,
+            "url": reverse(SEARCH_RESULT_VIEWS[result.kind], args=[result.pk]),
+        }
+        for result in search_index(request.GET.get("q", ""), kinds=kinds, teams=teams)
+    ]
+
+
+@login_required
+def search(request):
+    return render(
+        request,
+        "search.html",
+        {"query": request.GET.get("q", ""), "results": _search_results(request)},
+    )
+
+
+@login_required
+def search_api(request):
+    """ The search results as JSON, the best match first """
+    return JsonResponse({"results": _search_results(request)})
+
+
+@login_required
+def product_autocomplete(request):
+    """
+    Names of products that contain ?q=, for the autocompletion of the order form. Everyone who can order sees the
+    product names anyway.
+    """
+    return JsonResponse({"results": search_product_names(request.GET.get("q", ""))})
+
+
 @login_required
 @permission_required("orders.view_product", raise_exception=True)
 def product(request, product_id=None):
@@ -459,52 +581,99 @@ def delete_team(request, team_id=None):
     return redirect("teams")
 
 
+def _export_response(request, name, columns, rows):
+    """
+    Streams the rows in the format the request asks for with ?format=, CSV by default.
+
+    :param name: the name of the file without extension
+    """
+    export_format = request.GET.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest(
+            f"Unknown format '{export_format}', use one of {', '.join(EXPORT_FORMATS)}"
+        )
+    writer, content_type = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(writer(columns, rows), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{name}.{export_format}"'
+    return response
+
+
 @login_required
 @permission_required("orders.export_csv", raise_exception=True)
 def export_orders_csv(request):
-    # TODO: This whole view needs to be reworked once we have updated the product/product suggestion thing
-    if request.user.has_perm("orders.view_order"):
-        orders = Order.objects.all()
+    """
+    All orders the user may see, streamed while they are read.
+
+    With ?since=<ISO 8601 timestamp> or ?cursor=<X-Export-Cursor of an earlier export>, only the orders created,
+    changed or deleted since then are exported, with their ids.
+    """
+    try:
+        since = export_since(request.GET.get("since"), request.GET.get("cursor"))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    # Taken before reading, so nothing that changes while the export runs is missed by the next one
+    cursor = export_cursor(timezone.now())
+
+    orders = Order.objects.all()
+    deleted_orders = DeletedOrder.objects.all()
+    if not request.user.has_perm("orders.view_order"):
+        team_ids = user_team_ids(request.user)
+        orders = orders.filter(team_id__in=team_ids)
+        deleted_orders = deleted_orders.filter(team_id__in=team_ids)
+
+    if since is None:
+        columns, rows = ORDER_COLUMNS, order_rows(orders)
     else:
-        orders = Order.objects.filter(team__members=request.user)
-
-    # Create the HttpResponse object with the appropriate CSV header.
-    response = HttpResponse(content_type="text/csv")
-    response["Content-Disposition"] = 'attachment; filename="squirrel-export.csv"'
-
-    # Get the names of the model fields
-    field_names = [
-        "Amount",
-        "Item",
-        "URL",
-        "State",
-        "Unit price",
-        "Total price",
-        "Event",
-        "Team",
-    ]
+        columns = DELTA_COLUMNS
+        rows = chain(
+            order_rows(
+                orders.filter(updated_at__gt=since - CURSOR_OVERLAP), delta=True
+            ),
+            deleted_order_rows(
+                deleted_orders.filter(deleted_at__gt=since - CURSOR_OVERLAP)
+            ),
+        )
 
-    lines = [field_names]
+    response = _export_response(request, "squirrel-export", columns, rows)
+    response["X-Export-Cursor"] = cursor
+    return response
 
-    for order_instance in orders:
-        # TODO: Add prices back
 
-        lines.append(
-            [
-                order_instance.amount,
-                order_instance.product,
-                order_instance.url,
-                order_instance.get_state_display(),
-                order_instance.event,
-                order_instance.team,
-            ]
-        )
+@login_required
+@permission_required("orders.view_purchase", raise_exception=True)
+def export_purchases(request):
+    """ All purchases with their totals, streamed while they are read """
+    return _export_response(
+        request,
+        "squirrel-purchases",
+        PURCHASE_COLUMNS,
+        purchase_rows(Purchase.objects.all()),
+    )
 
-    writer = csv.writer(response)
-    for line in lines:
-        writer.writerow(line)
 
-    return response
+@login_required
+@permission_required("orders.view_stockpile", raise_exception=True)
+def export_stockpiles(request):
+    """ All stockpiles with their remaining stock, streamed while they are read """
+    return _export_response(
+        request,
+        "squirrel-stockpiles",
+        STOCKPILE_COLUMNS,
+        stockpile_rows(Stockpile.objects.all()),
+    )
+
+
+@login_required
+@permission_required("orders.view_pillage", raise_exception=True)
+def export_pillages(request):
+    """ All pillages with their orders and stockpiles, streamed while they are read """
+    return _export_response(
+        request,
+        "squirrel-pillages",
+        PILLAGE_COLUMNS,
+        pillage_rows(Pillage.objects.all()),
+    )
 
 
 @login_required
@@ -517,6 +686,7 @@ def purchase(request, purchase_id=None):
         purchase_object = get_object_or_404(Purchase, id=purchase_id)
     else:
         purchase_object = None
+    preview = None
 
     if request.method == "POST":
         if purchase_object:
@@ -533,14 +703,19 @@ def purchase(request, purchase_id=None):
                 raise PermissionDenied
 
         if form.is_valid() and formset.is_valid():
-            p = form.save()
-            formset.save()
-            return redirect(f"/purchases/{p.id}")
+            if "preview" in request.POST:
+                preview = PillagePlanTable(
+                    plan_allocation(stockpiles=formset.save(commit=False))
+                )
+            else:
+                p = form.save()
+                formset.save()
+                return redirect(f"/purchases/{p.id}")
 
     else:
         if purchase_object:
             form = PurchaseForm(instance=purchase_object)
-            formset = StockpileFormSet(instance=Purchase.objects.get(id=purchase_id))
+            formset = StockpileFormSet(instance=purchase_object)
 
         else:
             form = PurchaseForm()
@@ -557,7 +732,13 @@ def purchase(request, purchase_id=None):
     return render(
         request,
         "purchase.html",
-        {"form": form, "formset": formset, "sum_net": sum_net, "sum_gross": sum_gross},
+        {
+            "form": form,
+            "formset": formset,
+            "sum_net": sum_net,
+            "sum_gross": sum_gross,
+            "preview": preview,
+        },
     )
 
 
@@ -576,6 +757,7 @@ def stockpile(request, stockpile_id=None):
         stockpile_object = get_object_or_404(Stockpile, id=stockpile_id)
     else:
         stockpile_object = None
+    preview = None
 
     if request.method == "POST":
         if stockpile_object:
@@ -590,8 +772,13 @@ def stockpile(request, stockpile_id=None):
                 raise PermissionDenied
 
         if form.is_valid():
-            stockpile_object = form.save()
-            return redirect("stockpiles")
+            if "preview" in request.POST:
+                preview = PillagePlanTable(
+                    plan_allocation(stockpiles=[form.save(commit=False)])
+                )
+            else:
+                stockpile_object = form.save()
+                return redirect("stockpiles")
     else:
         if stockpile_object:
             if request.user.has_perm("orders.view_stockpile"):
@@ -605,7 +792,9 @@ def stockpile(request, stockpile_id=None):
                 raise PermissionDenied
 
     return render(
-        request, "stockpile.html", {"form": form, "events": Event.objects.all()}
+        request,
+        "stockpile.html",
+        {"form": form, "events": Event.objects.all(), "preview": preview},
     )
 
 
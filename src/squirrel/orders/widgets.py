@@ -4,42 +4,10 @@ It has not been cleaned up yet.
 """
 
 from django import forms
-from django.template import Context, loader
+from django.core.cache import cache
 from django.utils import formats
 from django.utils.encoding import force_text
-
-
-class DictContext(dict):
-    pass
-
-
-REQUIRED_CONTEXT_ATTRIBTUES = (
-    "_form_config",
-    "_form_render",
-)
-
-
-def flatten_context(context):
-    if isinstance(context, Context):
-        flat = {}
-        for d in context.dicts:
-            flat.update(d)
-        return flat
-    else:
-        return context
-
-
-def flatten_contexts(*contexts):
-    """Takes a list of context instances and returns a new dict that
-    combines all of them."""
-    new_context = DictContext()
-    for context in contexts:
-        if context is not None:
-            new_context.update(flatten_context(context))
-            for attr in REQUIRED_CONTEXT_ATTRIBTUES:
-                if hasattr(context, attr):
-                    setattr(new_context, attr, getattr(context, attr))
-    return new_context
+from django.utils.safestring import mark_safe
 
 
 class Widget(forms.Widget):
@@ -76,21 +44,31 @@ class Widget(forms.Widget):
 
 
 class Input(Widget):
+    """
+    An input with optional suggestions in a <datalist>.
+
+    The datalist is a list or a function that returns one. If datalist_version is given, it is a function that
+    returns a token that changes whenever the datalist does, and the rendered <datalist> is cached until then. The
+    suggestions are then neither loaded nor rendered for every form.
+    """
+
     template_name = "widgets/input.html"
+    datalist_template_name = "widgets/datalist.html"
     input_type = None
     datalist = None
+    datalist_version = None
 
     def __init__(self, *args, **kwargs):
         datalist = kwargs.pop("datalist", None)
         if datalist is not None:
             self.datalist = datalist
+        datalist_version = kwargs.pop("datalist_version", None)
+        if datalist_version is not None:
+            self.datalist_version = datalist_version
         template_name = kwargs.pop("template_name", None)
         if template_name is not None:
             self.template_name = template_name
         super(Input, self).__init__(*args, **kwargs)
-        # This attribute is used to inject a surrounding context in the
-        # floppyforms templatetags, when rendered inside a complete form.
-        self.context_instance = None
 
     def get_context_data(self):
         return {}
@@ -133,17 +111,35 @@ class Input(Widget):
                 if not isinstance(attr, bool):
                     context["attrs"][key] = str(attr)
 
-        if self.datalist is not None:
-            context["datalist"] = self.datalist
+        context["list_id"] = f"{context['attrs'].get('id', name)}_list"
         return context
 
-    def render(self, name, value, attrs=None, **kwargs):
-        template_name = kwargs.pop("template_name", None)
-        if template_name is None:
-            template_name = self.template_name
+    def render(self, name, value, attrs=None, renderer=None, template_name=None):
         context = self.get_context(name, value, attrs=attrs or {})
-        context = flatten_contexts(self.context_instance, context)
-        return loader.render_to_string(template_name, context)
+        if self.datalist is not None:
+            context["datalist"] = self.render_datalist(context["list_id"], renderer)
+        return self._render(template_name or self.template_name, context, renderer)
+
+    def render_datalist(self, list_id, renderer=None):
+        """ The rendered <datalist>, from the cache if there is a datalist_version """
+        if self.datalist_version is None:
+            return self._render_datalist(list_id, renderer)
+
+        key = f"widgets:datalist:{list_id}:{self.datalist_version()}"
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = self._render_datalist(list_id, renderer)
+            # Fragments of old versions are never read again, they just expire
+            cache.set(key, fragment, 24 * 60 * 60)
+        return mark_safe(fragment)
+
+    def _render_datalist(self, list_id, renderer):
+        items = self.datalist() if callable(self.datalist) else self.datalist
+        if not items:
+            return ""
+        return self._render(
+            self.datalist_template_name, {"list_id": list_id, "items": items}, renderer
+        )
 
 
 class TextInput(Input):
@@ -154,3 +150,19 @@ class TextInput(Input):
         if kwargs.get("attrs", None) is not None:
             self.input_type = kwargs["attrs"].pop("type", self.input_type)
         super(TextInput, self).__init__(*args, **kwargs)
+
+
+class AutocompleteInput(TextInput):
+    """
+    A text input that fetches its suggestions while the user types instead of shipping all of them with the page.
+    The url is called with ?q=<what was typed> and has to answer with {"results": [...]}.
+    """
+
+    template_name = "widgets/autocomplete.html"
+
+    def __init__(self, *args, **kwargs):
+        self.url = kwargs.pop("url")
+        super(AutocompleteInput, self).__init__(*args, **kwargs)
+
+    def get_context_data(self):
+        return {"url": str(self.url)}
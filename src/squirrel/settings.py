@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
 
 from decouple import config
 
@@ -41,11 +42,15 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.forms",
     "squirrel.orders",
     "crispy_forms",
     "django_tables2",
 ]
 
+# Render form widgets with the templates configured below, so the widgets in templates/widgets are found
+FORM_RENDERER = "django.forms.renderers.TemplatesSetting"
+
 # Which templates to use for crispy_forms
 CRISPY_TEMPLATE_PACK = "bootstrap4"
 
@@ -72,6 +77,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "squirrel.orders.permissions.permissions",
             ],
         },
     },
@@ -87,9 +93,56 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
+        # How long to wait for the write lock of another worker, in seconds
+        "OPTIONS": {"timeout": config("DATABASE_TIMEOUT", default=20, cast=int)},
     }
 }
 
+# Tests of parallel writers need a database file, as SQLite only supports parallel writers on files. They are
+# skipped on the in-memory database that tests use by default.
+TEST_DATABASE_NAME = config("TEST_DATABASE_NAME", default="")
+if TEST_DATABASE_NAME:
+    DATABASES["default"]["TEST"] = {"NAME": TEST_DATABASE_NAME}
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Permissions, team memberships and the product catalog are cached. All processes that serve squirrel have to share
+# the cache, or they would not see that something changed. By default it is kept in the database, in the table
+# created by python3 manage.py createcachetable.
+
+CACHES = {
+    "default": {
+        "BACKEND": config(
+            "CACHE_BACKEND", default="django.core.cache.backends.db.DatabaseCache"
+        ),
+        "LOCATION": config("CACHE_LOCATION", default="squirrel_cache"),
+    }
+}
+
+# Caches in the memory of a process are only shared if there is a single process. Permissions and team memberships
+# are not cached across requests unless the cache is shared.
+CACHE_SHARED = config(
+    "CACHE_SHARED",
+    default=CACHES["default"]["BACKEND"]
+    not in (
+        "django.core.cache.backends.locmem.LocMemCache",
+        "django.core.cache.backends.dummy.DummyCache",
+    ),
+    cast=bool,
+)
+
+# Tests run in a single process and count queries, so they keep the cache in memory
+if sys.argv[1:2] == ["test"]:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    CACHE_SHARED = True
+
+
+# Authentication
+# The ModelBackend, with the permissions of users cached across requests
+
+AUTHENTICATION_BACKENDS = ["squirrel.orders.backends.CachedModelBackend"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -148,6 +201,22 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = os.path.join(BASE_DIR, "public")
 
+# Allocation of stock to orders
+# Which orders are filled first: fifo, smallest, largest or priority
+ALLOCATION_STRATEGY = config("ALLOCATION_STRATEGY", default="fifo")
+
+# For the priority strategy: names of teams and events whose orders are filled first, highest priority first
+ALLOCATION_PRIORITY_TEAMS = config(
+    "ALLOCATION_PRIORITY_TEAMS",
+    default="",
+    cast=lambda v: [s.strip() for s in v.split(",") if s.strip()],
+)
+ALLOCATION_PRIORITY_EVENTS = config(
+    "ALLOCATION_PRIORITY_EVENTS",
+    default="",
+    cast=lambda v: [s.strip() for s in v.split(",") if s.strip()],
+)
+
 # Login and logout config
 LOGOUT_REDIRECT_URL = "login"
 LOGIN_REDIRECT_URL = "orders"
@@ -155,6 +224,18 @@ LOGIN_REDIRECT_URL = "orders"
 # django-tables2 config
 DJANGO_TABLES2_TEMPLATE = "django_tables2/bootstrap4.html"
 
+# Page the order, stockpile and pillage lists by id instead of counting and skipping rows, for large databases.
+# The lists are then always sorted newest first.
+KEYSET_PAGINATION = config("KEYSET_PAGINATION", default=False, cast=bool)
+
+# Let the order form fetch product suggestions while typing instead of listing all products in the page
+PRODUCT_AUTOCOMPLETE = config("PRODUCT_AUTOCOMPLETE", default=False, cast=bool)
+
+# How many days deleted orders are remembered for the delta export, see the prune_deleted_orders command
+DELETED_ORDERS_RETENTION_DAYS = config(
+    "DELETED_ORDERS_RETENTION_DAYS", default=90, cast=int
+)
+
 # Test running
 TEST_RUNNER = "django_nose.NoseTestSuiteRunner"
 
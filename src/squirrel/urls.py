@@ -44,7 +44,14 @@ urlpatterns = [
     path("orders/<int:order_id>", views.order, name="edit_order"),
     path("orders/delete/<int:order_id>", views.delete_order, name="delete_order"),
     path("orders/export", views.export_orders_csv, name="export_orders_csv"),
+    path("search", views.search, name="search"),
+    path("search.json", views.search_api, name="search_api"),
     path("products", views.ProductListView.as_view(), name="products"),
+    path(
+        "products/autocomplete",
+        views.product_autocomplete,
+        name="product_autocomplete",
+    ),
     path("products/new", views.product, name="new_product"),
     path("products/<int:product_id>", views.product, name="edit_product"),
     path(
@@ -63,6 +70,7 @@ urlpatterns = [
     path("events/<int:event_id>", views.event, name="edit_event"),
     path("events/delete/<int:event_id>", views.delete_event, name="delete_event"),
     path("purchases", views.PurchaseListView.as_view(), name="purchases"),
+    path("purchases/export", views.export_purchases, name="export_purchases"),
     path("purchases/new", views.purchase, name="new_purchase"),
     path("purchases/<int:purchase_id>", views.purchase, name="edit_purchase"),
     path(
@@ -71,6 +79,7 @@ urlpatterns = [
         name="delete_purchase",
     ),
     path("stockpiles", views.StockpileListView.as_view(), name="stockpiles"),
+    path("stockpiles/export", views.export_stockpiles, name="export_stockpiles"),
     path("stockpiles/new", views.stockpile, name="new_stockpile"),
     path("stockpiles/<int:stockpile_id>", views.stockpile, name="edit_stockpile"),
     path(
@@ -79,6 +88,7 @@ urlpatterns = [
         name="delete_stockpile",
     ),
     path("pillages", views.PillageListView.as_view(), name="pillages"),
+    path("pillages/export", views.export_pillages, name="export_pillages"),
     path("pillages/new", views.pillage, name="new_pillage"),
     path("pillages/<int:pillage_id>", views.pillage, name="edit_pillage"),
     path(
@@ -0,0 +1,46 @@
+/*
+ * Fills the datalist of inputs with a data-autocomplete url with suggestions while the user types.
+ * The url is called with ?q=<input> and answers with {"results": [...]}.
+ */
+(function () {
+  "use strict";
+
+  function attach(input) {
+    if (input.dataset.autocompleteAttached) {
+      return;
+    }
+    input.dataset.autocompleteAttached = "true";
+
+    var datalist = document.getElementById(input.getAttribute("list"));
+    var timer = null;
+    var last = null;
+
+    input.addEventListener("input", function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        var term = input.value.trim();
+        if (!term || term === last) {
+          return;
+        }
+        last = term;
+
+        fetch(input.dataset.autocomplete + "?q=" + encodeURIComponent(term), {credentials: "same-origin"})
+          .then(function (response) { return response.json(); })
+          .then(function (data) {
+            // Answers to older requests are dropped
+            if (term !== last) {
+              return;
+            }
+            datalist.innerHTML = "";
+            data.results.forEach(function (name) {
+              var option = document.createElement("option");
+              option.value = name;
+              datalist.appendChild(option);
+            });
+          });
+      }, 150);
+    });
+  }
+
+  document.querySelectorAll("input[data-autocomplete]").forEach(attach);
+})();
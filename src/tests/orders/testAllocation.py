@@ -0,0 +1,311 @@
+import random
+from io import StringIO
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from squirrel.orders.allocation import (
+    STRATEGIES,
+    Allocation,
+    Demand,
+    FifoStrategy,
+    LargestFirstStrategy,
+    PriorityStrategy,
+    SmallestFirstStrategy,
+    Supply,
+    allocate,
+    allocate_cumulative,
+    get_strategy,
+)
+from squirrel.orders.models import Order, Pillage, Product, Stockpile, Team
+from squirrel.orders.planning import plan_allocation
+
+
+class AllocateTests(TestCase):
+    def test_fills_in_given_order(self):
+        allocations = allocate(
+            [Demand(1, 3), Demand(2, 5), Demand(3, 4)], [Supply(10, 6), Supply(11, 4)]
+        )
+        self.assertEqual(
+            allocations,
+            [
+                Allocation(1, 10, 3),
+                Allocation(2, 10, 3),
+                Allocation(2, 11, 2),
+                Allocation(3, 11, 2),
+            ],
+        )
+
+    def test_stops_when_demand_is_met(self):
+        allocations = allocate([Demand(1, 3)], [Supply(10, 2), Supply(11, 4)])
+        self.assertEqual(allocations, [Allocation(1, 10, 2), Allocation(1, 11, 1)])
+
+    def test_skips_empty_entries(self):
+        allocations = allocate(
+            [Demand(1, 0), Demand(2, 2)], [Supply(10, 0), Supply(11, 4)]
+        )
+        self.assertEqual(allocations, [Allocation(2, 11, 2)])
+
+    def test_nothing_to_allocate(self):
+        self.assertEqual(allocate([], [Supply(10, 2)]), [])
+        self.assertEqual(allocate([Demand(1, 2)], []), [])
+
+
+class StockpileAllocationBenchmark(TestCase):
+    """ Saving a stockpile must take the same number of queries for any number of open orders """
+
+    def setUp(self) -> None:
+        self.team = Team.objects.create(name="Procurement")
+
+    def queries_for_stockpile(self, order_count):
+        product = Product.objects.create(name=f"Product {Product.objects.count()}")
+        for _ in range(order_count):
+            Order.objects.create(product=product, team=self.team, amount=2)
+
+        with CaptureQueriesContext(connection) as context:
+            stockpile = Stockpile.objects.create(
+                product=product, amount=order_count * 2, unit_price=100, tax=1.19
+            )
+
+        stockpile.refresh_from_db()
+        self.assertEqual(stockpile.stock, 0)
+        self.assertEqual(
+            Pillage.objects.filter(stockpile=stockpile).count(), order_count
+        )
+        self.assertFalse(
+            Order.objects.filter(product=product, pillaged_amount__lt=2).exists()
+        )
+
+        return len(context.captured_queries)
+
+    def test_query_count_is_constant(self):
+        self.assertEqual(self.queries_for_stockpile(1), self.queries_for_stockpile(5))
+        self.assertEqual(self.queries_for_stockpile(5), self.queries_for_stockpile(150))
+
+
+class OrderAllocationBenchmark(TestCase):
+    """ Saving an order must take the same number of queries for any number of stockpiles """
+
+    def setUp(self) -> None:
+        self.team = Team.objects.create(name="Procurement")
+
+    def queries_for_order(self, stockpile_count):
+        product = Product.objects.create(name=f"Product {Product.objects.count()}")
+        for _ in range(stockpile_count):
+            Stockpile.objects.create(
+                product=product, amount=3, unit_price=100, tax=1.19
+            )
+
+        with CaptureQueriesContext(connection) as context:
+            order = Order.objects.create(
+                product=product, team=self.team, amount=stockpile_count * 3
+            )
+
+        self.assertEqual(order.to_pillage, 0)
+        self.assertEqual(Pillage.objects.filter(order=order).count(), stockpile_count)
+        self.assertFalse(
+            Stockpile.objects.filter(product=product, pillaged_amount__lt=3).exists()
+        )
+
+        return len(context.captured_queries)
+
+    def test_query_count_is_constant(self):
+        self.assertEqual(self.queries_for_order(1), self.queries_for_order(5))
+        self.assertEqual(self.queries_for_order(5), self.queries_for_order(150))
+
+    def test_update_takes_only_what_is_missing(self):
+        product = Product.objects.create(name="Growing order")
+        Stockpile.objects.create(product=product, amount=10, unit_price=100, tax=1.19)
+        order = Order.objects.create(product=product, team=self.team, amount=4)
+
+        order.amount = 6
+        order.save()
+
+        order.refresh_from_db()
+        self.assertEqual(order.pillaged_amount, 6)
+        self.assertEqual(Pillage.objects.filter(order=order).count(), 2)
+
+
+class StrategyTests(TestCase):
+    demand = [
+        Demand(1, 5, "Helpdesk", "36C3"),
+        Demand(2, 1, "Bar", "36C3"),
+        Demand(3, 9, "Bar", "Camp"),
+        Demand(4, 2, "NOC", "Camp"),
+    ]
+
+    def filled_orders(self, strategy, stock):
+        return [a.order_id for a in strategy.allocate(self.demand, [Supply(1, stock)])]
+
+    def test_fifo(self):
+        self.assertEqual(self.filled_orders(FifoStrategy(), 7), [1, 2, 3])
+
+    def test_smallest_first(self):
+        self.assertEqual(self.filled_orders(SmallestFirstStrategy(), 9), [2, 4, 1, 3])
+
+    def test_largest_first(self):
+        self.assertEqual(self.filled_orders(LargestFirstStrategy(), 12), [3, 1])
+
+    def test_priority(self):
+        strategy = PriorityStrategy(teams=["NOC"], events=["Camp"])
+        self.assertEqual(self.filled_orders(strategy, 20), [4, 3, 1, 2])
+
+    @override_settings(ALLOCATION_STRATEGY="smallest")
+    def test_configured_strategy(self):
+        self.assertIsInstance(get_strategy(), SmallestFirstStrategy)
+
+    @override_settings(
+        ALLOCATION_STRATEGY="priority", ALLOCATION_PRIORITY_TEAMS=["Bar"]
+    )
+    def test_configured_priority(self):
+        self.assertEqual(self.filled_orders(get_strategy(), 6), [2, 3])
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ImproperlyConfigured, get_strategy, "random")
+
+    @override_settings(ALLOCATION_STRATEGY="largest")
+    def test_stockpile_uses_configured_strategy(self):
+        team = Team.objects.create(name="Procurement")
+        product = Product.objects.create(name="Portal gun")
+        small = Order.objects.create(product=product, team=team, amount=1)
+        large = Order.objects.create(product=product, team=team, amount=4)
+
+        Stockpile.objects.create(product=product, amount=4, unit_price=100, tax=1.19)
+
+        self.assertEqual(
+            list(Pillage.objects.values_list("order_id", "amount")), [(large.pk, 4)]
+        )
+        small.refresh_from_db()
+        self.assertEqual(small.to_pillage, 1)
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command("benchmark_allocation", "--orders", "10000", stdout=out)
+        for name in STRATEGIES:
+            self.assertIn(name, out.getvalue())
+
+    def test_benchmark_without_orders(self):
+        self.assertRaises(
+            CommandError,
+            call_command,
+            "benchmark_allocation",
+            "--orders",
+            "0",
+            stdout=StringIO(),
+        )
+
+    def test_benchmark_fill_rate(self):
+        out = StringIO()
+        call_command(
+            "benchmark_allocation",
+            "--orders",
+            "100",
+            "--stockpiles",
+            "1",
+            "--supply-ratio",
+            "0.5",
+            stdout=out,
+        )
+        # All stock is handed out, so half of the ordered items are allocated whatever the strategy
+        for line in out.getvalue().splitlines()[2:]:
+            self.assertTrue(line.endswith("50.0%"), line)
+
+
+class AllocateCumulativeTests(TestCase):
+    def test_same_result_as_allocate(self):
+        rng = random.Random(42)
+        for _ in range(50):
+            demand = [Demand(i, rng.randint(0, 20)) for i in range(rng.randint(0, 30))]
+            supply = [Supply(i, rng.randint(0, 40)) for i in range(rng.randint(0, 10))]
+            self.assertEqual(
+                allocate_cumulative(demand, supply), allocate(demand, supply)
+            )
+
+
+class PlanAllocationTests(TestCase):
+    def setUp(self) -> None:
+        self.team = Team.objects.create(name="Procurement")
+        self.product = Product.objects.create(name="Club-Mate")
+        self.other_product = Product.objects.create(name="Tschunk")
+        self.first = Order.objects.create(
+            product=self.product, team=self.team, amount=3
+        )
+        self.second = Order.objects.create(
+            product=self.product, team=self.team, amount=5
+        )
+
+    def planned(self, pillages):
+        return [(p.order, p.stockpile, p.amount) for p in pillages]
+
+    def test_stockpile_fills_open_orders(self):
+        stockpile = Stockpile(amount=6, product=self.product, unit_price=100, tax=1.19)
+        with self.assertNumQueries(1):
+            pillages = plan_allocation(stockpiles=[stockpile])
+        self.assertEqual(
+            self.planned(pillages),
+            [(self.first, stockpile, 3), (self.second, stockpile, 3)],
+        )
+
+    def test_nothing_is_written(self):
+        plan_allocation(
+            stockpiles=[
+                Stockpile(amount=6, product=self.product, unit_price=100, tax=1.19)
+            ]
+        )
+        self.assertFalse(Pillage.objects.exists())
+        self.assertFalse(Stockpile.objects.exists())
+
+    def test_stockpiles_are_played_through_in_order(self):
+        stockpiles = [
+            Stockpile(amount=2, product=self.product, unit_price=100, tax=1.19),
+            Stockpile(amount=9, product=self.product, unit_price=100, tax=1.19),
+            Stockpile(amount=4, product=self.other_product, unit_price=100, tax=1.19),
+        ]
+        with self.assertNumQueries(1):
+            pillages = plan_allocation(stockpiles=stockpiles)
+        self.assertEqual(
+            self.planned(pillages),
+            [
+                (self.first, stockpiles[0], 2),
+                (self.first, stockpiles[1], 1),
+                (self.second, stockpiles[1], 5),
+            ],
+        )
+
+    def test_orders_take_from_stock(self):
+        stockpile = Stockpile.objects.create(
+            amount=10, product=self.product, unit_price=100, tax=1.19
+        )
+        order = Order(product=self.product, team=self.team, amount=4)
+        with self.assertNumQueries(1):
+            pillages = plan_allocation(orders=[order])
+        self.assertEqual(self.planned(pillages), [(order, stockpile, 2)])
+
+    def test_product_uses_strategy(self):
+        Stockpile.objects.create(
+            amount=10, product=self.product, unit_price=100, tax=1.19
+        )
+        # Orders that were never allocated, e.g. from an import
+        Order.objects.bulk_create(
+            [
+                Order(product=self.product, team=self.team, amount=8),
+                Order(product=self.product, team=self.team, amount=1),
+            ]
+        )
+
+        pillages = plan_allocation(
+            product=self.product, strategy=SmallestFirstStrategy()
+        )
+        self.assertEqual(
+            [(p.order.amount, p.amount) for p in pillages], [(1, 1), (8, 1)]
+        )
+
+    def test_changed_stockpile_uses_its_new_amount(self):
+        stockpile = Stockpile.objects.create(
+            amount=4, product=self.product, unit_price=100, tax=1.19
+        )
+        stockpile.amount = 6
+        pillages = plan_allocation(stockpiles=[stockpile])
+        self.assertEqual(self.planned(pillages), [(self.second, stockpile, 2)])
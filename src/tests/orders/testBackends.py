@@ -0,0 +1,118 @@
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from squirrel.orders.backends import check_cache_shared, user_team_ids
+from squirrel.orders.models import Event, Order, Product, Team
+
+
+class AccessCacheTests(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user("engel", password="engel")
+        self.team = Team.objects.create(name="NOC")
+        self.other_team = Team.objects.create(name="POC")
+        self.team.members.add(self.user)
+
+    def fresh_user(self):
+        """ A new instance, as for the next request """
+        return User.objects.get(pk=self.user.pk)
+
+    def test_warm_request_needs_no_authorization_queries(self):
+        self.user.user_permissions.add(Permission.objects.get(codename="request_order"))
+        order = Order.objects.create(
+            product=Product.objects.create(name="Mate"),
+            team=self.team,
+            event=Event.objects.create(name="36C3"),
+        )
+        self.client.login(username="engel", password="engel")
+        self.client.get(f"/orders/{order.pk}")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/orders/{order.pk}")
+
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            self.assertNotIn("auth_permission", query["sql"])
+            self.assertNotIn("auth_user_groups", query["sql"])
+            self.assertNotIn("orders_team_members", query["sql"])
+
+    def test_permissions_cached(self):
+        self.assertFalse(self.fresh_user().has_perm("orders.view_vendor"))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(self.fresh_user().has_perm("orders.view_vendor"))
+        self.assertEqual(len(queries), 1)  # Only the user itself
+
+    def test_user_permissions_changed(self):
+        self.assertFalse(self.fresh_user().has_perm("orders.view_vendor"))
+        permission = Permission.objects.get(codename="view_vendor")
+
+        self.user.user_permissions.add(permission)
+        self.assertTrue(self.fresh_user().has_perm("orders.view_vendor"))
+
+        permission.user_set.remove(self.user)
+        self.assertFalse(self.fresh_user().has_perm("orders.view_vendor"))
+
+    def test_group_permissions_changed(self):
+        group = Group.objects.create(name="Einkauf")
+        self.assertFalse(self.fresh_user().has_perm("orders.view_vendor"))
+
+        self.user.groups.add(group)
+        group.permissions.add(Permission.objects.get(codename="view_vendor"))
+        self.assertTrue(self.fresh_user().has_perm("orders.view_vendor"))
+
+        group.delete()
+        self.assertFalse(self.fresh_user().has_perm("orders.view_vendor"))
+
+    def test_superuser(self):
+        self.assertFalse(self.fresh_user().get_all_permissions())
+        self.user.is_superuser = True
+        self.user.save()
+        self.assertIn("orders.view_vendor", self.fresh_user().get_all_permissions())
+
+    def test_teams_cached(self):
+        self.assertEqual(user_team_ids(self.fresh_user()), {self.team.pk})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(user_team_ids(self.fresh_user()), {self.team.pk})
+        self.assertEqual(len(queries), 1)  # Only the user itself
+
+    def test_team_members_changed(self):
+        self.assertEqual(user_team_ids(self.fresh_user()), {self.team.pk})
+
+        self.other_team.members.add(self.user)
+        self.assertEqual(
+            user_team_ids(self.fresh_user()), {self.team.pk, self.other_team.pk}
+        )
+
+        self.user.team_set.remove(self.team)
+        self.assertEqual(user_team_ids(self.fresh_user()), {self.other_team.pk})
+
+        self.other_team.members.clear()
+        self.assertEqual(user_team_ids(self.fresh_user()), set())
+
+    def test_team_deleted(self):
+        self.assertEqual(user_team_ids(self.fresh_user()), {self.team.pk})
+        self.team.delete()
+        self.assertEqual(user_team_ids(self.fresh_user()), set())
+
+    @override_settings(CACHE_SHARED=False)
+    def test_not_cached_unless_shared(self):
+        self.assertFalse(self.fresh_user().has_perm("orders.view_vendor"))
+        self.assertEqual(user_team_ids(self.fresh_user()), {self.team.pk})
+
+        # Without signals, as if another process had made the changes
+        User.user_permissions.through.objects.create(
+            user=self.user, permission=Permission.objects.get(codename="view_vendor")
+        )
+        Team.members.through.objects.filter(user=self.user).delete()
+
+        self.assertTrue(self.fresh_user().has_perm("orders.view_vendor"))
+        self.assertEqual(user_team_ids(self.fresh_user()), set())
+
+    def test_check_cache_shared(self):
+        self.assertEqual(check_cache_shared(None), [])
+        with override_settings(CACHE_SHARED=False):
+            self.assertEqual(
+                [message.id for message in check_cache_shared(None)], ["orders.W001"]
+            )
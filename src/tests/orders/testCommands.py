@@ -0,0 +1,171 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from squirrel.orders.models import (
+    DeletedOrder,
+    Event,
+    Order,
+    Pillage,
+    Product,
+    Stockpile,
+    Team,
+)
+
+
+class CheckPillageCountersTests(TestCase):
+    def setUp(self) -> None:
+        team = Team.objects.create(name="Procurement")
+        product = Product.objects.create(name="Dr. Cave Johnson")
+        self.order = Order.objects.create(product=product, team=team, amount=8)
+        self.stockpile = Stockpile.objects.create(
+            amount=10, product=product, unit_price=13370, tax=1.24
+        )
+
+    def test_consistent(self):
+        out = StringIO()
+        call_command("check_pillage_counters", stdout=out)
+        self.assertIn("All counters are consistent.", out.getvalue())
+
+    def test_inconsistent(self):
+        Stockpile.objects.filter(pk=self.stockpile.pk).update(pillaged_amount=3)
+        out = StringIO()
+        self.assertRaises(
+            CommandError, call_command, "check_pillage_counters", stdout=out
+        )
+        self.assertIn(
+            f"Stockpile {self.stockpile.pk}: counter is 3, pillages sum up to 8",
+            out.getvalue(),
+        )
+
+    def test_repair(self):
+        Order.objects.filter(pk=self.order.pk).update(pillaged_amount=0)
+        call_command("check_pillage_counters", "--repair", stdout=StringIO())
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.pillaged_amount, 8)
+
+
+class ReallocateTests(TestCase):
+    def setUp(self) -> None:
+        self.team = Team.objects.create(name="Procurement")
+        self.product = Product.objects.create(name="Club-Mate")
+        self.camp = Event.objects.create(name="Camp")
+        self.congress = Event.objects.create(name="Congress")
+
+        self.stockpile = Stockpile.objects.create(
+            amount=10, product=self.product, unit_price=1000, tax=1.19
+        )
+        self.camp_order = Order.objects.create(
+            product=self.product, team=self.team, amount=6, event=self.camp
+        )
+        self.congress_order = Order.objects.create(
+            product=self.product, team=self.team, amount=6, event=self.congress
+        )
+
+    def amounts(self):
+        return {
+            order.pk: order.pillaged_amount
+            for order in Order.objects.filter(product=self.product)
+        }
+
+    def test_rebuilds_missing_pillages(self):
+        # e.g. after a bulk import that bypassed the models
+        Pillage.objects.all().delete()
+
+        call_command("reallocate", stdout=StringIO())
+
+        self.assertEqual(
+            self.amounts(), {self.camp_order.pk: 6, self.congress_order.pk: 4}
+        )
+        self.assertTrue(all(p.automatic for p in Pillage.objects.all()))
+
+    @override_settings(
+        ALLOCATION_STRATEGY="priority", ALLOCATION_PRIORITY_EVENTS=["Congress"]
+    )
+    def test_uses_strategy(self):
+        call_command("reallocate", stdout=StringIO())
+
+        self.assertEqual(
+            self.amounts(), {self.camp_order.pk: 4, self.congress_order.pk: 6}
+        )
+
+    def test_keeps_manual_pillages(self):
+        Pillage.objects.all().delete()
+        Pillage.objects.create(
+            order=self.congress_order, stockpile=self.stockpile, amount=5
+        )
+
+        call_command("reallocate", stdout=StringIO())
+
+        self.assertEqual(
+            self.amounts(), {self.camp_order.pk: 5, self.congress_order.pk: 5}
+        )
+        self.assertEqual(Pillage.objects.filter(automatic=False).get().amount, 5)
+
+    def test_dry_run(self):
+        Pillage.objects.all().delete()
+        out = StringIO()
+
+        call_command("reallocate", "--dry-run", stdout=out)
+
+        self.assertIn("creating 2 pillages of 10 items", out.getvalue())
+        self.assertFalse(Pillage.objects.exists())
+
+    def test_event(self):
+        Pillage.objects.all().delete()
+
+        call_command("reallocate", "--event", "Congress", stdout=StringIO())
+
+        self.assertEqual(
+            self.amounts(), {self.camp_order.pk: 0, self.congress_order.pk: 6}
+        )
+
+    def test_product(self):
+        other = Product.objects.create(name="Tschunk")
+        Order.objects.create(product=other, team=self.team, amount=1)
+        Pillage.objects.all().delete()
+
+        call_command("reallocate", "--product", "Tschunk", stdout=StringIO())
+
+        self.assertFalse(Pillage.objects.exists())
+
+    def test_unknown_product(self):
+        self.assertRaises(CommandError, call_command, "reallocate", "--product", "Nope")
+
+    def test_constant_query_count(self):
+        Pillage.objects.all().delete()
+        with CaptureQueriesContext(connection) as few:
+            call_command("reallocate", stdout=StringIO())
+
+        Pillage.objects.all().delete()
+        for _ in range(50):
+            Order.objects.create(product=self.product, team=self.team, amount=1)
+            Stockpile.objects.create(
+                amount=1, product=self.product, unit_price=1000, tax=1.19
+            )
+        Pillage.objects.all().delete()
+        with CaptureQueriesContext(connection) as many:
+            call_command("reallocate", stdout=StringIO())
+
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+
+class PruneDeletedOrdersTests(TestCase):
+    @override_settings(DELETED_ORDERS_RETENTION_DAYS=30)
+    def test_prune(self):
+        kept = DeletedOrder.objects.create(order_id=1, team_id=1)
+        old = DeletedOrder.objects.create(order_id=2, team_id=1)
+        DeletedOrder.objects.filter(pk=old.pk).update(
+            deleted_at=timezone.now() - timedelta(days=31)
+        )
+
+        out = StringIO()
+        call_command("prune_deleted_orders", stdout=out)
+
+        self.assertIn("Removed 1 records of deleted orders.", out.getvalue())
+        self.assertEqual(list(DeletedOrder.objects.all()), [kept])
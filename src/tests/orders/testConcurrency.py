@@ -0,0 +1,91 @@
+import threading
+
+from django.db import connection
+from django.db.models import F, Sum
+from django.test import TransactionTestCase
+from squirrel.orders.models import Order, Pillage, Product, Stockpile, Team
+
+
+class ConcurrentAllocationTests(TransactionTestCase):
+    """
+    Many writers save orders and stockpiles for the same product at the same time. Stock must never be handed out
+    twice.
+    """
+
+    writers = 8
+    saves_per_writer = 10
+
+    def setUp(self) -> None:
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest(
+                "SQLite only supports parallel writers on files, set TEST_DATABASE_NAME"
+            )
+        self.team = Team.objects.create(name="Procurement")
+        self.product = Product.objects.create(name="Club-Mate")
+
+    def run_writers(self, work):
+        barrier = threading.Barrier(self.writers)
+        errors = []
+
+        def writer(number):
+            try:
+                barrier.wait()
+                for i in range(self.saves_per_writer):
+                    work(number, i)
+            except Exception as e:  # Reported by the assertion below
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=writer, args=(n,)) for n in range(self.writers)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+
+    def assertNothingOverallocated(self):
+        self.assertFalse(
+            Stockpile.objects.filter(pillaged_amount__gt=F("amount")).exists()
+        )
+        self.assertFalse(Order.objects.filter(pillaged_amount__gt=F("amount")).exists())
+
+        for stockpile in Stockpile.objects.all():
+            pillaged = stockpile.pillage_set.aggregate(Sum("amount"))["amount__sum"]
+            self.assertEqual(stockpile.pillaged_amount, pillaged or 0)
+            self.assertGreaterEqual(stockpile.stock, 0)
+        for order in Order.objects.all():
+            pillaged = order.pillage_set.aggregate(Sum("amount"))["amount__sum"]
+            self.assertEqual(order.pillaged_amount, pillaged or 0)
+
+    def test_parallel_orders(self):
+        Stockpile.objects.create(
+            product=self.product, amount=50, unit_price=100, tax=1.19
+        )
+
+        self.run_writers(
+            lambda n, i: Order.objects.create(
+                product=self.product, team=self.team, amount=1 + (n + i) % 3
+            )
+        )
+
+        self.assertNothingOverallocated()
+        self.assertEqual(Stockpile.objects.get().stock, 0)
+
+    def test_parallel_orders_and_stockpiles(self):
+        def work(n, i):
+            if n % 2:
+                Order.objects.create(product=self.product, team=self.team, amount=3)
+            else:
+                Stockpile.objects.create(
+                    product=self.product, amount=2, unit_price=100, tax=1.19
+                )
+
+        self.run_writers(work)
+
+        self.assertNothingOverallocated()
+        # 40 orders of 3 and 40 stockpiles of 2: all stock must be handed out
+        self.assertEqual(Pillage.objects.aggregate(Sum("amount"))["amount__sum"], 80)
@@ -0,0 +1,55 @@
+import io
+import json
+import zipfile
+from decimal import Decimal
+from xml.etree import ElementTree
+
+from django.test import SimpleTestCase
+from squirrel.orders.exports import euros, stream_csv, stream_jsonl, stream_xlsx
+
+NAMESPACE = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+
+
+class WriterTests(SimpleTestCase):
+    columns = ["Item", "Unit price", "Paid", "Comment"]
+    rows = [["Mate", Decimal("1.50"), True, None], ["<Tschunk> & \x07", 2, False, "ok"]]
+
+    def test_euros(self):
+        self.assertEqual(str(euros(14600)), "14.60")
+        self.assertEqual(str(euros(14604.4)), "14.60")
+        self.assertEqual(str(euros(14605)), "14.61")
+        self.assertIsNone(euros(None))
+
+    def test_csv(self):
+        chunks = list(stream_csv(self.columns, iter(self.rows), rows_per_chunk=1))
+        self.assertEqual(chunks[0], "Item,Unit price,Paid,Comment\r\n")
+        self.assertEqual(
+            "".join(chunks[1:]), "Mate,1.50,yes,\r\n<Tschunk> & \x07,2,no,ok\r\n",
+        )
+
+    def test_jsonl(self):
+        lines = "".join(stream_jsonl(self.columns, iter(self.rows))).splitlines()
+        self.assertEqual(
+            json.loads(lines[0]),
+            {"item": "Mate", "unit_price": 1.5, "paid": True, "comment": None},
+        )
+
+    def test_xlsx(self):
+        chunks = list(stream_xlsx(self.columns, iter(self.rows * 3), rows_per_chunk=2))
+        self.assertGreater(len(chunks), 3)
+
+        workbook = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+        self.assertIsNone(workbook.testzip())
+        sheet = ElementTree.fromstring(workbook.read("xl/worksheets/sheet1.xml"))
+        rows = sheet.findall("x:sheetData/x:row", NAMESPACE)
+        self.assertEqual(len(rows), 7)
+
+        cells = rows[2].findall("x:c", NAMESPACE)
+        self.assertEqual([cell.get("r") for cell in cells], ["A3", "B3", "C3", "D3"])
+        # Control characters can't be written in XML and are dropped
+        self.assertEqual(cells[0].find("x:is/x:t", NAMESPACE).text, "<Tschunk> & ")
+        self.assertEqual(cells[1].find("x:v", NAMESPACE).text, "2")
+        self.assertEqual(cells[2].get("t"), "b")
+
+        # Empty cells are left out
+        self.assertEqual(len(rows[1].findall("x:c", NAMESPACE)), 3)
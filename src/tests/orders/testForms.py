@@ -1,7 +1,13 @@
+from unittest import skipUnless
+
 from django.contrib.auth.models import Permission, User
-from django.test import TestCase
-from squirrel.orders.forms import OrderForm, ProductForm
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from squirrel.orders.forms import OrderFilterForm, OrderForm, ProductForm
 from squirrel.orders.models import Event, Order, Product, Team
+from squirrel.orders.widgets import TextInput
 
 
 class ProductFormTests(TestCase):
@@ -137,3 +143,159 @@ class OrderFormTests(TestCase):
             data=form_data, teams=Team.objects.all(), states=Order.STATE_CHOICES
         )
         self.assertTrue(form.is_valid())
+
+
+class OrderFilterFormTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="helpdesk", password="test123")
+        self.team = Team.objects.create(name="Bottles")
+        self.other_team = Team.objects.create(name="Zebus")
+        self.product = Product.objects.create(name="Tardis")
+        self.event = Event.objects.create(name="36C3")
+
+        self.approved = Order.objects.create(
+            product=self.product,
+            team=self.team,
+            event=self.event,
+            state="APP",
+            created_by=self.user,
+        )
+        self.requested = Order.objects.create(
+            product=self.product, team=self.other_team, state="REQ"
+        )
+
+    def filtered(self, **data):
+        return list(OrderFilterForm(data).filter(Order.objects.order_by("id")))
+
+    def test_no_filters(self):
+        self.assertEqual(self.filtered(), [self.approved, self.requested])
+
+    def test_filters_are_combined(self):
+        self.assertEqual(
+            self.filtered(state="APP", event=self.event.id), [self.approved]
+        )
+        self.assertEqual(self.filtered(state="APP", team=self.other_team.id), [])
+
+    def test_filter_by_product_name_and_creator(self):
+        self.assertEqual(
+            self.filtered(product="Tardis", created_by=self.user.id), [self.approved]
+        )
+
+    def test_invalid_filters_find_nothing(self):
+        self.assertEqual(self.filtered(state="NOPE"), [])
+
+    def test_unknown_product_finds_nothing(self):
+        self.assertEqual(self.filtered(state="APP", product="nonexistent"), [])
+
+    @skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is SQLite")
+    def test_common_filters_use_an_index(self):
+        for data in (
+            {"state": "APP"},
+            {"state": "APP", "event": self.event.id},
+            {"team": self.team.id, "state": "APP"},
+            {"product": "Tardis", "state": "APP"},
+        ):
+            sql, params = (
+                OrderFilterForm(data)
+                .filter(Order.objects.all())
+                .query.sql_with_params()
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                steps = [
+                    row[-1] for row in cursor.fetchall() if "orders_order" in row[-1]
+                ]
+
+            # A table scan shows up as SCAN, an index lookup as SEARCH ... USING INDEX
+            self.assertTrue(steps, data)
+            for step in steps:
+                self.assertTrue(step.startswith("SEARCH"), (data, step))
+                self.assertIn("INDEX", step, data)
+
+
+class OrderFormAutocompleteTests(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        Product.objects.create(name="Tardis")
+        Product.objects.create(name="Apple")
+
+    def test_datalist_lists_all_products(self):
+        form = OrderForm(teams=Team.objects.all(), states=Order.STATE_CHOICES)
+        self.assertIn('<option value="Tardis">', str(form["product"]))
+
+    def test_datalist_cached(self):
+        def render():
+            with CaptureQueriesContext(connection) as queries:
+                html = str(
+                    OrderForm(teams=Team.objects.none(), states=Order.STATE_CHOICES)[
+                        "product"
+                    ]
+                )
+            return html, len(queries)
+
+        render()
+        for i in range(20):
+            Product.objects.create(name=f"Product {i}")
+        html, first_render = render()
+        self.assertIn('<option value="Product 19">', html)
+
+        html, second_render = render()
+        self.assertIn('<option value="Product 19">', html)
+        self.assertEqual(second_render, 0)
+        self.assertLess(second_render, first_render)
+
+        Product.objects.get(name="Product 19").delete()
+        self.assertNotIn('<option value="Product 19">', render()[0])
+
+    @override_settings(PRODUCT_AUTOCOMPLETE=True)
+    def test_autocomplete_fetches_products(self):
+        with CaptureQueriesContext(connection) as queries:
+            html = str(
+                OrderForm(teams=Team.objects.none(), states=Order.STATE_CHOICES)[
+                    "product"
+                ]
+            )
+
+        self.assertIn('data-autocomplete="/products/autocomplete"', html)
+        self.assertNotIn("Tardis", html)
+        self.assertFalse(
+            [q for q in queries.captured_queries if "orders_product" in q["sql"]]
+        )
+
+    @override_settings(PRODUCT_AUTOCOMPLETE=True)
+    def test_autocomplete_validates_name(self):
+        form = OrderForm(
+            teams=Team.objects.all(),
+            states=Order.STATE_CHOICES,
+            data={"product": "Apple"},
+        )
+        form.is_valid()
+        self.assertNotIn("product", form.errors)
+
+
+class TextInputTests(TestCase):
+    def test_datalist(self):
+        widget = TextInput(datalist=["Mate", "Tschunk"])
+        self.assertHTMLEqual(
+            widget.render("drink", "Mate", attrs={"id": "id_drink"}),
+            '<input type="text" name="drink" value="Mate" id="id_drink" list="id_drink_list">'
+            '<datalist id="id_drink_list"><option value="Mate"><option value="Tschunk"></datalist>',
+        )
+
+    def test_empty_datalist(self):
+        widget = TextInput(datalist=[])
+        self.assertHTMLEqual(
+            widget.render("drink", None), '<input type="text" name="drink">'
+        )
+
+    def test_datalist_version(self):
+        cache.clear()
+        version = "1"
+        items = ["Mate"]
+        widget = TextInput(datalist=lambda: items, datalist_version=lambda: version)
+
+        self.assertIn("Mate", widget.render("drink", None))
+        items = ["Tschunk"]
+        self.assertIn("Mate", widget.render("drink", None))
+        version = "2"
+        self.assertIn("Tschunk", widget.render("drink", None))
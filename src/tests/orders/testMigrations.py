@@ -1,10 +1,11 @@
 from django.apps import apps
+from django.core.management.sql import emit_post_migrate_signal
 from django.db import connection
 from django.db.migrations.executor import MigrationExecutor
-from django.test import TestCase
+from django.test import TransactionTestCase
 
 
-class TestMigrations(TestCase):
+class TestMigrations(TransactionTestCase):
     """
     A class to perform tests of forward migrations
 
@@ -41,5 +42,127 @@ class TestMigrations(TestCase):
 
         self.apps = executor.loader.project_state(self.migrate_to).apps
 
+    def tearDown(self):
+        # Leave the database fully migrated for the following tests
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        emit_post_migrate_signal(verbosity=0, interactive=False, db=connection.alias)
+
     def setUpBeforeMigration(self, apps):
         pass
+
+
+class PillagedAmountMigrationTests(TestMigrations):
+    app = "orders"
+    migrate_from = "0004_product_order"
+    migrate_to = "0005_pillaged_amount"
+
+    def setUpBeforeMigration(self, apps):
+        Order = apps.get_model("orders", "Order")
+        Pillage = apps.get_model("orders", "Pillage")
+        Product = apps.get_model("orders", "Product")
+        Stockpile = apps.get_model("orders", "Stockpile")
+        Team = apps.get_model("orders", "Team")
+
+        product = Product.objects.create(name="Portal gun")
+        team = Team.objects.create(name="Aperture")
+        order = Order.objects.create(product=product, team=team, amount=5)
+        stockpile = Stockpile.objects.create(
+            product=product, amount=7, unit_price=1000, tax=1.19
+        )
+        Stockpile.objects.create(product=product, amount=3, unit_price=1000, tax=1.19)
+
+        # Historical models have no custom save, so no automatic pillaging happens here
+        Pillage.objects.create(order=order, stockpile=stockpile, amount=2)
+        Pillage.objects.create(order=order, stockpile=stockpile, amount=1)
+
+    def test_counters_are_initialized(self):
+        Order = self.apps.get_model("orders", "Order")
+        Stockpile = self.apps.get_model("orders", "Stockpile")
+
+        self.assertEqual(Order.objects.get().pillaged_amount, 3)
+        self.assertEqual(
+            list(
+                Stockpile.objects.order_by("amount").values_list(
+                    "pillaged_amount", flat=True
+                )
+            ),
+            [0, 3],
+        )
+
+
+class RepairPillagesMigrationTests(TestMigrations):
+    app = "orders"
+    migrate_from = "0005_pillaged_amount"
+    migrate_to = "0006_repair_pillages"
+
+    def setUpBeforeMigration(self, apps):
+        Order = apps.get_model("orders", "Order")
+        Pillage = apps.get_model("orders", "Pillage")
+        Product = apps.get_model("orders", "Product")
+        Stockpile = apps.get_model("orders", "Stockpile")
+        Team = apps.get_model("orders", "Team")
+
+        product = Product.objects.create(name="Portal gun")
+        other_product = Product.objects.create(name="Cake")
+        team = Team.objects.create(name="Aperture")
+        order = Order.objects.create(product=product, team=team, amount=5)
+        stockpile = Stockpile.objects.create(
+            product=product, amount=7, unit_price=1000, tax=1.19
+        )
+        other_stockpile = Stockpile.objects.create(
+            product=other_product, amount=3, unit_price=1000, tax=1.19
+        )
+
+        self.kept = Pillage.objects.create(order=order, stockpile=stockpile, amount=4)
+        self.shrunk = Pillage.objects.create(order=order, stockpile=stockpile, amount=4)
+        self.mismatched = Pillage.objects.create(
+            order=order, stockpile=other_stockpile, amount=1
+        )
+
+    def test_pillages_are_repaired(self):
+        Order = self.apps.get_model("orders", "Order")
+        Pillage = self.apps.get_model("orders", "Pillage")
+
+        self.assertEqual(
+            list(Pillage.objects.order_by("id").values_list("id", "amount")),
+            [(self.kept.id, 4), (self.shrunk.id, 1)],
+        )
+        self.assertEqual(Order.objects.get().pillaged_amount, 5)
+
+
+class PurchaseTotalsMigrationTests(TestMigrations):
+    app = "orders"
+    migrate_from = "0008_pillage_automatic"
+    migrate_to = "0009_purchase_totals"
+
+    def setUpBeforeMigration(self, apps):
+        Product = apps.get_model("orders", "Product")
+        Purchase = apps.get_model("orders", "Purchase")
+        Stockpile = apps.get_model("orders", "Stockpile")
+        Vendor = apps.get_model("orders", "Vendor")
+
+        product = Product.objects.create(name="Portal gun")
+        vendor = Vendor.objects.create(name="Aperture")
+        net = Purchase.objects.create(vendor=vendor, is_net=True)
+        gross = Purchase.objects.create(vendor=vendor, is_net=False)
+        for purchase in (net, gross):
+            Stockpile.objects.create(
+                purchase=purchase, product=product, amount=2, unit_price=1190, tax=1.19
+            )
+            Stockpile.objects.create(
+                purchase=purchase, product=product, amount=1, unit_price=100, tax=1.07
+            )
+
+    def test_totals_are_initialized(self):
+        Purchase = self.apps.get_model("orders", "Purchase")
+
+        self.assertEqual(
+            list(
+                Purchase.objects.order_by("-is_net").values_list(
+                    "total_net", "total_gross"
+                )
+            ),
+            [(2480, 2939), (2093, 2480)],
+        )
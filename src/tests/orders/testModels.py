@@ -1,6 +1,13 @@
+from unittest import mock
+
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import F
 from django.db.utils import IntegrityError
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from squirrel.orders.catalog import catalog_version, search_product_names
 from squirrel.orders.models import (
     Event,
     Order,
@@ -48,6 +55,59 @@ class ProductModelTests(TestCase):
         product.save()
 
 
+class ProductCatalogTests(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        for name in ["Mate", "Club-Mate", "Wasser", "mate tea", "Tomate"]:
+            Product.objects.create(name=name)
+
+    def test_prefix_matches_first(self):
+        self.assertEqual(
+            search_product_names("mate"), ["Mate", "mate tea", "Club-Mate", "Tomate"],
+        )
+
+    def test_limit(self):
+        self.assertEqual(
+            search_product_names("MATE", limit=3), ["Mate", "mate tea", "Club-Mate"]
+        )
+
+    def test_empty_term(self):
+        self.assertEqual(search_product_names("  "), [])
+
+    def test_cached(self):
+        search_product_names("mate")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(search_product_names("was"), ["Wasser"])
+        self.assertEqual(len(queries), 0)
+
+    def test_results_cached_by_term(self):
+        search_product_names("mate")
+        with mock.patch(
+            "squirrel.orders.catalog.product_name_index", side_effect=AssertionError
+        ):
+            self.assertEqual(len(search_product_names("Mate ")), 4)
+            self.assertRaises(AssertionError, search_product_names, "was")
+
+    def test_index_kept_in_process(self):
+        search_product_names("mate")
+        with mock.patch("squirrel.orders.catalog.cache.get", wraps=cache.get) as get:
+            search_product_names("was")
+        self.assertNotIn("names", " ".join(call[0][0] for call in get.call_args_list))
+
+    def test_product_changes_bump_version(self):
+        search_product_names("mate")
+        version = catalog_version()
+
+        product = Product.objects.create(name="Mate light")
+        self.assertNotEqual(catalog_version(), version)
+        self.assertIn("Mate light", search_product_names("mate"))
+
+        version = catalog_version()
+        product.delete()
+        self.assertNotEqual(catalog_version(), version)
+        self.assertNotIn("Mate light", search_product_names("mate"))
+
+
 class OrderModelTests(TestCase):
     def setUp(self) -> None:
         self.team = Team.objects.create(name="Aperture Science Laboratories")
@@ -76,6 +136,7 @@ class OrderModelTests(TestCase):
         self.assertEqual(pillages[0].amount, 13)
 
         # Check that the stockpile has 4 remaining
+        stockpile.refresh_from_db()
         self.assertEqual(stockpile.stock, 4)
 
         # Create a second order to test that pillages are emtied correctly
@@ -87,6 +148,7 @@ class OrderModelTests(TestCase):
         # The pillage for the second order can only have four as the stockpile has 17
         self.assertEqual(pillages[1].amount, 4)
 
+        stockpile.refresh_from_db()
         self.assertEqual(stockpile.stock, 0)
 
 
@@ -103,6 +165,124 @@ class PurchaseModelTests(TestCase):
             product=self.product, team=self.team, amount=23, state="APP"
         )
 
+    def test_sums_of_net_purchase(self):
+        Stockpile.objects.create(
+            purchase=self.purchase,
+            product=self.product,
+            amount=3,
+            unit_price=13370,
+            tax=1.19,
+        )
+        Stockpile.objects.create(
+            purchase=self.purchase,
+            product=self.product,
+            amount=1,
+            unit_price=1005,
+            tax=1.07,
+        )
+        purchase = Purchase.objects.get(pk=self.purchase.pk)
+        self.assertAlmostEqual(purchase.sum_net, 41.12)
+        self.assertAlmostEqual(purchase.sum_gross, 48.81)
+
+    def test_sums_of_gross_purchase(self):
+        self.purchase.is_net = False
+        self.purchase.save()
+        Stockpile.objects.create(
+            purchase=self.purchase,
+            product=self.product,
+            amount=2,
+            unit_price=11900,
+            tax=1.19,
+        )
+        purchase = Purchase.objects.get(pk=self.purchase.pk)
+        self.assertAlmostEqual(purchase.sum_net, 20)
+        self.assertAlmostEqual(purchase.sum_gross, 23.8)
+
+    def test_sums_of_empty_purchase(self):
+        self.assertEqual(self.purchase.sum_net, 0)
+        self.assertEqual(self.purchase.sum_gross, 0)
+
+    def assertTotals(self, purchase, net, gross):
+        purchase.refresh_from_db()
+        self.assertEqual((purchase.total_net, purchase.total_gross), (net, gross))
+
+    def test_totals_follow_stockpile_changes(self):
+        stockpile = Stockpile.objects.create(
+            purchase=self.purchase,
+            product=self.product,
+            amount=2,
+            unit_price=1000,
+            tax=1.5,
+        )
+        self.assertTotals(self.purchase, 2000, 3000)
+
+        stockpile.amount = 30
+        stockpile.save()
+        self.assertTotals(self.purchase, 30000, 45000)
+
+        other = Purchase.objects.create(vendor=self.vendor, is_net=False)
+        stockpile.purchase = other
+        stockpile.save()
+        self.assertTotals(self.purchase, 0, 0)
+        self.assertTotals(other, 20000, 30000)
+
+        stockpile.delete()
+        self.assertTotals(other, 0, 0)
+
+    def test_totals_round_each_stockpile(self):
+        """ Each stockpile is rounded to 10ths of cents before summing, only the sum is rounded to cents """
+        for _ in range(7):
+            Stockpile.objects.create(
+                purchase=self.purchase,
+                product=self.product,
+                amount=1,
+                unit_price=2,
+                tax=1.19,
+            )
+        # 7 × 2.38 would be 16.66 10ths of cents, rounded to 2 cents. Rounded per stockpile it is 7 × 2.
+        self.assertTotals(self.purchase, 14, 14)
+        self.assertEqual(self.purchase.sum_gross, 0.01)
+
+    def test_totals_follow_is_net(self):
+        Stockpile.objects.create(
+            purchase=self.purchase,
+            product=self.product,
+            amount=2,
+            unit_price=1500,
+            tax=1.5,
+        )
+        self.purchase.is_net = False
+        self.purchase.save()
+        self.assertTotals(self.purchase, 2000, 3000)
+
+    def test_totals_are_not_overwritten_by_stale_instance(self):
+        stale = Purchase.objects.get(pk=self.purchase.pk)
+        Stockpile.objects.create(
+            purchase=self.purchase,
+            product=self.product,
+            amount=2,
+            unit_price=1000,
+            tax=1.5,
+        )
+        stale.paid = True
+        stale.save()
+        self.assertTotals(self.purchase, 2000, 3000)
+
+    def test_totals_of_many_purchases_in_one_query(self):
+        for amount in range(1, 6):
+            purchase = Purchase.objects.create(vendor=self.vendor)
+            Stockpile.objects.create(
+                purchase=purchase,
+                product=self.product,
+                amount=amount,
+                unit_price=1000,
+                tax=1.5,
+            )
+
+        with self.assertNumQueries(1):
+            sums = [(p.sum_net, p.sum_gross) for p in Purchase.objects.order_by("id")]
+        self.assertEqual(sums, [(0, 0)] + [(a, a * 1.5) for a in range(1, 6)])
+
 
 class StockpilePillageModelTests(TestCase):
     def setUp(self) -> None:
@@ -135,6 +315,7 @@ class StockpilePillageModelTests(TestCase):
         Order.objects.create(
             amount=7, product=self.product, event=self.event, team=self.team
         )
+        self.stockpile.refresh_from_db()
         self.assertEqual(self.stockpile.stock, 3)
 
     def test_pillage_order_fulfilled(self):
@@ -192,3 +373,339 @@ class StockpilePillageModelTests(TestCase):
 
         # Check that the last stockpile has 80 left
         self.assertEqual(Stockpile.objects.get(amount=100).stock, 80)
+
+
+class TrackedModelTests(TestCase):
+    def setUp(self) -> None:
+        self.product = Product.objects.create(name="Dr. Cave Johnson")
+        self.other_product = Product.objects.create(name="Wrong product.")
+        Stockpile.objects.create(
+            amount=10, product=self.product, unit_price=13370, tax=1.24
+        )
+
+    def test_loading_does_not_load_relations(self):
+        with self.assertNumQueries(1):
+            stockpile = Stockpile.objects.get()
+            self.assertFalse(stockpile.has_changed("product_id"))
+
+    def test_has_changed(self):
+        stockpile = Stockpile.objects.get()
+        stockpile.product = self.other_product
+        stockpile.amount = 10
+        self.assertTrue(stockpile.has_changed("product_id"))
+        self.assertFalse(stockpile.has_changed("amount"))
+        self.assertEqual(stockpile.stored_values["product_id"], self.product.id)
+
+    def test_unsaved_instance_has_no_stored_values(self):
+        stockpile = Stockpile(amount=1, product=self.product, unit_price=1, tax=1)
+        self.assertIsNone(stockpile.stored_values)
+        self.assertFalse(stockpile.has_changed("product_id"))
+
+        stockpile.save()
+        self.assertEqual(stockpile.stored_values["amount"], 1)
+
+    def test_save_remembers_new_values(self):
+        stockpile = Stockpile.objects.get()
+        stockpile.amount = 12
+        stockpile.save()
+        self.assertFalse(stockpile.has_changed("amount"))
+
+    def test_deferred_fields_are_read_when_needed(self):
+        stockpile = Stockpile.objects.only("id", "amount").get()
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                stockpile.stored_values,
+                {
+                    "product_id": self.product.pk,
+                    "purchase_id": None,
+                    "amount": 10,
+                    "unit_price": 13370,
+                    "tax": 1.24,
+                },
+            )
+
+    def test_deferred_fields_that_were_set(self):
+        stockpile = Stockpile.objects.only("id", "amount").get()
+        stockpile.product = self.other_product
+        self.assertTrue(stockpile.has_changed("product_id"))
+
+    def test_save_with_deferred_fields(self):
+        for fields in (("id", "amount"), ("id", "product_id")):
+            with self.subTest(fields):
+                stockpile = Stockpile.objects.only(*fields).get()
+                stockpile.amount = 12
+                stockpile.save()
+                stockpile = Stockpile.objects.get()
+                self.assertEqual(stockpile.amount, 12)
+                self.assertEqual(stockpile.product, self.product)
+
+    def test_order_with_deferred_product_changes_product(self):
+        team = Team.objects.create(name="Procurement")
+        order = Order.objects.create(product=self.product, team=team, amount=2)
+        Stockpile.objects.create(
+            amount=10, product=self.other_product, unit_price=1, tax=1
+        )
+
+        order = Order.objects.only("id", "amount").get()
+        order.product = self.other_product
+        order.save()
+
+        self.assertFalse(
+            Pillage.objects.exclude(stockpile__product=F("order__product")).exists()
+        )
+        self.assertEqual(Pillage.objects.get().stockpile.product, self.other_product)
+
+
+class PillagedAmountCounterTests(TestCase):
+    def setUp(self) -> None:
+        self.team = Team.objects.create(name="Procurement")
+        self.product = Product.objects.create(name="Dr. Cave Johnson")
+        self.order = Order.objects.create(
+            product=self.product, team=self.team, amount=8
+        )
+        self.stockpile = Stockpile.objects.create(
+            amount=10, product=self.product, unit_price=13370, tax=1.24
+        )
+        self.pillage = Pillage.objects.get()
+
+    def assertCounters(self, order_pillaged, stockpile_pillaged):
+        self.order.refresh_from_db()
+        self.stockpile.refresh_from_db()
+        self.assertEqual(self.order.pillaged_amount, order_pillaged)
+        self.assertEqual(self.stockpile.pillaged_amount, stockpile_pillaged)
+
+    def test_create_counts(self):
+        self.assertCounters(8, 8)
+
+    def test_update_counts_difference(self):
+        self.pillage.amount = 5
+        self.pillage.save()
+        self.assertCounters(5, 5)
+
+    def test_update_with_own_amount_is_valid(self):
+        """ Changing an existing pillage must not count its old amount twice """
+        self.pillage.amount = 8
+        self.pillage.save()
+        self.assertCounters(8, 8)
+
+    def test_delete_counts(self):
+        self.pillage.delete()
+        self.assertCounters(0, 0)
+
+    def test_cascading_delete_counts(self):
+        self.order.delete()
+        self.stockpile.refresh_from_db()
+        self.assertEqual(self.stockpile.pillaged_amount, 0)
+
+    def test_save_does_not_overwrite_counter(self):
+        """ A stale instance must not write its counter back """
+        stale = Order.objects.get(pk=self.order.pk)
+        self.stockpile.delete()
+        stale.comment = "Still here"
+        stale.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.pillaged_amount, 0)
+
+    def test_str_of_loaded_pillage_costs_no_queries(self):
+        pillage = Pillage.objects.select_related(
+            "order__product", "stockpile__product"
+        ).get()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                str(pillage),
+                "Pillage of 8 for 8  of Dr. Cave Johnson from Stockpile of Dr. Cave Johnson (2/10)",
+            )
+
+    def test_reading_stock_costs_no_queries(self):
+        stockpile = Stockpile.objects.get(pk=self.stockpile.pk)
+        order = Order.objects.get(pk=self.order.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(stockpile.stock, 2)
+            self.assertEqual(order.to_pillage, 0)
+
+
+class InventoryConstraintTests(TestCase):
+    def setUp(self) -> None:
+        self.team = Team.objects.create(name="Procurement")
+        self.product = Product.objects.create(name="Dr. Cave Johnson")
+        self.other_product = Product.objects.create(name="Wrong product.")
+        self.stockpile = Stockpile.objects.create(
+            amount=10, product=self.product, unit_price=13370, tax=1.24
+        )
+        self.other_stockpile = Stockpile.objects.create(
+            amount=10, product=self.other_product, unit_price=13370, tax=1.24
+        )
+        self.order = Order.objects.create(
+            product=self.product, team=self.team, amount=4
+        )
+        self.open_order = Order.objects.create(
+            product=self.product, team=self.team, amount=20
+        )
+
+    def test_stockpile_cannot_be_exceeded(self):
+        self.assertRaises(
+            IntegrityError,
+            Pillage.objects.bulk_create,
+            [Pillage(order=self.open_order, stockpile=self.stockpile, amount=7)],
+        )
+
+    def test_order_cannot_be_exceeded(self):
+        stockpile = Stockpile.objects.create(
+            amount=30, product=self.product, unit_price=13370, tax=1.24
+        )
+        self.assertRaises(
+            IntegrityError,
+            Pillage.objects.bulk_create,
+            [Pillage(order=self.order, stockpile=stockpile, amount=1)],
+        )
+
+    def test_products_must_match(self):
+        self.assertRaises(
+            IntegrityError,
+            Pillage.objects.bulk_create,
+            [Pillage(order=self.open_order, stockpile=self.other_stockpile, amount=1)],
+        )
+
+    def test_pillaged_order_product_cannot_change(self):
+        with transaction.atomic():
+            self.assertRaises(
+                IntegrityError,
+                Order.objects.filter(pk=self.order.pk).update,
+                product=self.other_product,
+            )
+        Order.objects.filter(pk=self.order.pk).update(product=self.product)
+
+    def test_pillaged_stockpile_product_cannot_change(self):
+        with transaction.atomic():
+            self.assertRaises(
+                IntegrityError,
+                Stockpile.objects.filter(pk=self.stockpile.pk).update,
+                product=self.other_product,
+            )
+        Stockpile.objects.filter(pk=self.other_stockpile.pk).update(
+            product=self.product
+        )
+
+    def test_database_updates_counters(self):
+        Pillage.objects.filter(order=self.order).delete()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.pillaged_amount, 0)
+
+    def test_pillage_creation_is_a_single_insert(self):
+        order = Order.objects.create(
+            product=self.other_product, team=self.team, amount=1
+        )
+        Pillage.objects.filter(order=order).delete()
+
+        with CaptureQueriesContext(connection) as context:
+            Pillage.objects.create(
+                order=order, stockpile=self.other_stockpile, amount=1
+            )
+
+        self.assertEqual(
+            [q["sql"].split()[0] for q in context.captured_queries],
+            ["SAVEPOINT", "INSERT", "RELEASE"],
+        )
+        self.other_stockpile.refresh_from_db()
+        self.assertEqual(self.other_stockpile.stock, 9)
+
+    def test_order_amount_below_pillaged(self):
+        self.order.amount = 3
+        self.order.save()
+        self.order.refresh_from_db()
+        self.open_order.refresh_from_db()
+        self.assertEqual(self.order.pillaged_amount, 3)
+        self.assertEqual(self.open_order.pillaged_amount, 7)
+
+    def test_stockpile_amount_below_pillaged(self):
+        self.stockpile.refresh_from_db()
+        self.stockpile.amount = 3
+        self.stockpile.save()
+        self.stockpile.refresh_from_db()
+        self.assertEqual(self.stockpile.pillaged_amount, 3)
+        self.assertEqual(sum(Pillage.objects.values_list("amount", flat=True)), 3)
+
+
+class ReallocationTests(TestCase):
+    def setUp(self) -> None:
+        self.team = Team.objects.create(name="Procurement")
+        self.product = Product.objects.create(name="Dr. Cave Johnson")
+        self.other_product = Product.objects.create(name="Wrong product.")
+        self.stockpile = Stockpile.objects.create(
+            amount=10, product=self.product, unit_price=13370, tax=1.24
+        )
+        self.first = Order.objects.create(
+            product=self.product, team=self.team, amount=8
+        )
+        self.second = Order.objects.create(
+            product=self.product, team=self.team, amount=5
+        )
+
+    def assertPillaged(self, first, second):
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.pillaged_amount, first)
+        self.assertEqual(self.second.pillaged_amount, second)
+
+    def test_order_amount_drop_fills_waiting_orders(self):
+        self.first.amount = 3
+        self.first.save()
+        self.assertPillaged(3, 5)
+
+    def test_order_delete_fills_waiting_orders(self):
+        self.first.delete()
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.pillaged_amount, 5)
+
+    def test_product_change_fills_waiting_orders(self):
+        Stockpile.objects.create(
+            amount=10, product=self.other_product, unit_price=13370, tax=1.24
+        )
+        self.first.product = self.other_product
+        self.first.save()
+        self.assertPillaged(8, 5)
+        self.assertFalse(
+            Pillage.objects.filter(
+                order=self.first, stockpile__product=self.product
+            ).exists()
+        )
+
+    def test_stockpile_delete_fills_from_other_stockpiles(self):
+        other = Stockpile.objects.create(
+            amount=10, product=self.product, unit_price=13370, tax=1.24
+        )
+        self.assertPillaged(8, 5)
+
+        self.stockpile.delete()
+        self.assertPillaged(7, 3)
+        other.refresh_from_db()
+        self.assertEqual(other.stock, 0)
+
+    def test_stockpile_amount_drop_fills_from_other_stockpiles(self):
+        other = Stockpile.objects.create(
+            amount=10, product=self.product, unit_price=13370, tax=1.24
+        )
+
+        self.stockpile.amount = 4
+        self.stockpile.save()
+        self.assertPillaged(8, 5)
+        self.stockpile.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.stockpile.pillaged_amount, 4)
+        self.assertEqual(other.pillaged_amount, 9)
+
+    def test_stockpile_amount_drop_shrinks_newest_pillages_first(self):
+        self.stockpile.amount = 7
+        self.stockpile.save()
+        self.assertPillaged(7, 0)
+        self.assertEqual(Pillage.objects.count(), 1)
+
+    def test_pillage_delete_fills_other_orders(self):
+        Pillage.objects.get(order=self.first).delete()
+        self.assertPillaged(0, 5)
+
+    def test_pillage_shrink_fills_other_orders(self):
+        pillage = Pillage.objects.get(order=self.first)
+        pillage.amount = 5
+        pillage.save()
+        self.assertPillaged(5, 5)
@@ -0,0 +1,163 @@
+from django.contrib.auth.models import Permission, User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from squirrel.orders import views
+from squirrel.orders.models import (
+    Event,
+    Order,
+    Product,
+    Purchase,
+    Stockpile,
+    Team,
+    Vendor,
+)
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Helpers to check that a list view takes the same number of queries for any number of rows and stays within
+    the query_budget it declares
+    """
+
+    def assertQueryBudget(self, url, view_class, add_rows):
+        """
+        Renders the list once with a single row and once with many rows.
+
+        :param add_rows: a function that adds the given number of rows to the list
+        """
+        # Fills the caches, e.g. of the permissions
+        self.client.get(url)
+
+        add_rows(1)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+
+        add_rows(10)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(many),
+            len(few),
+            "The number of queries grows with the number of rows:\n"
+            + "\n".join(q["sql"] for q in many.captured_queries),
+        )
+        self.assertLessEqual(len(many), view_class.query_budget)
+
+
+class ListViewQueryBudgetTests(QueryBudgetTestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("engel", password="engel")
+        self.user.user_permissions.add(
+            *Permission.objects.filter(content_type__app_label="orders")
+        )
+        self.client.login(username="engel", password="engel")
+
+        self.team = Team.objects.create(name="The A-Team")
+        self.team.members.add(self.user)
+        self.vendor = Vendor.objects.create(name="Aperture Science Laboratories")
+        self.event = Event.objects.create(name="Required Event")
+
+    def add_products(self, count):
+        return [
+            Product.objects.create(name=f"Product {Product.objects.count()}", unit="l")
+            for _ in range(count)
+        ]
+
+    def add_purchases(self, count):
+        return [Purchase.objects.create(vendor=self.vendor) for _ in range(count)]
+
+    def add_stockpiles(self, count):
+        return [
+            Stockpile.objects.create(
+                product=product, purchase=purchase, amount=3, unit_price=1000, tax=1.19
+            )
+            for product, purchase in zip(
+                self.add_products(count), self.add_purchases(count)
+            )
+        ]
+
+    def add_orders(self, count):
+        return [
+            Order.objects.create(
+                product=product, team=self.team, event=self.event, amount=2
+            )
+            for product in self.add_products(count)
+        ]
+
+    def add_pillages(self, count):
+        for order in self.add_orders(count):
+            Stockpile.objects.create(
+                product=order.product, amount=3, unit_price=1000, tax=1.19
+            )
+
+    def test_orders(self):
+        self.assertQueryBudget("/orders", views.OrderListView, self.add_orders)
+
+    def test_orders_of_own_teams(self):
+        self.user.user_permissions.remove(Permission.objects.get(codename="view_order"))
+        self.assertQueryBudget("/orders", views.OrderListView, self.add_orders)
+
+    def test_products(self):
+        self.assertQueryBudget("/products", views.ProductListView, self.add_products)
+
+    def test_vendors(self):
+        self.assertQueryBudget(
+            "/vendors",
+            views.VendorListView,
+            lambda count: [
+                Vendor.objects.create(name=f"Vendor {Vendor.objects.count()}")
+                for _ in range(count)
+            ],
+        )
+
+    def test_teams(self):
+        self.assertQueryBudget(
+            "/teams",
+            views.TeamListView,
+            lambda count: [
+                Team.objects.create(name=f"Team {Team.objects.count()}")
+                for _ in range(count)
+            ],
+        )
+
+    def test_events(self):
+        self.assertQueryBudget(
+            "/events",
+            views.EventListView,
+            lambda count: [
+                Event.objects.create(name=f"Event {Event.objects.count()}")
+                for _ in range(count)
+            ],
+        )
+
+    def test_purchases(self):
+        self.assertQueryBudget("/purchases", views.PurchaseListView, self.add_purchases)
+
+    def test_stockpiles(self):
+        self.assertQueryBudget(
+            "/stockpiles", views.StockpileListView, self.add_stockpiles
+        )
+
+    def test_stockpiles_sorted_by_stock(self):
+        self.assertQueryBudget(
+            "/stockpiles?sort=-stock", views.StockpileListView, self.add_stockpiles
+        )
+
+    def test_pillages(self):
+        self.assertQueryBudget("/pillages", views.PillageListView, self.add_pillages)
+
+    def test_pillages_sorted_by_order(self):
+        self.assertQueryBudget(
+            "/pillages?sort=order", views.PillageListView, self.add_pillages
+        )
+
+    @override_settings(KEYSET_PAGINATION=True)
+    def test_keyset_paginated_lists(self):
+        self.assertQueryBudget("/orders", views.OrderListView, self.add_orders)
+        self.assertQueryBudget(
+            "/stockpiles", views.StockpileListView, self.add_stockpiles
+        )
+        self.assertQueryBudget("/pillages", views.PillageListView, self.add_pillages)
@@ -0,0 +1,172 @@
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import Permission, User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from squirrel.orders.models import Event, Order, Product, Team, Vendor
+from squirrel.orders.search import search, search_index_enabled, uninstall_search_index
+
+
+class SearchTests(TestCase):
+    def setUp(self) -> None:
+        self.mate = Product.objects.create(name="Mate")
+        self.club_mate = Product.objects.create(name="Club-Mate Granat")
+        Product.objects.create(name="Wasser")
+        self.vendor = Vendor.objects.create(name="Mate Großhandel")
+
+        self.team = Team.objects.create(name="NOC")
+        self.other_team = Team.objects.create(name="POC")
+        event = Event.objects.create(name="36C3")
+        self.order = Order.objects.create(
+            product=self.mate,
+            team=self.team,
+            event=event,
+            amount=1,
+            comment="Kalte Mate für das Zelt",
+        )
+        self.other_order = Order.objects.create(
+            product=self.mate,
+            team=self.other_team,
+            event=event,
+            amount=1,
+            comment="Mate bitte ungekühlt",
+        )
+
+    def assertFinds(self, term, expected, **kwargs):
+        self.assertCountEqual(
+            [(r.kind, r.pk) for r in search(term, **kwargs)], expected
+        )
+
+    def test_finds_all_kinds(self):
+        self.assertFinds(
+            "mate",
+            [
+                ("product", self.mate.pk),
+                ("product", self.club_mate.pk),
+                ("vendor", self.vendor.pk),
+                ("order", self.order.pk),
+                ("order", self.other_order.pk),
+            ],
+        )
+
+    def test_all_words(self):
+        self.assertFinds("mate gran", [("product", self.club_mate.pk)])
+
+    def test_best_match_first(self):
+        self.assertEqual(search("mate", kinds=["product"])[0].pk, self.mate.pk)
+
+    def test_kinds(self):
+        self.assertFinds("mate", [("vendor", self.vendor.pk)], kinds=["vendor"])
+
+    def test_teams(self):
+        self.assertFinds(
+            "mate", [("order", self.order.pk)], kinds=["order"], teams=[self.team.pk]
+        )
+        self.assertFinds("mate", [], kinds=["order"], teams=[])
+
+    def test_limit(self):
+        self.assertEqual(len(search("mate", limit=2)), 2)
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertFinds('mate" OR "wasser', [], kinds=["product"])
+        self.assertEqual(search('"*'), [])
+
+    def test_follows_changes(self):
+        self.mate.name = "Tschunk"
+        self.mate.save()
+        self.order.comment = ""
+        self.order.save()
+        Vendor.objects.filter(pk=self.vendor.pk).delete()
+
+        self.assertFinds(
+            "mate", [("product", self.club_mate.pk), ("order", self.other_order.pk)],
+        )
+        self.assertFinds("tschunk", [("product", self.mate.pk)])
+
+    @skipUnless(connection.vendor == "sqlite", "FTS5 only exists on SQLite")
+    def test_uses_index(self):
+        self.assertTrue(search_index_enabled(connection))
+
+    def test_fallback(self):
+        with mock.patch(
+            "squirrel.orders.search.search_index_enabled", return_value=False
+        ):
+            self.test_finds_all_kinds()
+            self.test_all_words()
+            self.test_best_match_first()
+            self.test_teams()
+
+
+@skipUnless(connection.vendor == "sqlite", "FTS5 only exists on SQLite")
+class RebuildSearchIndexCommandTests(TestCase):
+    def test_rebuild(self):
+        uninstall_search_index(connection)
+        product = Product.objects.create(name="Mate")
+
+        out = StringIO()
+        call_command("rebuild_search_index", stdout=out)
+
+        self.assertIn("Rebuilt the search index.", out.getvalue())
+        self.assertEqual([r.pk for r in search("mate")], [product.pk])
+
+        # The triggers are back as well
+        product.name = "Tschunk"
+        product.save()
+        self.assertEqual(search("mate"), [])
+
+
+class SearchViewTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("engel", password="engel")
+        self.team = Team.objects.create(name="NOC")
+        self.team.members.add(self.user)
+        other_team = Team.objects.create(name="POC")
+        event = Event.objects.create(name="36C3")
+
+        self.product = Product.objects.create(name="Mate")
+        self.order = Order.objects.create(
+            product=self.product, team=self.team, event=event, comment="Mate"
+        )
+        Order.objects.create(
+            product=self.product, team=other_team, event=event, comment="Mate"
+        )
+
+    def test_login_required(self):
+        response = self.client.get("/search?q=mate")
+        self.assertEqual(response.status_code, 302)
+
+    def test_only_visible_results(self):
+        self.client.login(username="engel", password="engel")
+        response = self.client.get("/search.json?q=mate")
+        self.assertEqual(
+            response.json()["results"],
+            [
+                {
+                    "kind": "order",
+                    "id": self.order.pk,
+                    "text": "Mate",
+                    "score": mock.ANY,
+                    "url": f"/orders/{self.order.pk}",
+                }
+            ],
+        )
+
+    def test_permissions_widen_results(self):
+        self.user.user_permissions.add(
+            Permission.objects.get(codename="view_order"),
+            Permission.objects.get(codename="view_product"),
+        )
+        self.client.login(username="engel", password="engel")
+        response = self.client.get("/search.json?q=mate")
+        self.assertCountEqual(
+            [r["kind"] for r in response.json()["results"]],
+            ["order", "order", "product"],
+        )
+
+    def test_page(self):
+        self.client.login(username="engel", password="engel")
+        response = self.client.get("/search?q=mate")
+        self.assertContains(response, f'href="/orders/{self.order.pk}"')
+        self.assertContains(response, 'value="mate"')
@@ -1,10 +1,30 @@
+import csv
+import io
+import json
+import zipfile
+from datetime import timedelta
 from test.support import EnvironmentVarGuard
+from unittest import skipUnless
 
 from django.contrib.auth.models import Permission, User
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import resolve
+from django.utils import timezone
 from squirrel.orders import views
-from squirrel.orders.models import Event, Order, Product, Team, Vendor
+from squirrel.orders.exports import export_cursor, export_since
+from squirrel.orders.models import (
+    Event,
+    Order,
+    Pillage,
+    Product,
+    Purchase,
+    Stockpile,
+    Team,
+    Vendor,
+)
 
 
 class RoutingTests(TestCase):
@@ -502,6 +522,433 @@ class OrderExportViewTests(TestCase):
         response = self.client.get("/orders/export")
         self.assertEqual(response.status_code, 200)
 
+    def export(self):
+        response = self.client.get("/orders/export")
+        self.assertTrue(response.streaming)
+        return list(
+            csv.reader(b"".join(response.streaming_content).decode().splitlines())
+        )
+
+    def test_export_with_prices(self):
+        team = Team.objects.create(name="Bar")
+        event = Event.objects.create(name="36C3")
+        mate = Product.objects.create(name="Mate", unit="crate")
+        Stockpile.objects.create(product=mate, amount=2, unit_price=10000, tax=1.19)
+        purchase = Purchase.objects.create(
+            vendor=Vendor.objects.create(name="Getränke Hoffmann"), is_net=False
+        )
+        Stockpile.objects.create(
+            product=mate, amount=2, unit_price=20000, tax=1.19, purchase=purchase
+        )
+        cold = Order.objects.create(
+            product=mate, amount=3, team=team, event=event, comment="Kalt"
+        )
+        tschunk = Order.objects.create(
+            product=Product.objects.create(name="Tschunk"), team=team
+        )
+
+        self.view_user.user_permissions.add(
+            Permission.objects.get(codename="view_order")
+        )
+        self.client.login(username="exporter", password="exporter")
+        self.assertEqual(
+            self.export(),
+            [
+                [
+                    "Id",
+                    "Amount",
+                    "Unit",
+                    "Item",
+                    "Comment",
+                    "State",
+                    "Unit price",
+                    "Total price",
+                    "Event",
+                    "Team",
+                ],
+                # 2 × 11.90 gross from the stockpile without purchase, 1 × 20.00 gross from the purchase
+                [
+                    str(cold.pk),
+                    "3",
+                    "crate",
+                    "Mate",
+                    "Kalt",
+                    "Requested",
+                    "14.60",
+                    "43.80",
+                    "36C3",
+                    "Bar",
+                ],
+                [
+                    str(tschunk.pk),
+                    "1",
+                    "",
+                    "Tschunk",
+                    "",
+                    "Requested",
+                    "",
+                    "",
+                    "",
+                    "Bar",
+                ],
+            ],
+        )
+
+    def test_export_only_own_teams(self):
+        self.view_user.team_set.add(Team.objects.create(name="Bar"))
+        product = Product.objects.create(name="Mate")
+        Order.objects.create(product=product, team=Team.objects.get(name="Bar"))
+        Order.objects.create(product=product, team=Team.objects.create(name="POC"))
+
+        self.client.login(username="exporter", password="exporter")
+        self.assertEqual([row[-1] for row in self.export()[1:]], ["Bar"])
+
+    def test_export_queries(self):
+        self.view_user.user_permissions.add(
+            Permission.objects.get(codename="view_order")
+        )
+        self.client.login(username="exporter", password="exporter")
+        team = Team.objects.create(name="Bar")
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.export()
+            return len(queries)
+
+        product = Product.objects.create(name="Mate")
+        Order.objects.create(product=product, team=team)
+        self.export()  # Fills the caches
+        few = count_queries()
+        for i in range(10):
+            Order.objects.create(product=product, team=team)
+            Stockpile.objects.create(
+                product=product, amount=1, unit_price=100, tax=1.07
+            )
+        self.assertEqual(count_queries(), few)
+
+
+class StockExportViewTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("engel", password="engel")
+        self.user.user_permissions.add(
+            Permission.objects.get(codename="view_purchase"),
+            Permission.objects.get(codename="view_stockpile"),
+            Permission.objects.get(codename="view_pillage"),
+        )
+        self.client.login(username="engel", password="engel")
+
+        self.team = Team.objects.create(name="Bar")
+        self.event = Event.objects.create(name="36C3")
+        self.mate = Product.objects.create(name="Mate", unit="crate")
+        self.order = Order.objects.create(
+            product=self.mate, amount=3, team=self.team, event=self.event
+        )
+        self.purchase = Purchase.objects.create(
+            vendor=Vendor.objects.create(name="Getränke Hoffmann"),
+            paid=True,
+            payer="Engel",
+        )
+        self.stockpile = Stockpile.objects.create(
+            product=self.mate,
+            amount=5,
+            unit_price=10125,
+            tax=1.19,
+            purchase=self.purchase,
+        )
+
+    def export(self, kind, **params):
+        response = self.client.get(f"/{kind}/export", params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def export_csv(self, kind):
+        return list(csv.reader(self.export(kind).decode().splitlines()))
+
+    def test_permission_required(self):
+        self.user.user_permissions.clear()
+        for kind in ("purchases", "stockpiles", "pillages"):
+            with self.subTest(kind):
+                self.assertEqual(self.client.get(f"/{kind}/export").status_code, 403)
+
+    def test_purchases(self):
+        rows = self.export_csv("purchases")
+        self.assertEqual(rows[0][0], "Id")
+        self.assertEqual(
+            rows[1][:2] + rows[1][3:4] + rows[1][6:],
+            [
+                str(self.purchase.pk),
+                "Getränke Hoffmann",
+                "yes",
+                "Engel",
+                "yes",
+                "50.63",
+                "60.24",
+            ],
+        )
+
+    def test_stockpiles(self):
+        self.assertEqual(
+            self.export_csv("stockpiles")[1],
+            [
+                str(self.stockpile.pk),
+                "Mate",
+                "crate",
+                "5",
+                "2",
+                "10.125",
+                "1.19",
+                str(self.purchase.pk),
+                "Getränke Hoffmann",
+            ],
+        )
+
+    def test_pillages(self):
+        pillage = Pillage.objects.get()
+        self.assertEqual(
+            self.export_csv("pillages")[1],
+            [
+                str(pillage.pk),
+                "3",
+                "yes",
+                str(self.order.pk),
+                "Mate",
+                "Requested",
+                "Bar",
+                "36C3",
+                str(self.stockpile.pk),
+                "Mate",
+                "10.125",
+                str(self.purchase.pk),
+            ],
+        )
+
+    def test_json_lines(self):
+        lines = self.export("stockpiles", format="jsonl").decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(
+            json.loads(lines[0]),
+            {
+                "id": self.stockpile.pk,
+                "item": "Mate",
+                "unit": "crate",
+                "amount": 5,
+                "stock": 2,
+                "unit_price": 10.125,
+                "tax_rate": 1.19,
+                "purchase": self.purchase.pk,
+                "vendor": "Getränke Hoffmann",
+            },
+        )
+
+    def test_xlsx(self):
+        response = self.client.get("/pillages/export", {"format": "xlsx"})
+        self.assertEqual(
+            response["Content-Disposition"],
+            'attachment; filename="squirrel-pillages.xlsx"',
+        )
+        workbook = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertIn(b"<v>10.125</v>", workbook.read("xl/worksheets/sheet1.xml"))
+
+    def test_unknown_format(self):
+        self.assertEqual(
+            self.client.get("/purchases/export", {"format": "pdf"}).status_code, 400
+        )
+
+    def test_queries(self):
+        def count_queries(kind):
+            with CaptureQueriesContext(connection) as queries:
+                self.export(kind)
+            return len(queries)
+
+        self.export("purchases")  # Fills the caches
+        few = {
+            kind: count_queries(kind)
+            for kind in ("purchases", "stockpiles", "pillages")
+        }
+        for i in range(10):
+            Order.objects.create(product=self.mate, team=self.team)
+            purchase = Purchase.objects.create(vendor=self.purchase.vendor)
+            Stockpile.objects.create(
+                product=self.mate, amount=1, unit_price=100, tax=1.07, purchase=purchase
+            )
+        self.assertEqual(Pillage.objects.count(), 11)
+        for kind, queries in few.items():
+            with self.subTest(kind):
+                self.assertEqual(count_queries(kind), queries)
+
+
+class OrderDeltaExportTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("exporter", password="exporter")
+        self.user.user_permissions.add(
+            Permission.objects.get(codename="export_csv"),
+            Permission.objects.get(codename="view_order"),
+        )
+        self.client.login(username="exporter", password="exporter")
+
+        self.team = Team.objects.create(name="Bar")
+        self.product = Product.objects.create(name="Mate")
+        self.old = Order.objects.create(product=self.product, team=self.team)
+        self.changed = Order.objects.create(product=self.product, team=self.team)
+        self.deleted = Order.objects.create(product=self.product, team=self.team)
+        self.deleted_pk = self.deleted.pk
+        Order.objects.update(updated_at=timezone.now() - timedelta(days=1))
+
+    def export(self, **params):
+        response = self.client.get("/orders/export", params)
+        self.assertEqual(response.status_code, 200)
+        rows = list(
+            csv.reader(b"".join(response.streaming_content).decode().splitlines())
+        )
+        return response["X-Export-Cursor"], rows
+
+    def change(self):
+        self.changed.amount = 2
+        self.changed.save()
+        self.deleted.delete()
+
+    def assertDelta(self, rows):
+        self.assertEqual(rows[0][0], "Id")
+        self.assertEqual(rows[0][-1], "Deleted")
+        self.assertEqual(
+            [(int(row[0]), row[1], row[-1]) for row in rows[1:]],
+            [(self.changed.pk, "2", ""), (self.deleted_pk, "", "yes")],
+        )
+
+    def test_since(self):
+        since = timezone.now() - timedelta(hours=1)
+        self.change()
+        self.assertDelta(self.export(since=since.isoformat())[1])
+
+    def test_cursor(self):
+        cursor, rows = self.export()
+        self.assertEqual(len(rows), 4)
+
+        # Changes within CURSOR_OVERLAP before the cursor are exported again, so the cursor is moved back in time
+        cursor = export_cursor(export_since(cursor=cursor) - timedelta(hours=1))
+        self.change()
+        next_cursor, rows = self.export(cursor=cursor)
+        self.assertDelta(rows)
+        self.assertNotEqual(next_cursor, cursor)
+
+    def test_pillages_change_orders(self):
+        since = timezone.now() - timedelta(hours=1)
+        Stockpile.objects.create(
+            product=self.product, amount=1, unit_price=10000, tax=1.19
+        )
+        rows = self.export(since=since.isoformat())[1]
+        self.assertEqual([int(row[0]) for row in rows[1:]], [self.old.pk])
+        self.assertEqual(rows[1][7], "11.90")
+
+    def assertChanged(self, *orders):
+        since = timezone.now() - timedelta(hours=1)
+        rows = self.export(since=since.isoformat())[1]
+        self.assertEqual(
+            [int(row[0]) for row in rows[1:]], sorted(order.pk for order in orders)
+        )
+
+    def pillaged(self, **kwargs):
+        """ A stockpile that filled the old order, with everything marked as changed a day ago """
+        stockpile = Stockpile.objects.create(
+            product=self.product, amount=1, unit_price=10000, tax=1.19, **kwargs
+        )
+        Order.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        return stockpile
+
+    def test_stockpile_prices_change_orders(self):
+        stockpile = self.pillaged()
+        stockpile.comment = "Kalt"
+        stockpile.save()
+        self.assertChanged()
+
+        for field, value in [("unit_price", 12000), ("tax", 1.07)]:
+            Order.objects.update(updated_at=timezone.now() - timedelta(days=1))
+            setattr(stockpile, field, value)
+            stockpile.save()
+            self.assertChanged(self.old)
+
+        Order.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        stockpile.purchase = Purchase.objects.create(
+            vendor=Vendor.objects.create(name="Metro"), is_net=False
+        )
+        stockpile.save()
+        self.assertChanged(self.old)
+
+    def test_purchase_prices_change_orders(self):
+        purchase = Purchase.objects.create(vendor=Vendor.objects.create(name="Metro"))
+        self.pillaged(purchase=purchase)
+        purchase.paid = True
+        purchase.save()
+        self.assertChanged()
+
+        purchase.is_net = False
+        purchase.save()
+        self.assertChanged(self.old)
+
+    def test_names_change_orders(self):
+        event = Event.objects.create(name="36C3")
+        Order.objects.filter(pk=self.old.pk).update(event=event)
+        Order.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        other = Team.objects.create(name="POC")
+        other.name = "NOC"
+        other.save()
+        self.assertChanged()
+
+        for instance, field, value, orders in [
+            (self.product, "unit", "crate", [self.old, self.changed, self.deleted]),
+            (self.team, "name", "Küche", [self.old, self.changed, self.deleted]),
+            (event, "name", "37C3", [self.old]),
+        ]:
+            Order.objects.update(updated_at=timezone.now() - timedelta(days=1))
+            setattr(instance, field, value)
+            instance.save()
+            self.assertChanged(*orders)
+
+    def test_invalid(self):
+        self.assertEqual(
+            self.client.get("/orders/export", {"cursor": "nope"}).status_code, 400
+        )
+        self.assertEqual(
+            self.client.get("/orders/export", {"since": "yesterday"}).status_code, 400
+        )
+
+    @override_settings(DELETED_ORDERS_RETENTION_DAYS=30)
+    def test_too_old(self):
+        since = timezone.now() - timedelta(days=31)
+        response = self.client.get("/orders/export", {"since": since.isoformat()})
+        self.assertContains(response, "Export all orders", status_code=400)
+
+        response = self.client.get("/orders/export", {"cursor": export_cursor(since)})
+        self.assertContains(
+            response,
+            f"{since.isoformat(timespec='seconds')} is too long ago",
+            status_code=400,
+        )
+
+        since = timezone.now() - timedelta(days=29)
+        self.assertEqual(self.export(since=since.isoformat())[1][0][0], "Id")
+
+    def test_only_own_teams(self):
+        self.user.user_permissions.remove(Permission.objects.get(codename="view_order"))
+        self.user.team_set.add(self.team)
+        other = Order.objects.create(
+            product=self.product, team=Team.objects.create(name="POC")
+        )
+        since = timezone.now() - timedelta(hours=1)
+        self.change()
+        other.delete()
+        self.assertDelta(self.export(since=since.isoformat())[1])
+
+    @skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is SQLite")
+    def test_uses_index(self):
+        sql, params = Order.objects.filter(
+            updated_at__gt=timezone.now()
+        ).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            self.assertIn("order_updated_at_idx", cursor.fetchall()[0][-1])
+
 
 class ProductViewTests(TestCase):
     def setUp(self) -> None:
@@ -776,3 +1223,256 @@ class TeamViewTests(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.url, "/teams")
         self.assertEqual(Team.objects.all().count(), 0)
+
+
+class AllocationPreviewViewTests(TestCase):
+    def setUp(self) -> None:
+        self.product = Product.objects.create(name="Club-Mate")
+        self.vendor = Vendor.objects.create(name="Mate Dealer")
+        self.team = Team.objects.create(name="Bar")
+        self.order = Order.objects.create(
+            product=self.product, team=self.team, amount=3
+        )
+
+        self.user = User.objects.create_user("purchasing", password="purchasing")
+        for codename in ("add_stockpile", "view_purchase", "add_purchase"):
+            self.user.user_permissions.add(Permission.objects.get(codename=codename))
+        self.client.login(username="purchasing", password="purchasing")
+
+    def test_stockpile_preview_does_not_save(self):
+        response = self.client.post(
+            "/stockpiles/new",
+            {
+                "product": self.product.id,
+                "amount": 5,
+                "unit_price": 100,
+                "tax": 1.19,
+                "preview": "",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Pillages when saved")
+        self.assertEqual(
+            [(p.order, p.amount) for p in response.context["preview"].data.data],
+            [(self.order, 3)],
+        )
+        self.assertFalse(Stockpile.objects.exists())
+        self.assertFalse(Pillage.objects.exists())
+
+    def test_purchase_preview_does_not_save(self):
+        response = self.client.post(
+            "/purchases/new",
+            {
+                "is_net": True,
+                "vendor": self.vendor.id,
+                "ordered_at": "2020-06-01 12:00",
+                "stockpile_set-TOTAL_FORMS": 1,
+                "stockpile_set-INITIAL_FORMS": 0,
+                "stockpile_set-0-product": self.product.id,
+                "stockpile_set-0-amount": 2,
+                "stockpile_set-0-unit_price": 100,
+                "stockpile_set-0-tax": 1.19,
+                "preview": "",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(p.order, p.amount) for p in response.context["preview"].data.data],
+            [(self.order, 2)],
+        )
+        self.assertFalse(Purchase.objects.exists())
+        self.assertFalse(Pillage.objects.exists())
+
+
+class StockpileListViewTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("engel", password="engel")
+        self.user.user_permissions.add(
+            Permission.objects.get(codename="view_stockpile")
+        )
+        self.client.login(username="engel", password="engel")
+
+        team = Team.objects.create(name="Bar")
+        for name, amount, ordered in (
+            ("Mate", 10, 4),
+            ("Tschunk", 5, 0),
+            ("Beer", 8, 7),
+        ):
+            product = Product.objects.create(name=name)
+            Stockpile.objects.create(
+                product=product, amount=amount, unit_price=100, tax=1.19
+            )
+            if ordered:
+                Order.objects.create(product=product, team=team, amount=ordered)
+
+    def stock_column(self, sort):
+        response = self.client.get("/stockpiles", {"sort": sort})
+        self.assertEqual(response.status_code, 200)
+        return [
+            row.get_cell("stock") for row in response.context["table"].page.object_list
+        ]
+
+    def test_sort_by_stock(self):
+        self.assertEqual(self.stock_column("stock"), [1, 5, 6])
+
+    def test_sort_by_stock_descending(self):
+        self.assertEqual(self.stock_column("-stock"), [6, 5, 1])
+
+
+@override_settings(KEYSET_PAGINATION=True)
+class KeysetPaginationTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("engel", password="engel")
+        self.user.user_permissions.add(Permission.objects.get(codename="view_order"))
+        self.client.login(username="engel", password="engel")
+
+        self.team = Team.objects.create(name="Bar")
+        self.product = Product.objects.create(name="Club-Mate")
+        self.orders = [
+            Order.objects.create(product=self.product, team=self.team, amount=i)
+            for i in range(30)
+        ]
+
+    def page(self, **params):
+        response = self.client.get("/orders", params)
+        self.assertEqual(response.status_code, 200)
+        return (
+            [row.record.pk for row in response.context["table"].rows],
+            response.context["keyset"],
+        )
+
+    def test_first_page_is_newest(self):
+        ids, keyset = self.page()
+        self.assertEqual(ids, [o.pk for o in reversed(self.orders[5:])])
+        self.assertEqual(keyset, {"newer": None, "older": self.orders[5].pk})
+
+    def test_older_page(self):
+        ids, keyset = self.page(after=self.orders[5].pk)
+        self.assertEqual(ids, [o.pk for o in reversed(self.orders[:5])])
+        self.assertEqual(keyset, {"newer": self.orders[4].pk, "older": None})
+
+    def test_newer_page(self):
+        ids, keyset = self.page(before=self.orders[4].pk)
+        self.assertEqual(ids, [o.pk for o in reversed(self.orders[5:])])
+        self.assertEqual(keyset["older"], self.orders[5].pk)
+
+    def test_pages_do_not_shift_on_insert(self):
+        Order.objects.create(product=self.product, team=self.team, amount=1)
+        ids, _ = self.page(after=self.orders[5].pk)
+        self.assertEqual(ids, [o.pk for o in reversed(self.orders[:5])])
+
+    def test_nothing_is_counted(self):
+        with CaptureQueriesContext(connection) as context:
+            self.page(after=self.orders[20].pk)
+        self.assertFalse([q for q in context.captured_queries if "COUNT" in q["sql"]])
+
+
+class OrderListFilterTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("engel", password="engel")
+        self.user.user_permissions.add(Permission.objects.get(codename="view_order"))
+        self.client.login(username="engel", password="engel")
+
+        team = Team.objects.create(name="Bar")
+        product = Product.objects.create(name="Club-Mate")
+        self.approved = Order.objects.create(product=product, team=team, state="APP")
+        Order.objects.create(product=product, team=team, state="REQ")
+
+    def test_filter_by_state(self):
+        response = self.client.get("/orders", {"state": "APP"})
+        self.assertEqual(
+            [row.record for row in response.context["table"].rows], [self.approved]
+        )
+
+    def test_unknown_product(self):
+        response = self.client.get("/orders", {"state": "APP", "product": "Mate"})
+        self.assertEqual(list(response.context["table"].rows), [])
+        self.assertTrue(response.context["filter_form"].errors["product"])
+
+    @override_settings(KEYSET_PAGINATION=True)
+    def test_keyset_pages_keep_filters(self):
+        for _ in range(25):
+            Order.objects.create(
+                product=self.approved.product, team=self.approved.team, state="APP"
+            )
+
+        response = self.client.get("/orders", {"state": "APP"})
+        older = response.context["keyset"]["older"]
+        self.assertContains(response, f"?state=APP&amp;after={older}")
+
+
+class ProductAutocompleteViewTests(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        User.objects.create_user("engel", password="engel")
+        Product.objects.create(name="Club-Mate")
+        Product.objects.create(name="Mate")
+
+    def test_login_required(self):
+        response = self.client.get("/products/autocomplete?q=mate")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response.url, "/accounts/login/?next=/products/autocomplete%3Fq%3Dmate"
+        )
+
+    def test_results(self):
+        self.client.login(username="engel", password="engel")
+        response = self.client.get("/products/autocomplete?q=mate")
+        self.assertEqual(response.json(), {"results": ["Mate", "Club-Mate"]})
+
+
+class EditColumnTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("engel", password="engel")
+        self.user.user_permissions.add(Permission.objects.get(codename="view_vendor"))
+        self.client.login(username="engel", password="engel")
+        self.vendors = [Vendor.objects.create(name=f"Vendor {i}") for i in range(3)]
+
+    def test_hidden_without_permissions(self):
+        response = self.client.get("/vendors")
+        self.assertFalse(response.context["table"].columns["edit"].visible)
+        self.assertNotContains(response, "/vendors/delete/")
+
+    def test_only_permitted_buttons(self):
+        self.user.user_permissions.add(Permission.objects.get(codename="change_vendor"))
+        response = self.client.get("/vendors")
+        for vendor in self.vendors:
+            self.assertContains(response, f'href="/vendors/{vendor.pk}">Edit</a>')
+        self.assertNotContains(response, "/vendors/delete/")
+
+    def test_all_buttons(self):
+        self.user.user_permissions.add(
+            Permission.objects.get(codename="change_vendor"),
+            Permission.objects.get(codename="delete_vendor"),
+        )
+        response = self.client.get("/vendors")
+        for vendor in self.vendors:
+            self.assertContains(response, f'href="/vendors/{vendor.pk}">Edit</a>')
+            self.assertContains(
+                response, f'href="/vendors/delete/{vendor.pk}">Delete</a>'
+            )
+
+    def test_navigation(self):
+        response = self.client.get("/vendors")
+        self.assertContains(response, 'href="/vendors"')
+        self.assertNotContains(response, 'href="/products"')
+
+    def test_superuser(self):
+        User.objects.create_superuser("admin", password="admin")
+        self.client.login(username="admin", password="admin")
+        response = self.client.get("/vendors")
+        self.assertContains(response, f'href="/vendors/delete/{self.vendors[0].pk}"')
+        self.assertContains(response, 'href="/products"')
+
+
+class PillageListTests(TestCase):
+    def test_columns(self):
+        user = User.objects.create_user("engel", password="engel")
+        user.user_permissions.add(Permission.objects.get(codename="view_pillage"))
+        self.client.login(username="engel", password="engel")
+
+        response = self.client.get("/pillages")
+        self.assertEqual(
+            [column.name for column in response.context["table"].columns][:6],
+            ["id", "amount", "order", "team", "stockpile", "automatic"],
+        )